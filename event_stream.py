@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""event_stream.py
+Live event stream (Server-Sent Events for /api/stream) shared by the MQTT bridge and the debug web viewer.
+
+Every event is serialized once into an SSE frame and appended to one backlog shared by all
+clients; each client only remembers the last event id it has sent. A slow client never holds up
+polling or other clients: once it falls behind the backlog it is resynced with a fresh snapshot
+instead of being buffered per client.
+"""
+
+import json
+import threading
+import itertools
+import collections
+
+class EventStream:
+    """Backlog of SSE frames for one process; `meter` is None for a single meter."""
+
+    def __init__(self, backlog=100, keepalive=15):
+        self.keepalive = keepalive
+        self.cond = threading.Condition()
+        self.frames = collections.deque(maxlen=max(1, backlog))  # (event_id, meter, frame)
+        self.last_id = 0
+        self.state = {}      # meter -> {"timestamp", "connection_status", "registers"}
+        self.snapshots = {}  # meter -> cached snapshot frame, dropped on every change
+        self.clients = 0
+
+    def _frame(self, event, event_id, data):
+        body = json.dumps(data, separators=(",", ":"))
+        return f"id: {event_id}\nevent: {event}\ndata: {body}\n\n".encode("utf-8")
+
+    def _append(self, meter, event, data):
+        self.last_id += 1
+        self.frames.append((self.last_id, meter, self._frame(event, self.last_id, data)))
+        self.snapshots.pop(meter, None)
+        self.cond.notify_all()
+
+    def publish(self, meter, timestamp, registers):
+        """Queue a delta event with the registers that changed since the last event of this meter"""
+        with self.cond:
+            state = self.state.setdefault(meter, {"timestamp": None, "connection_status": None, "registers": {}})
+            previous = state["registers"]
+            changed = {name: data for name, data in registers.items() if previous.get(name) != data}
+            state["timestamp"] = timestamp
+            state["registers"] = registers
+            if changed:
+                self._append(meter, "delta", {"meter": meter, "timestamp": timestamp,
+                                              "connection_status": state["connection_status"], "registers": changed})
+
+    def publish_status(self, meter, status):
+        with self.cond:
+            state = self.state.setdefault(meter, {"timestamp": None, "connection_status": None, "registers": {}})
+            if state["connection_status"] != status:
+                state["connection_status"] = status
+                self._append(meter, "status", {"meter": meter, "connection_status": status})
+
+    def _snapshot_frames(self, meter_filter):
+        frames = []
+        for meter, state in self.state.items():
+            if meter_filter is not None and meter != meter_filter:
+                continue
+            frame = self.snapshots.get(meter)
+            if frame is None:
+                frame = self.snapshots[meter] = self._frame("snapshot", self.last_id, dict(state, meter=meter))
+            frames.append(frame)
+        return frames
+
+    def subscribe(self, meter_filter=None):
+        """Generator of SSE frames for one client"""
+        with self.cond:
+            pending = self._snapshot_frames(meter_filter)
+            sent = self.last_id
+            self.clients += 1
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                for frame in pending:
+                    yield frame
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.last_id > sent, timeout=self.keepalive):
+                        pending = [b": keepalive\n\n"]
+                        continue
+                    oldest = self.frames[0][0]
+                    if sent + 1 < oldest:
+                        # fell behind the backlog: skip the missed deltas, resync from a snapshot
+                        pending = self._snapshot_frames(meter_filter)
+                    else:
+                        pending = [frame for _, meter, frame in itertools.islice(self.frames, sent + 1 - oldest, None)
+                                   if meter_filter is None or meter == meter_filter]
+                    sent = self.last_id
+        finally:
+            with self.cond:
+                self.clients -= 1
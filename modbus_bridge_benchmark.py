@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""modbus_bridge_benchmark.py
+End-to-end benchmark of modbus_mqtt_bridge.py: runs the bridge as a subprocess in fleet mode
+against simulated meters (modbus_meter_simulator.py) and a minimal MQTT stand-in broker,
+both hosted by this process, and measures per run:
+  cycles/s, registers/s and Modbus requests/s
+  cycle latency (poll cycle duration reported by the bridge in /api/stats)
+  sample-to-publish latency (last response of a cycle to its snapshot arriving at the broker)
+  CPU of the bridge process per meter, RSS and peak RSS
+Results are written as JSON, runs can be compared with those of another commit (--compare).
+
+Examples:
+  python modbus_bridge_benchmark.py --meters 1,10,100 --output bench.json
+  python modbus_bridge_benchmark.py --meters 50 --strategies block,single --formats json,packed
+  python modbus_bridge_benchmark.py --meters 1,10,100 --output new.json --compare bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+import urllib.request
+from types import SimpleNamespace
+
+from modbus_meter_simulator import VirtualMeter, MeterServer, Faults, SimulatorStats
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("modbus-benchmark")
+
+BRIDGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modbus_mqtt_bridge.py")
+TOPIC_PREFIX = "bench"
+
+# Read strategies: bridge environment per strategy name
+STRATEGIES = {
+    "block": {},                          # one request for the whole map
+    "split": {"READ_MAX_WORDS": "32"},    # a few medium sized requests
+    "single": {"READ_MAX_WORDS": "1"},    # one request per register
+}
+PAYLOAD_FORMATS = ("json", "msgpack", "cbor", "packed")
+
+# Numbers compared by --compare, (key, label, higher is better)
+COMPARED = [
+    ("registers_per_s", "registers/s", True),
+    ("cycle_p99", "cycle p99", False),
+    ("sample_to_publish_p99", "s2p p99", False),
+    ("cpu_percent_per_meter", "CPU%/meter", False),
+    ("rss_mb", "RSS MB", False),
+]
+
+# ----------------------------
+# Measurement: meters report requests, the broker reports arriving snapshots
+# ----------------------------
+def percentiles(samples):
+    # same summary as the bridge's /api/stats; importing the bridge would start its MQTT client and servers
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+    last = len(ordered) - 1
+    result = {"count": len(ordered)}
+    for p in (50, 90, 99):
+        result[f"p{p}"] = round(ordered[last * p // 100], 4)
+    result["max"] = round(ordered[last], 4)
+    return result
+
+class Recorder:
+    def __init__(self):
+        self.cycle_open = set()
+        self.last_response = {}
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.registers = 0
+        self.snapshots = 0
+        self.messages = 0
+        self.payload_bytes = 0
+        self.latencies = []
+
+    def response(self, meter):
+        self.cycle_open.add(meter)
+        self.last_response[meter] = time.monotonic()
+        self.requests += 1
+
+    def message(self, topic, payload):
+        now = time.monotonic()
+        self.messages += 1
+        self.payload_bytes += len(payload)
+        parts = topic.split("/")
+        if len(parts) != 3 or parts[2] == "schema":
+            return
+        if parts[2] != "snapshot":
+            self.registers += 1
+            return
+        meter = parts[1]
+        if meter in self.cycle_open:
+            self.cycle_open.discard(meter)
+            self.snapshots += 1
+            self.latencies.append(now - self.last_response[meter])
+
+class RecordingMeterServer(MeterServer):
+    def __init__(self, name, recorder, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+        self.recorder = recorder
+
+    def respond(self, unit_id, pdu):
+        response = super().respond(unit_id, pdu)
+        self.recorder.response(self.name)
+        return response
+
+# ----------------------------
+# MQTT stand-in: accepts any client, acknowledges everything, keeps nothing
+# ----------------------------
+class MqttStandIn:
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                first = (await reader.readexactly(1))[0]
+                length, shift = 0, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                packet_type = first >> 4
+                if packet_type == 1:  # CONNECT
+                    writer.write(b"\x20\x02\x00\x00")
+                elif packet_type == 3:  # PUBLISH
+                    qos = (first >> 1) & 0x03
+                    topic_length = struct.unpack_from(">H", body)[0]
+                    topic = body[2:2 + topic_length].decode("utf-8")
+                    offset = 2 + topic_length
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        writer.write((b"\x40\x02" if qos == 1 else b"\x50\x02") + packet_id)
+                    self.recorder.message(topic, body[offset:])
+                elif packet_type == 6:  # PUBREL
+                    writer.write(b"\x70\x02" + body[:2])
+                elif packet_type == 8:  # SUBSCRIBE: grant QoS 0 for every filter
+                    filters, offset = 0, 2
+                    while offset < len(body):
+                        offset += 2 + struct.unpack_from(">H", body, offset)[0] + 1
+                        filters += 1
+                    writer.write(bytes((0x90, 2 + filters)) + body[:2] + b"\x00" * filters)
+                elif packet_type == 12:  # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif packet_type == 14:  # DISCONNECT
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+# ----------------------------
+# Bridge process
+# ----------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def meter_address(index, args):
+    """Own loopback address per meter (like separate devices), or one host with consecutive ports"""
+    if args.shared_host:
+        return "127.0.0.1", args.base_port + index
+    return f"127.0.{1 + index // 250}.{1 + index % 250}", args.base_port
+
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def process_memory_mb(pid):
+    memory = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                memory[line[:5]] = int(line.split()[1]) / 1024.0
+    return memory.get("VmRSS"), memory.get("VmHWM")
+
+def bridge_stats(api_port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{api_port}/api/stats", timeout=5) as response:
+            return json.load(response)
+    except OSError:
+        return None
+
+def cycle_percentiles(stats):
+    """Median of the per-meter p50 and worst per-meter p99 of the cycle duration"""
+    cycles = [m["cycle_seconds"] for m in stats.get("meters", {}).values() if m["cycle_seconds"]["count"]]
+    if not cycles:
+        return None, None
+    p50 = sorted(c["p50"] for c in cycles)
+    return p50[len(p50) // 2], max(c["p99"] for c in cycles)
+
+async def run_case(meters, strategy, payload_format, args, workdir):
+    recorder = Recorder()
+    faults = Faults(SimpleNamespace(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, timeout_rate=0.0,
+                                    exception_rate=0.0, exception_code=0, disconnect_rate=0.0, seed=args.seed))
+    stats = SimulatorStats()
+    servers, fleet = [], []
+    for index in range(meters):
+        name = f"m{index + 1:04d}"
+        host, port = meter_address(index, args)
+        handler = RecordingMeterServer(name, recorder, port, {1: VirtualMeter(index, seed=args.seed)}, faults, stats)
+        servers.append(await asyncio.start_server(handler.handle_connection, host, port))
+        fleet.append({"name": name, "host": host, "port": port, "unit_id": 1})
+    broker_port = free_port()
+    servers.append(await asyncio.start_server(MqttStandIn(recorder).handle_connection, "127.0.0.1", broker_port))
+
+    meters_file = os.path.join(workdir, "meters.json")
+    with open(meters_file, "w", encoding="utf-8") as f:
+        json.dump(fleet, f)
+    api_port = free_port()
+    env = dict(os.environ, METERS_FILE=meters_file, MQTT_HOST="127.0.0.1", MQTT_PORT=str(broker_port),
+               MQTT_TOPIC_PREFIX=TOPIC_PREFIX, PAYLOAD_FORMAT=payload_format, INTERVAL=str(args.interval),
+               API_PORT=str(api_port), PROMETHEUS_PORT=str(free_port()), LOG_LEVEL="WARNING",
+               STATS_WINDOW=str(max(1, int(args.duration / args.interval))),  # percentiles cover the measured window
+               **STRATEGIES[strategy])
+    env.update(item.split("=", 1) for item in args.env)
+    log_path = os.path.join(workdir, f"bridge-{meters}-{strategy}-{payload_format}.log")
+    with open(log_path, "wb") as bridge_log:
+        bridge = subprocess.Popen([sys.executable, BRIDGE], env=env, stdout=bridge_log, stderr=subprocess.STDOUT)
+    try:
+        started = time.monotonic()
+        while bridge_stats(api_port) is None:
+            if bridge.poll() is not None or time.monotonic() - started > 30:
+                raise RuntimeError(f"Bridge did not start, see {log_path}")
+            await asyncio.sleep(0.2)
+        await asyncio.sleep(args.warmup)
+
+        recorder.reset()
+        cpu_before, harness_before = process_cpu_seconds(bridge.pid), time.process_time()
+        window_start = time.monotonic()
+        await asyncio.sleep(args.duration)
+        elapsed = time.monotonic() - window_start
+        cpu = process_cpu_seconds(bridge.pid) - cpu_before
+        harness_cpu = time.process_time() - harness_before
+        rss, rss_peak = process_memory_mb(bridge.pid)
+        cycle_p50, cycle_p99 = cycle_percentiles(bridge_stats(api_port) or {})
+        if bridge.poll() is not None:
+            raise RuntimeError(f"Bridge exited during the run, see {log_path}")
+    finally:
+        bridge.terminate()
+        try:
+            bridge.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            bridge.kill()
+        for server in servers:
+            server.close()
+        await asyncio.sleep(0.5)  # let the connection handlers see the bridge disconnect
+
+    latencies = percentiles(recorder.latencies)
+    return {
+        "meters": meters,
+        "strategy": strategy,
+        "format": payload_format,
+        "interval": args.interval,
+        "duration": round(elapsed, 3),
+        "expected_cycles_per_s": round(meters / args.interval, 3),
+        "cycles_per_s": round(recorder.snapshots / elapsed, 3),
+        "registers_per_s": round(recorder.registers / elapsed, 1),
+        "modbus_requests_per_s": round(recorder.requests / elapsed, 1),
+        "mqtt_messages_per_s": round(recorder.messages / elapsed, 1),
+        "mqtt_bytes_per_s": round(recorder.payload_bytes / elapsed),
+        "cycle_p50": cycle_p50,
+        "cycle_p99": cycle_p99,
+        "sample_to_publish_p50": latencies.get("p50"),
+        "sample_to_publish_p99": latencies.get("p99"),
+        "cpu_percent": round(100.0 * cpu / elapsed, 2),
+        "cpu_percent_per_meter": round(100.0 * cpu / elapsed / meters, 3),
+        "rss_mb": round(rss, 1),
+        "rss_peak_mb": round(rss_peak, 1),
+        "harness_cpu_percent": round(100.0 * harness_cpu / elapsed, 2),
+    }
+
+# ----------------------------
+# Reporting
+# ----------------------------
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(BRIDGE),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "started": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+def run_key(run):
+    return run["meters"], run["strategy"], run["format"], run["interval"]
+
+def print_runs(runs):
+    print(f"{'meters':>6} {'strategy':<8} {'format':<8} {'cycles/s':>9} {'regs/s':>9} {'cycle p50/p99 ms':>17} "
+          f"{'s2p p50/p99 ms':>15} {'CPU%/meter':>10} {'RSS MB':>7}")
+    for r in runs:
+        ms = lambda v: "-" if v is None else f"{v * 1000:.1f}"
+        print(f"{r['meters']:>6} {r['strategy']:<8} {r['format']:<8} {r['cycles_per_s']:>9} {r['registers_per_s']:>9} "
+              f"{ms(r['cycle_p50']) + '/' + ms(r['cycle_p99']):>17} "
+              f"{ms(r['sample_to_publish_p50']) + '/' + ms(r['sample_to_publish_p99']):>15} "
+              f"{r['cpu_percent_per_meter']:>10} {r['rss_mb']:>7}")
+
+def print_comparison(runs, baseline):
+    print(f"\nChange against {baseline['environment'].get('commit')} (positive = better):")
+    before = {run_key(r): r for r in baseline["runs"]}
+    for run in runs:
+        old = before.get(run_key(run))
+        if old is None:
+            continue
+        changes = []
+        for key, label, higher_better in COMPARED:
+            if run.get(key) is None or not old.get(key):
+                continue
+            change = 100.0 * (run[key] - old[key]) / old[key]
+            changes.append(f"{label} {change if higher_better else -change:+.1f}%")
+        print(f"  {run['meters']:>5} {run['strategy']:<8} {run['format']:<8} " + ", ".join(changes))
+
+async def run_all(args):
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="bridge-bench-") as workdir:
+        for meters, strategy, payload_format in itertools.product(args.meters, args.strategies, args.formats):
+            log.info("Run: %d meter(s), strategy %s, format %s", meters, strategy, payload_format)
+            runs.append(await run_case(meters, strategy, payload_format, args, workdir))
+    return runs
+
+def csv_list(convert=str, choices=None):
+    def parse(value):
+        items = [convert(v.strip()) for v in value.split(",") if v.strip()]
+        unknown = [item for item in items if choices and item not in choices]
+        if unknown:
+            raise argparse.ArgumentTypeError(f"unknown value(s) {unknown}, choose from {', '.join(choices)}")
+        return items
+    return parse
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the Modbus -> MQTT bridge")
+    parser.add_argument("--meters", type=csv_list(int), default=[1, 10, 100], help="meter counts (default: 1,10,100)")
+    parser.add_argument("--strategies", type=csv_list(choices=STRATEGIES), default=["block"],
+                        help=f"read strategies: {', '.join(STRATEGIES)} (default: block)")
+    parser.add_argument("--formats", type=csv_list(choices=PAYLOAD_FORMATS), default=["json"],
+                        help=f"payload formats: {', '.join(PAYLOAD_FORMATS)} (default: json)")
+    parser.add_argument("--interval", type=int, default=1, help="INTERVAL of the bridge in seconds (default: 1)")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds per run (default: 30)")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds before measuring (default: 5)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated meter response time")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="+- random part of the response time")
+    parser.add_argument("--base-port", type=int, default=5020, help="Modbus port of the simulated meters (default: 5020)")
+    parser.add_argument("--shared-host", action="store_true",
+                        help="all meters on 127.0.0.1 with consecutive ports instead of one loopback address each")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra bridge environment for every run (repeatable)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the simulated meters")
+    parser.add_argument("--output", metavar="PATH", help="write results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="JSON results of an earlier run to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = {"environment": environment(), "runs": asyncio.run(run_all(args))}
+    print_runs(result["runs"])
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(result["runs"], json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        log.info("Results written to %s", args.output)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
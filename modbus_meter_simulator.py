@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""modbus_meter_simulator.py
+Simulates Telstar meters over Modbus TCP for load and soak tests without hardware.
+Serves the built-in register map of register_map.py (0x2000 .. 0x205F) with evolving values
+and can inject latency, timeouts, exception responses and disconnects.
+
+Examples:
+  python modbus_meter_simulator.py                                  # one meter on 127.0.0.1:5020
+  python modbus_meter_simulator.py --meters 200 --write-meters meters.json
+  python modbus_meter_simulator.py --units 16 --latency-ms 30 --timeout-rate 0.01
+"""
+
+import sys
+import math
+import time
+import json
+import random
+import struct
+import asyncio
+import logging
+import argparse
+
+from register_map import REGISTERS, VALUE_FORMATS
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("modbus-simulator")
+
+MAP_START = min(entry[0] for entry in REGISTERS)
+MAP_WORDS = max(entry[0] + entry[3] // 2 for entry in REGISTERS) - MAP_START
+
+MBAP = struct.Struct(">HHHB")  # transaction id, protocol id, length, unit id
+READ_REQUEST = struct.Struct(">BHH")  # function code, start address, word count
+
+# Modbus exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_ADDRESS = 0x02
+ILLEGAL_VALUE = 0x03
+SERVER_BUSY = 0x06
+GATEWAY_TARGET_FAILED = 0x0B
+
+# ----------------------------
+# Virtual meter: physically plausible values, evaluated at request time
+# ----------------------------
+class VirtualMeter:
+    """One simulated meter.
+
+    Power per phase follows a slow load curve plus noise (optionally minus PV generation at
+    daytime), voltage wanders around 230 V, current and power factor are derived from it.
+    Energy counters integrate the power between two requests, so they only ever increase;
+    registers are encoded modulo their width, so uint32 Wh counters wrap like on a real meter.
+    """
+
+    def __init__(self, index, seed=0, pv=False, wrap_in_wh=None):
+        self.rng = random.Random(seed * 100003 + index)
+        self.serial = 80000000 + index
+        self.base = [self.rng.uniform(100.0, 1500.0) for _ in range(3)]
+        self.shift = [self.rng.uniform(0.0, 2 * math.pi) for _ in range(3)]
+        self.period = self.rng.uniform(300.0, 3600.0)
+        self.tan_phi = self.rng.uniform(0.1, 0.45)
+        self.pv_peak = self.rng.uniform(3000.0, 10000.0) if pv else 0.0
+        # energy in Wh: import/export per tariff, reactive energy per quadrant
+        if wrap_in_wh:
+            self.energy = {("import", 1): 2 ** 32 - wrap_in_wh, ("import", 2): 0.0, ("export", 1): 0.0, ("export", 2): 0.0}
+            self.reactive = [2 ** 32 - wrap_in_wh, 0.0, 0.0, 0.0]
+        else:
+            start = self.rng.uniform(1e5, 5e6)
+            self.energy = {("import", 1): start, ("import", 2): start / 3, ("export", 1): start / 10, ("export", 2): 0.0}
+            self.reactive = [start / 5, start / 20, 0.0, start / 50]
+        self.updated = time.time()
+        self.words = None
+
+    def _powers(self, now):
+        pv = 0.0
+        if self.pv_peak:
+            hour = time.localtime(now).tm_hour + time.localtime(now).tm_min / 60.0
+            pv = self.pv_peak * max(0.0, math.sin(math.pi * (hour - 6.0) / 12.0)) / 3.0
+        powers = []
+        for base, shift in zip(self.base, self.shift):
+            load = base * (1.0 + 0.4 * math.sin(2 * math.pi * now / self.period + shift))
+            powers.append(load * self.rng.gauss(1.0, 0.05) - pv)
+        return powers
+
+    def update(self, now):
+        dt = max(0.0, now - self.updated)
+        self.updated = now
+        tariff = 1 if 6 <= time.localtime(now).tm_hour < 22 else 2
+        powers = self._powers(now)
+        voltages = [230.0 + 3.0 * math.sin(now / 97.0 + i) + self.rng.gauss(0.0, 0.4) for i in range(3)]
+        reactive = [abs(p) * self.tan_phi for p in powers]
+        total = sum(powers)
+        direction = "import" if total >= 0 else "export"
+        self.energy[(direction, tariff)] += abs(total) * dt / 3600.0
+        self.reactive[0 if total >= 0 else 1] += sum(reactive) * dt / 3600.0
+
+        e = self.energy
+        values = {
+            "serial_number": self.serial,
+            "date_time_utc": int(now),
+            "active_power_total_mW": total * 1000,
+            "reactive_power_total_mVar": sum(reactive) * 1000,
+            "active_tariff": tariff,
+            "active_energy_import_total_mWh": (e[("import", 1)] + e[("import", 2)]) * 1000,
+            "active_energy_export_total_mWh": (e[("export", 1)] + e[("export", 2)]) * 1000,
+            "active_energy_import_total_Wh": e[("import", 1)] + e[("import", 2)],
+            "active_energy_export_total_Wh": e[("export", 1)] + e[("export", 2)],
+        }
+        for i, phase in enumerate(("l1", "l2", "l3")):
+            values[f"active_power_{phase}_mW"] = powers[i] * 1000
+            values[f"reactive_power_{phase}_mVar"] = reactive[i] * 1000
+            values[f"voltage_{phase}_mV"] = voltages[i] * 1000
+            values[f"current_{phase}_mA"] = powers[i] / voltages[i] * 1000
+            values[f"power_factor_{phase}_raw"] = 1000 * abs(powers[i]) / math.hypot(powers[i], reactive[i])
+        for direction in ("import", "export"):
+            for tariff_no in (1, 2):
+                values[f"active_energy_{direction}_t{tariff_no}_mWh"] = e[(direction, tariff_no)] * 1000
+                values[f"active_energy_{direction}_t{tariff_no}_Wh"] = e[(direction, tariff_no)]
+        for q in range(4):
+            values[f"reactive_energy_q{q + 1}_mVarh"] = self.reactive[q] * 1000
+            values[f"reactive_energy_q{q + 1}_Varh"] = self.reactive[q]
+        self.words = encode_registers(values)
+        return self.words
+
+def encode_registers(values):
+    """Big endian words of the whole map; values are wrapped to the register width"""
+    data = bytearray(MAP_WORDS * 2)
+    for address, name, unit, size_bytes, signed in (entry[:5] for entry in REGISTERS):
+        raw = int(round(values.get(name, 0))) & ((1 << (size_bytes * 8)) - 1)
+        struct.pack_into(">" + VALUE_FORMATS[(size_bytes, False)], data, (address - MAP_START) * 2, raw)
+    return data
+
+# ----------------------------
+# Modbus TCP server with fault injection
+# ----------------------------
+class Faults:
+    def __init__(self, args):
+        self.latency = args.latency_ms / 1000.0
+        self.jitter = args.jitter_ms / 1000.0
+        self.timeout_rate = args.timeout_rate
+        self.exception_rate = args.exception_rate
+        self.exception_code = args.exception_code
+        self.disconnect_rate = args.disconnect_rate
+        self.rng = random.Random(args.seed)
+
+    def pick(self):
+        """None (answer normally), "disconnect", "timeout" or "exception" for one request"""
+        r = self.rng.random()
+        for fault, rate in (("disconnect", self.disconnect_rate), ("timeout", self.timeout_rate),
+                            ("exception", self.exception_rate)):
+            if r < rate:
+                return fault
+            r -= rate
+        return None
+
+    def delay(self):
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+class SimulatorStats:
+    def __init__(self):
+        self.requests = 0
+        self.faults = {"disconnect": 0, "timeout": 0, "exception": 0}
+        self.connections = 0
+
+class MeterServer:
+    """Modbus TCP endpoint for one port, serving one or more unit IDs.
+
+    A port with a single meter answers any unit ID, like most meters with a TCP interface;
+    with several units it behaves like a gateway and rejects unknown unit IDs. Requests of
+    one connection are answered in order (--concurrent answers them as they complete,
+    which exercises transaction id matching of pipelining clients).
+    """
+
+    def __init__(self, port, meters, faults, stats, address_offset=0, concurrent=False):
+        self.port = port
+        self.meters = meters  # unit id -> VirtualMeter
+        self.faults = faults
+        self.stats = stats
+        self.address_offset = address_offset
+        self.concurrent = concurrent
+
+    def meter(self, unit_id):
+        if len(self.meters) == 1:
+            return next(iter(self.meters.values()))
+        return self.meters.get(unit_id)
+
+    def respond(self, unit_id, pdu):
+        function = pdu[0]
+        if function not in (0x03, 0x04) or len(pdu) != READ_REQUEST.size:
+            return bytes((function | 0x80, ILLEGAL_FUNCTION))
+        _, address, count = READ_REQUEST.unpack(pdu)
+        meter = self.meter(unit_id)
+        if meter is None:
+            return bytes((function | 0x80, GATEWAY_TARGET_FAILED))
+        if not 1 <= count <= 125:
+            return bytes((function | 0x80, ILLEGAL_VALUE))
+        offset = address - self.address_offset - MAP_START
+        if offset < 0 or offset + count > MAP_WORDS:
+            return bytes((function | 0x80, ILLEGAL_ADDRESS))
+        words = meter.update(time.time())
+        return bytes((function, count * 2)) + bytes(words[offset * 2:(offset + count) * 2])
+
+    async def handle_request(self, writer, header, pdu):
+        tid, pid, _, unit_id = header
+        self.stats.requests += 1
+        fault = self.faults.pick()
+        if fault:
+            self.stats.faults[fault] += 1
+        if fault == "disconnect":
+            writer.close()
+            return
+        delay = self.faults.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if fault == "timeout":
+            return
+        if fault == "exception":
+            response = bytes((pdu[0] | 0x80, self.faults.exception_code))
+        else:
+            response = self.respond(unit_id, pdu)
+        if not writer.is_closing():
+            writer.write(MBAP.pack(tid, pid, len(response) + 1, unit_id) + response)
+
+    async def handle_connection(self, reader, writer):
+        self.stats.connections += 1
+        tasks = set()
+        try:
+            while True:
+                header = MBAP.unpack(await reader.readexactly(MBAP.size))
+                pdu = await reader.readexactly(header[2] - 1)
+                if self.concurrent:
+                    task = asyncio.create_task(self.handle_request(writer, header, pdu))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    await self.handle_request(writer, header, pdu)
+                if writer.is_closing():
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.stats.connections -= 1
+            writer.close()
+
+async def report_loop(stats, interval):
+    last = 0
+    while True:
+        await asyncio.sleep(interval)
+        log.info("%.1f requests/s, %d connection(s), faults: %s",
+                 (stats.requests - last) / interval, stats.connections, stats.faults)
+        last = stats.requests
+
+async def serve(args):
+    faults = Faults(args)
+    stats = SimulatorStats()
+    servers = []
+    fleet = []
+    index = 0
+    for port in range(args.base_port, args.base_port + args.meters):
+        meters = {}
+        for unit_id in range(1, args.units + 1):
+            meters[unit_id] = VirtualMeter(index, seed=args.seed, pv=index < args.pv_meters, wrap_in_wh=args.wrap_in_wh)
+            fleet.append({"name": f"sim-{index + 1:03d}", "host": args.host, "port": port, "unit_id": unit_id})
+            index += 1
+        handler = MeterServer(port, meters, faults, stats, args.address_offset, args.concurrent)
+        servers.append(await asyncio.start_server(handler.handle_connection, args.host, port))
+    if args.write_meters:
+        with open(args.write_meters, "w", encoding="utf-8") as f:
+            json.dump(fleet, f, indent=2)
+        log.info("Wrote fleet definition for METERS_FILE to %s", args.write_meters)
+    log.info("Simulating %d meter(s) on %s:%d-%d (%d unit(s) per port)",
+             index, args.host, args.base_port, args.base_port + args.meters - 1, args.units)
+    if args.report:
+        asyncio.create_task(report_loop(stats, args.report))
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated Telstar meters over Modbus TCP")
+    parser.add_argument("--host", default="127.0.0.1", help="listen address (default: 127.0.0.1)")
+    parser.add_argument("--base-port", type=int, default=5020, help="first TCP port (default: 5020)")
+    parser.add_argument("--meters", type=int, default=1, help="number of ports, one after another (default: 1)")
+    parser.add_argument("--units", type=int, default=1, help="unit IDs 1..N per port, like a gateway (default: 1)")
+    parser.add_argument("--address-offset", type=int, default=0, help="same as MODBUS_ADDRESS_OFFSET of the bridge")
+    parser.add_argument("--pv-meters", type=int, default=0, help="number of meters with PV generation (export)")
+    parser.add_argument("--wrap-in-wh", type=float, default=None,
+                        help="start the 32 bit Wh counters this many Wh before they wrap")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="response delay per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="+- random part of the delay")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="share of requests never answered")
+    parser.add_argument("--exception-rate", type=float, default=0.0, help="share of requests answered with an exception")
+    parser.add_argument("--exception-code", type=int, default=SERVER_BUSY, help="exception code (default: 6, busy)")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="share of requests that close the connection")
+    parser.add_argument("--concurrent", action="store_true", help="answer requests of one connection concurrently")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for reproducible runs")
+    parser.add_argument("--write-meters", metavar="PATH", help="write a METERS_FILE for the bridge's fleet mode")
+    parser.add_argument("--report", type=float, default=10.0, help="seconds between statistics lines (0 = off)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        log.info("Stopping simulator")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
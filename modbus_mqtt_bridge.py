@@ -6,15 +6,64 @@ Also exposes Prometheus metrics on /metrics.
 """
 
 import os
+import io
+import sys
+import ast
+import re
 import time
 import json
+import math
+import random
+import zlib
+import struct
+import fnmatch
+import bisect
+import queue
+import socket
+import socketserver
+import signal
+import atexit
+import sqlite3
+import collections
+from array import array
+import asyncio
+import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
 import logging
 import threading
+import itertools
 from datetime import datetime
 from pymodbus.client import ModbusTcpClient
+from pymodbus.exceptions import ModbusIOException, ConnectionException
+from pymodbus.pdu import ExceptionResponse
 import paho.mqtt.client as mqtt
-from prometheus_client import start_http_server, Gauge
-from flask import Flask, jsonify
+from prometheus_client import start_http_server, generate_latest, CONTENT_TYPE_LATEST, Gauge, Counter, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from flask import Flask, Response, jsonify, request
+import register_map
+from event_stream import EventStream
+from register_map import BUILTIN_MAP, scaling, compile_codec, decode_block, load_profile
+
+# Optional binary payload formats (PAYLOAD_FORMAT=msgpack / cbor)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+# Optional: vectorized downsampling for /api/history
+try:
+    import numpy as np
+except ImportError:
+    np = None
+# Optional: ASGI server for RUNTIME=asyncio
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
 
 # ----------------------------
 # Config from env
@@ -25,6 +74,30 @@ MODBUS_UNIT_ID = int(os.getenv("MODBUS_UNIT_ID", "1"))
 # If your device expects an offset (e.g. address base 40001), set MODBUS_ADDRESS_OFFSET to -40001 or similar.
 # Default 0 assumes addresses from PDF (hex like 0x2000) are usable directly.
 MODBUS_ADDRESS_OFFSET = int(os.getenv("MODBUS_ADDRESS_OFFSET", "0"))
+# Block reads: registers are coalesced into as few read_holding_registers calls as possible.
+# READ_MAX_GAP = unused words allowed between two entries of one block (0 = strictly contiguous)
+# READ_MAX_WORDS = upper bound per request (Modbus FC03 allows at most 125 words)
+READ_MAX_GAP = int(os.getenv("READ_MAX_GAP", "0"))
+READ_MAX_WORDS = min(int(os.getenv("READ_MAX_WORDS", "125")), 125)
+# JSON/YAML register profile (see README); empty = built-in Telstar 80A map
+REGISTER_PROFILE = os.getenv("REGISTER_PROFILE", "")
+# Seconds between checks for changed profile files (0 = reload on SIGHUP only)
+PROFILE_WATCH_INTERVAL = float(os.getenv("PROFILE_WATCH_INTERVAL", "5"))
+# Request timeouts adapt to the meter: p99 of the recent round-trip times * MODBUS_TIMEOUT_FACTOR,
+# clamped to MODBUS_TIMEOUT_MIN..MODBUS_TIMEOUT (MODBUS_TIMEOUT is also the connect timeout)
+MODBUS_TIMEOUT = float(os.getenv("MODBUS_TIMEOUT", "5"))
+MODBUS_TIMEOUT_MIN = float(os.getenv("MODBUS_TIMEOUT_MIN", "0.5"))
+MODBUS_TIMEOUT_FACTOR = float(os.getenv("MODBUS_TIMEOUT_FACTOR", "3"))
+# Retries of a single request inside pymodbus (0 = fail fast, the next cycle retries)
+MODBUS_RETRIES = int(os.getenv("MODBUS_RETRIES", "0"))
+# Time budget of one poll cycle in seconds (0 = the shortest interval of the polled groups)
+CYCLE_DEADLINE = float(os.getenv("CYCLE_DEADLINE", "0"))
+# Failed requests in a row after which the rest of a cycle is skipped
+CYCLE_MAX_FAILURES = int(os.getenv("CYCLE_MAX_FAILURES", "3"))
+# Circuit breaker: failed cycles in a row until a meter is paused, pause doubling from min to max seconds
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "3"))
+BREAKER_BACKOFF_MIN = float(os.getenv("BREAKER_BACKOFF_MIN", "5"))
+BREAKER_BACKOFF_MAX = float(os.getenv("BREAKER_BACKOFF_MAX", "300"))
 
 MQTT_HOST = os.getenv("MQTT_HOST", "127.0.0.1")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
@@ -33,6 +106,10 @@ MQTT_PASS = os.getenv("MQTT_PASS")
 MQTT_QOS = int(os.getenv("MQTT_QOS", "0"))
 MQTT_RETAIN = os.getenv("MQTT_RETAIN", "false").lower() in ("1", "true", "yes")
 MQTT_TOPIC_PREFIX = os.getenv("MQTT_TOPIC_PREFIX", "meter/telstar80a")
+# Payload encoding of per-register and snapshot topics: json | msgpack | cbor | packed
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json").lower()
+# Fresh reads on request: JSON requests on <prefix>/request, answers on <prefix>/response (or "reply_to")
+MQTT_REQUESTS = os.getenv("MQTT_REQUESTS", "false").lower() in ("1", "true", "yes")
 
 # TLS options (optional)
 MQTT_TLS = os.getenv("MQTT_TLS", "false").lower() in ("1", "true", "yes")
@@ -41,115 +118,359 @@ MQTT_TLS_CERT = os.getenv("MQTT_TLS_CERT")   # client cert (optional)
 MQTT_TLS_KEY = os.getenv("MQTT_TLS_KEY")     # client key (optional)
 MQTT_TLS_INSECURE = os.getenv("MQTT_TLS_INSECURE", "false").lower() in ("1","true","yes")
 
+# Store-and-forward: MQTT messages are spooled to disk while the broker is unreachable
+SPOOL_DIR = os.getenv("SPOOL_DIR")                      # enables the spool (e.g. /var/lib/telstar/spool)
+SPOOL_MAX_MB = int(os.getenv("SPOOL_MAX_MB", "100"))     # size cap, oldest segments are dropped first
+SPOOL_SEGMENT_MB = int(os.getenv("SPOOL_SEGMENT_MB", "4"))
+SPOOL_FSYNC_INTERVAL = float(os.getenv("SPOOL_FSYNC_INTERVAL", "1"))  # seconds between fsyncs
+SPOOL_REPLAY_RATE = int(os.getenv("SPOOL_REPLAY_RATE", "100"))        # messages/s after reconnect
+
+# Fleet mode: poll several meters from one process (JSON list of meters, see README)
+METERS_FILE = os.getenv("METERS_FILE")
+# Max. concurrent poll cycles per Modbus host (gateways often serve only one request at a time)
+FLEET_HOST_CONCURRENCY = int(os.getenv("FLEET_HOST_CONCURRENCY", "1"))
+# Max. outstanding Modbus transactions per TCP connection in fleet mode (1 = one request at a time)
+MODBUS_PIPELINE = int(os.getenv("MODBUS_PIPELINE", "1"))
+# Poller processes in fleet mode ("auto" = one per CPU core, 0/1 = poll in the API process)
+FLEET_SHARDS = os.getenv("FLEET_SHARDS", "0").lower()
+FLEET_SHARDS = (os.cpu_count() or 1) if FLEET_SHARDS == "auto" else int(FLEET_SHARDS)
+# Set by the front-end for its shard processes only
+FLEET_SHARD = os.getenv("FLEET_SHARD")
+
 INTERVAL = int(os.getenv("INTERVAL", "10"))
+# Multi-rate polling: "<pattern>[,<pattern>...]=<seconds>;..." (see README), empty = all registers every INTERVAL
+POLL_GROUPS = os.getenv("POLL_GROUPS", "")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
+# Modbus TCP gateway: downstream clients read the meter's registers through the bridge (0 = disabled)
+GATEWAY_PORT = int(os.getenv("GATEWAY_PORT", "0"))
+# Max. age in seconds of cached registers served by the gateway, older ranges are read from the meter (empty = INTERVAL)
+GATEWAY_MAX_AGE = float(os.getenv("GATEWAY_MAX_AGE") or INTERVAL)
+# On-demand reads (?max_age=, MQTT requests): meter reads per second across all callers, and burst size
+FRESH_READ_RATE = float(os.getenv("FRESH_READ_RATE", "1"))
+FRESH_READ_BURST = int(os.getenv("FRESH_READ_BURST", "3"))
+
+# Report-by-exception: publish a register only when it changed by more than its deadband
+PUBLISH_ON_CHANGE = os.getenv("PUBLISH_ON_CHANGE", "false").lower() in ("1", "true", "yes")
+# "<pattern>[,<pattern>...]=<abs>|<pct>%;..." in scaled units, e.g. "active_power_*=5;voltage_*=0.5%"
+PUBLISH_DEADBANDS = os.getenv("PUBLISH_DEADBANDS", "")
+# Max. silence per topic in seconds before an unchanged value is published again (0 = never)
+PUBLISH_HEARTBEAT = int(os.getenv("PUBLISH_HEARTBEAT", "300"))
+
 # Prometheus
 PROMETHEUS_PORT = int(os.getenv("PROMETHEUS_PORT", "8000"))
 PROMETHEUS_PREFIX = os.getenv("PROMETHEUS_PREFIX", "telstar")
+# Additionally export every register under its old metric name {prefix}_{register}
+PROMETHEUS_LEGACY_METRICS = os.getenv("PROMETHEUS_LEGACY_METRICS", "false").lower() in ("1", "true", "yes")
 
 # API/Webhook port
 API_PORT = int(os.getenv("API_PORT", "5000"))
 
+# "threads": poll thread, paho network thread, Flask development server and metrics server
+# "asyncio": polling, MQTT network I/O, API and /metrics on one event loop (needs uvicorn)
+RUNTIME = os.getenv("RUNTIME", "threads").lower()
+# Threads running the Flask routes with RUNTIME=asyncio (every open /api/stream holds one)
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS", "16"))
+
+# Recent samples kept for the percentiles in /api/stats (Modbus RTT, cycle duration, ...)
+STATS_WINDOW = int(os.getenv("STATS_WINDOW", "1000"))
+
+# In-memory history: samples kept per register for /api/history (0 = disabled)
+HISTORY_SIZE = int(os.getenv("HISTORY_SIZE", "3600"))
+
+# Rollups: statistics over wall-clock aligned windows in seconds, e.g. "60,900" (empty = disabled)
+ROLLUP_WINDOWS = os.getenv("ROLLUP_WINDOWS", "")
+# Registers included in rollups (comma separated patterns)
+ROLLUP_REGISTERS = os.getenv("ROLLUP_REGISTERS", "*")
+
+# Derived quantities: built-in ones to compute (comma separated patterns, e.g. "*"; empty = none)
+DERIVED_METRICS = os.getenv("DERIVED_METRICS", "")
+# Own formulas: "<name>[<unit>]=<expression>;..." (see README)
+DERIVED_FORMULAS = os.getenv("DERIVED_FORMULAS", "")
+
+# Local time-series store: SQLite file in WAL mode (e.g. /var/lib/telstar/history/history.db), empty = disabled
+STORE_PATH = os.getenv("STORE_PATH")
+STORE_REGISTERS = os.getenv("STORE_REGISTERS", "*")                   # comma separated patterns
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL", "10"))  # seconds between write transactions
+STORE_RETENTION_DAYS = float(os.getenv("STORE_RETENTION_DAYS", "7"))   # raw samples
+STORE_DOWNSAMPLE = int(os.getenv("STORE_DOWNSAMPLE", "300"))           # seconds per aggregated row (0 = off)
+STORE_DOWNSAMPLE_RETENTION_DAYS = float(os.getenv("STORE_DOWNSAMPLE_RETENTION_DAYS", "730"))
+
+# Sink pipeline: every sink (mqtt, state, stream, ...) is fed from its own bounded queue
+SINK_QUEUE_SIZE = int(os.getenv("SINK_QUEUE_SIZE", "100"))
+# "<sink>=<policy>;..." with policy drop-oldest | coalesce-latest | block
+SINK_POLICIES = os.getenv("SINK_POLICIES", "")
+
+# Live stream (/api/stream): events kept for clients that fall behind, keep-alive interval in seconds
+STREAM_BACKLOG = int(os.getenv("STREAM_BACKLOG", "100"))
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "15"))
+
 logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO),
                     format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 log = logging.getLogger("modbus-mqtt")
 
 # ----------------------------
-# Register mapping (from PDF)
-# Format: (address_hex, name, unit, size_bytes, signed)
-# ----------------------------
-REGISTERS = [
-    (0x2000, "serial_number", "", 4, False),
-    (0x2002, "date_time_utc", "unix", 4, False),
-    (0x2004, "active_power_total_mW", "mW", 4, True),
-    (0x2006, "active_power_l1_mW", "mW", 4, True),
-    (0x2008, "active_power_l2_mW", "mW", 4, True),
-    (0x200A, "active_power_l3_mW", "mW", 4, True),
-    (0x200C, "reactive_power_total_mVar", "mVar", 4, False),
-    (0x200E, "reactive_power_l1_mVar", "mVar", 4, False),
-    (0x2010, "reactive_power_l2_mVar", "mVar", 4, False),
-    (0x2012, "reactive_power_l3_mVar", "mVar", 4, False),
-    (0x2014, "voltage_l1_mV", "mV", 4, False),
-    (0x2016, "voltage_l2_mV", "mV", 4, False),
-    (0x2018, "voltage_l3_mV", "mV", 4, False),
-    (0x201A, "current_l1_mA", "mA", 4, True),
-    (0x201C, "current_l2_mA", "mA", 4, True),
-    (0x201E, "current_l3_mA", "mA", 4, True),
-    (0x2020, "power_factor_l1_raw", "1/1000", 2, False),
-    (0x2021, "power_factor_l2_raw", "1/1000", 2, False),
-    (0x2022, "power_factor_l3_raw", "1/1000", 2, False),
-    (0x2023, "active_tariff", "", 2, False),
-    (0x2024, "active_energy_import_total_mWh", "mWh", 8, False),
-    (0x2028, "active_energy_export_total_mWh", "mWh", 8, False),
-    (0x202C, "active_energy_import_t1_mWh", "mWh", 8, False),
-    (0x2030, "active_energy_import_t2_mWh", "mWh", 8, False),
-    (0x2034, "active_energy_export_t1_mWh", "mWh", 8, False),
-    (0x2038, "active_energy_export_t2_mWh", "mWh", 8, False),
-    (0x203C, "reactive_energy_q1_mVarh", "mVarh", 8, False),
-    (0x2040, "reactive_energy_q2_mVarh", "mVarh", 8, False),
-    (0x2044, "reactive_energy_q3_mVarh", "mVarh", 8, False),
-    (0x2048, "reactive_energy_q4_mVarh", "mVarh", 8, False),
-    (0x204C, "active_energy_import_total_Wh", "Wh", 4, False),
-    (0x204E, "active_energy_export_total_Wh", "Wh", 4, False),
-    (0x2050, "active_energy_import_t1_Wh", "Wh", 4, False),
-    (0x2052, "active_energy_import_t2_Wh", "Wh", 4, False),
-    (0x2054, "active_energy_export_t1_Wh", "Wh", 4, False),
-    (0x2056, "active_energy_export_t2_Wh", "Wh", 4, False),
-    (0x2058, "reactive_energy_q1_Varh", "Varh", 4, False),
-    (0x205A, "reactive_energy_q2_Varh", "Varh", 4, False),
-    (0x205C, "reactive_energy_q3_Varh", "Varh", 4, False),
-    (0x205E, "reactive_energy_q4_Varh", "Varh", 4, False),
-]
+# Register map (register_map.py): the built-in Telstar 80A map or REGISTER_PROFILE.
+# Meters in METERS_FILE may use other profiles; the name tables below (derived quantities,
+# Prometheus families, deadbands, rollups, store) cover the registers of all loaded profiles
+# and are rebuilt when profiles are reloaded (see "Register profiles").
+# ----------------------------
+DEFAULT_MAP = load_profile(REGISTER_PROFILE) if REGISTER_PROFILE else BUILTIN_MAP
+REGISTERS = DEFAULT_MAP.registers
 
 # ----------------------------
-# Scaling rules: convert raw to human units
-# Each entry name -> (scale_fn, final_unit)
-# If not present, raw integer is returned as-is.
-# We use: power in W (mW -> W), energy in kWh:
-#  - mWh (milli-watt-hour) -> kWh  : divide by 1_000_000
-#  - Wh -> kWh : divide by 1000
-# ----------------------------
-def identity(v): return v
-
-SCALE_MAP = {
-    "_mW":      (lambda v: v / 1000.0, "W"),
-    "_mV":      (lambda v: v / 1000.0, "V"),
-    "_mA":      (lambda v: v / 1000.0, "A"),
-    # mWh -> kWh
-    "_mWh":     (lambda v: v / 1_000_000.0, "kWh"),
-    # mVar -> Var
-    "_mVar":    (lambda v: v / 1000.0, "Var"),
-    "_mVarh":   (lambda v: v / 1000.0, "Varh"),
-    "_1/1000":  (lambda v: v / 1000.0, ""),
-    "_rawpf":   (lambda v: v / 1000.0, ""),
-    "Wh":       (lambda v: v / 1000.0, "kWh"),  # Wh -> kWh
-    "Varh":     (lambda v: v, "Varh"),
-}
+# Derived quantities, computed once per cycle after decoding
+# Format: (name, unit, expression). Expressions see the scaled values of the registers read in
+# this cycle (W, Var, V, A, kWh, ...) and earlier derived values by name; rate(<counter>) is the
+# change per second since the previous cycle and is missing after a counter reset.
+# A quantity is skipped when one of its inputs was not read in the cycle; built-in rules whose
+# inputs are not in any loaded register map are left out.
+# ----------------------------
+DERIVED_RULES = [
+    ("apparent_power_total_VA", "VA", "hypot(active_power_total_mW, reactive_power_total_mVar)"),
+    ("apparent_power_l1_VA", "VA", "hypot(active_power_l1_mW, reactive_power_l1_mVar)"),
+    ("apparent_power_l2_VA", "VA", "hypot(active_power_l2_mW, reactive_power_l2_mVar)"),
+    ("apparent_power_l3_VA", "VA", "hypot(active_power_l3_mW, reactive_power_l3_mVar)"),
+    # negative while the phase (or the total) feeds in
+    ("power_factor_signed_total", "",
+     "active_power_total_mW / hypot(active_power_total_mW, reactive_power_total_mVar) "
+     "if active_power_total_mW or reactive_power_total_mVar else 1.0"),
+    ("power_factor_signed_l1", "", "copysign(power_factor_l1_raw, active_power_l1_mW)"),
+    ("power_factor_signed_l2", "", "copysign(power_factor_l2_raw, active_power_l2_mW)"),
+    ("power_factor_signed_l3", "", "copysign(power_factor_l3_raw, active_power_l3_mW)"),
+    ("voltage_imbalance_pct", "%", "imbalance(voltage_l1_mV, voltage_l2_mV, voltage_l3_mV)"),
+    ("current_imbalance_pct", "%", "imbalance(abs(current_l1_mA), abs(current_l2_mA), abs(current_l3_mA))"),
+    # kWh/s -> W
+    ("import_power_W", "W", "rate(active_energy_import_total_mWh) * 3600000"),
+    ("export_power_W", "W", "rate(active_energy_export_total_mWh) * 3600000"),
+]
+
+def imbalance(*values):
+    """Largest deviation from the mean in % of the mean"""
+    mean = sum(values) / len(values)
+    return max(abs(v - mean) for v in values) / mean * 100.0 if mean else 0.0
+
+DERIVED_GLOBALS = {"__builtins__": {}, "abs": abs, "min": min, "max": max, "round": round, "hypot": math.hypot,
+                   "sqrt": math.sqrt, "copysign": math.copysign, "imbalance": imbalance}
+
+class CounterRates(ast.NodeTransformer):
+    """Rewrites rate(<counter>) to the name <counter>__rate, filled in before evaluation."""
+
+    def __init__(self):
+        self.counters = set()
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id == "rate":
+            if len(node.args) != 1 or not isinstance(node.args[0], ast.Name):
+                raise ValueError("rate() takes one register name")
+            self.counters.add(node.args[0].id)
+            return ast.copy_location(ast.Name(f"{node.args[0].id}__rate", ast.Load()), node)
+        return node
+
+def parse_derived_formulas(spec):
+    formulas = []
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        m = re.fullmatch(r"([A-Za-z_]\w*)\s*(?:\[([^\]]*)\])?\s*=(?!=)\s*(.+)", part)
+        if not m:
+            raise ValueError(f"Invalid DERIVED_FORMULAS entry (expected name[unit]=expression): {part!r}")
+        formulas.append((m.group(1), m.group(2) or "", m.group(3)))
+    return formulas
+
+def compile_derived(enabled, spec, registers):
+    """[(name, unit, code, inputs)] in evaluation order, plus the counters used by rate()"""
+    patterns = [p.strip() for p in enabled.split(",") if p.strip()]
+    rules = [rule for rule in DERIVED_RULES if any(fnmatch.fnmatchcase(rule[0], p) for p in patterns)]
+    register_names = {entry[1] for entry in registers}
+    known = set(register_names)
+    compiled, counters = [], set()
+    for i, (name, unit, expression) in enumerate(rules + parse_derived_formulas(spec)):
+        if name in known:
+            raise ValueError(f"Derived quantity {name} is defined twice or shadows a register")
+        try:
+            tree = ast.parse(expression, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Derived quantity {name}: invalid expression {expression!r}: {e.msg}")
+        if any(isinstance(node, (ast.Attribute, ast.Subscript, ast.Lambda)) for node in ast.walk(tree)):
+            raise ValueError(f"Derived quantity {name}: only names, numbers, operators and functions are allowed")
+        rates = CounterRates()
+        tree = ast.fix_missing_locations(rates.visit(tree))
+        unknown = sorted(rates.counters - register_names)
+        inputs = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)} - DERIVED_GLOBALS.keys()
+        unknown += sorted(i for i in inputs if i not in known and not i.endswith("__rate"))
+        if unknown and i < len(rules):
+            log.debug("Derived quantity %s disabled, the register map has no %s", name, ", ".join(unknown))
+            continue
+        if unknown:
+            raise ValueError(f"Derived quantity {name}: unknown name(s) {', '.join(unknown)}")
+        compiled.append((name, unit, compile(tree, f"<derived {name}>", "eval"), frozenset(inputs)))
+        counters |= rates.counters
+        known.add(name)
+    return compiled, frozenset(counters)
+
+DERIVED, DERIVED_COUNTERS = compile_derived(DERIVED_METRICS, DERIVED_FORMULAS, REGISTERS)
+# every name a sample can carry: registers first, then derived quantities
+SAMPLE_NAMES = [entry[1] for entry in REGISTERS] + [name for name, _, _, _ in DERIVED]
+
+class DerivedState:
+    """Evaluates DERIVED for the cycles of one meter; keeps the previous counter readings for rate()."""
+
+    def __init__(self):
+        self.previous = {}
+
+    def evaluate(self, samples):
+        now = time.monotonic()
+        env = dict(DERIVED_GLOBALS)
+        env.update((res["name"], res["value"]) for res in samples)
+        for name in DERIVED_COUNTERS:
+            value = env.get(name)
+            if value is None:
+                continue
+            previous = self.previous.get(name)
+            self.previous[name] = (value, now)
+            # a counter that went backwards was reset (or replaced): start over from the new reading
+            if previous is not None and value >= previous[0] and now > previous[1]:
+                env[f"{name}__rate"] = (value - previous[0]) / (now - previous[1])
+        timestamp = samples[0]["timestamp"]
+        derived = []
+        for name, unit, code, inputs in DERIVED:
+            if not inputs <= env.keys():
+                continue
+            try:
+                value = eval(code, env)
+            except (ArithmeticError, ValueError, TypeError) as e:
+                log.debug("Derived quantity %s skipped: %s", name, e)
+                continue
+            env[name] = value
+            derived.append({"name": name, "address": None, "value": value, "unit": unit, "value_raw": None,
+                            "unit_raw": unit, "raw_registers": [], "timestamp": timestamp})
+        return derived
+
+DERIVED_STATES = {}
 
-def scale_value_by_name(name, raw_value, unit_label):
-    # try suffix heuristics
-    for suffix, (fn, unit) in SCALE_MAP.items():
-        if name.endswith(suffix) or unit_label == suffix.replace("_",""):
-            return fn(raw_value), unit or unit_label
-    # special by unit_label
-    if unit_label in ("mW", "mV", "mA", "mWh", "mVar", "mVarh", "1/1000", "Wh"):
-        key = "_" + unit_label
-        if key in SCALE_MAP:
-            fn, unit = SCALE_MAP[key]
-            return fn(raw_value), unit
-    # default unchanged
-    return raw_value, unit_label
+def derive_samples(meter, samples):
+    if not DERIVED or not samples:
+        return []
+    state = DERIVED_STATES.get(meter)
+    if state is None:
+        state = DERIVED_STATES[meter] = DerivedState()
+    return state.evaluate(samples)
 
 # ----------------------------
-# Prometheus metrics: one Gauge per register name
+# Prometheus metrics: registers grouped into labelled families
+# Format: (pattern on register name, family, help, type); named groups become labels.
+# Registers matching no rule are exported as {prefix}_{register}.
+# In fleet mode every metric carries a "meter" label.
 # ----------------------------
-PROM_GAUGES = {}
-for _, name, _, _, _ in REGISTERS:
-    metric_name = f"{PROMETHEUS_PREFIX}_{name}".replace(".", "_").replace("-", "_")
-    PROM_GAUGES[name] = Gauge(metric_name, f"Telstar register {name}")
+PROM_LABELS = ["meter"] if METERS_FILE else []
 
-SNAPSHOT_GAUGE = Gauge(f"{PROMETHEUS_PREFIX}_snapshot_timestamp", "Snapshot timestamp")
+PROM_FAMILY_RULES = [
+    (r"active_power_(?P<phase>total|l[123])_mW", "active_power_watts", "Active power in W", "gauge"),
+    (r"reactive_power_(?P<phase>total|l[123])_mVar", "reactive_power_var", "Reactive power in Var", "gauge"),
+    (r"voltage_(?P<phase>l[123])_mV", "voltage_volts", "Voltage in V", "gauge"),
+    (r"current_(?P<phase>l[123])_mA", "current_amperes", "Current in A", "gauge"),
+    (r"power_factor_(?P<phase>l[123])_raw", "power_factor", "Power factor", "gauge"),
+    (r"active_energy_(?P<direction>import|export)_(?P<tariff>total|t[12])_(?P<resolution>mWh|Wh)",
+     "active_energy_kwh", "Active energy counter in kWh", "counter"),
+    (r"reactive_energy_(?P<quadrant>q[1-4])_(?P<resolution>mVarh|Varh)",
+     "reactive_energy_varh", "Reactive energy counter in Varh", "counter"),
+    (r"date_time_utc", "meter_time_seconds", "Meter clock as unix time", "gauge"),
+    (r"apparent_power_(?P<phase>total|l[123])_VA", "apparent_power_va", "Apparent power in VA (derived)", "gauge"),
+    (r"power_factor_signed_(?P<phase>total|l[123])", "power_factor_signed",
+     "Power factor, negative while feeding in (derived)", "gauge"),
+    (r"(?P<quantity>voltage|current)_imbalance_pct", "imbalance_percent",
+     "Largest phase deviation from the mean in % (derived)", "gauge"),
+    (r"(?P<direction>import|export)_power_W", "grid_power_watts",
+     "Import/export power from the energy counters in W (derived)", "gauge"),
+]
+
+def compile_prom_families():
+    """register name -> (family, help, type, label_names, label_values)"""
+    families = {}
+    for name in SAMPLE_NAMES:
+        for pattern, family, help_text, kind in PROM_FAMILY_RULES:
+            m = re.fullmatch(pattern, name)
+            if m:
+                labels = m.groupdict()
+                families[name] = (family, help_text, kind, list(labels), list(labels.values()))
+                break
+        else:
+            family = name.replace(".", "_").replace("-", "_")
+            families[name] = (family, f"Telstar register {name}", "gauge", [], [])
+    return families
+
+def compile_prom_legacy(families):
+    """PROMETHEUS_LEGACY_METRICS: register name -> old metric family, for registers moved into a family"""
+    legacy_names = {}
+    if PROMETHEUS_LEGACY_METRICS:
+        for name, spec in families.items():
+            legacy = name.replace(".", "_").replace("-", "_")
+            if spec[0] != legacy:
+                legacy_names[name] = legacy
+    return legacy_names
+
+PROM_FAMILIES = compile_prom_families()
+PROM_LEGACY = compile_prom_legacy(PROM_FAMILIES)
+
+class SnapshotCollector:
+    """Exports the registers of STATE_SNAPSHOT when /metrics is scraped.
+
+    Nothing is set per poll cycle; the metric families are built on the first scrape
+    after a new snapshot and reused by every further scrape of the same version.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.families = []
+
+    def _new_families(self):
+        families = {}
+        specs = [spec[:4] for spec in PROM_FAMILIES.values()]
+        specs += [(legacy, f"Telstar register {name}", "gauge", []) for name, legacy in PROM_LEGACY.items()]
+        for family, help_text, kind, label_names in specs:
+            if family not in families:
+                metric_class = CounterMetricFamily if kind == "counter" else GaugeMetricFamily
+                families[family] = metric_class(f"{PROMETHEUS_PREFIX}_{family}", help_text,
+                                                labels=label_names + PROM_LABELS)
+        families["snapshot_timestamp"] = GaugeMetricFamily(f"{PROMETHEUS_PREFIX}_snapshot_timestamp",
+                                                           "Snapshot timestamp", labels=PROM_LABELS)
+        return families
+
+    def _build(self, snapshot):
+        families = self._new_families()
+        for meter, (timestamp, registers) in snapshot.meters.items():
+            meter_labels = [meter] if PROM_LABELS else []
+            for name, data in registers.items():
+                spec = PROM_FAMILIES.get(name)
+                if spec is None:
+                    continue
+                try:
+                    value = float(data["value"])
+                except (TypeError, ValueError):
+                    # if conversion fails, skip
+                    continue
+                families[spec[0]].add_metric(spec[4] + meter_labels, value)
+                if name in PROM_LEGACY:
+                    families[PROM_LEGACY[name]].add_metric(meter_labels, value)
+            if timestamp is not None:
+                families["snapshot_timestamp"].add_metric(meter_labels, timestamp)
+        return list(families.values())
+
+    def describe(self):
+        return list(self._new_families().values())
+
+    def collect(self):
+        snapshot = STATE_SNAPSHOT
+        with self.lock:
+            if self.version != snapshot.version:
+                self.families = self._build(snapshot)
+                self.version = snapshot.version
+            return self.families
+
+REGISTRY.register(SnapshotCollector())
+
+POLL_OVERRUNS = Counter(f"{PROMETHEUS_PREFIX}_poll_overruns", "Poll ticks skipped because a cycle overran",
+                        ["group"] + PROM_LABELS)
 
 # ----------------------------
 # Global state for API/Webhooks
@@ -159,33 +480,107 @@ latest_data = {
     "connection_status": "Not connected",
     "registers": {}
 }
+# Fleet mode only: meter name -> {"timestamp", "connection_status", "registers", ...}
+if METERS_FILE:
+    latest_data["meters"] = {}
 
 # ----------------------------
 # Flask API for Webhooks
 # ----------------------------
 app = Flask(__name__)
 
+# ----------------------------
+# Immutable API snapshots
+# latest_data is only written under SNAPSHOT_LOCK, and every change publishes a new
+# StateSnapshot holding a shallow copy of it. The JSON body is encoded on the first request
+# for a version, not per batch, so a fleet updating meter by meter does not re-encode the
+# whole document each time. Requests read STATE_SNAPSHOT once and serve cached bytes;
+# derived views (topic list, single topics) are encoded at most once per version as well.
+# Every body carries an ETag so pollers get 304 when nothing changed.
+# ----------------------------
+def encode_json(obj):
+    # byte-identical to jsonify() outside debug mode
+    return (app.json.dumps(obj, separators=(",", ":")) + "\n").encode("utf-8")
+
+class StateSnapshot:
+    __slots__ = ("version", "timestamp", "registers", "meters", "data", "encoded", "lock", "views")
+
+    def __init__(self, version, data):
+        self.version = version
+        self.timestamp = data["timestamp"]
+        self.registers = data.get("registers", {})
+        # register dicts are replaced, never mutated, so copying the containers is enough
+        self.data = dict(data)
+        if "meters" in data:
+            self.data["meters"] = {name: dict(m) for name, m in data["meters"].items()}
+            # meter name -> (timestamp, registers)
+            self.meters = {name: (m["timestamp"], m["registers"]) for name, m in data["meters"].items()}
+        else:
+            self.meters = {None: (self.timestamp, self.registers)}
+        self.encoded = None
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def encode(self):
+        """Encoded body and ETag of the whole document, built once per version"""
+        encoded = self.encoded
+        if encoded is None:
+            with self.lock:
+                encoded = self.encoded
+                if encoded is None:
+                    body = encode_json(self.data)
+                    encoded = self.encoded = (body, f"{self.version:x}-{zlib.crc32(body):08x}")
+        return encoded
+
+    def view(self, key, build):
+        """Encoded body and ETag of a view derived from this snapshot, built once per version"""
+        cached = self.views.get(key)
+        if cached is None:
+            body = encode_json(build(self))
+            cached = self.views[key] = (body, f"{self.version:x}-{zlib.crc32(body):08x}")
+        return cached
+
+SNAPSHOT_LOCK = threading.RLock()
+STATE_SNAPSHOT = StateSnapshot(0, latest_data)
+
+def publish_snapshot():
+    global STATE_SNAPSHOT
+    with SNAPSHOT_LOCK:
+        STATE_SNAPSHOT = StateSnapshot(STATE_SNAPSHOT.version + 1, latest_data)
+
+def cached_response(body, etag):
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
 @app.route('/api/data')
 def api_data():
-    """Get all register values"""
-    return jsonify(latest_data)
+    """Get all register values (?max_age=<seconds> reads older blocks from the meter)"""
+    if "max_age" in request.args:
+        return fresh_response(REGISTER_NAMES)
+    return cached_response(*STATE_SNAPSHOT.encode())
 
 @app.route('/api/topics')
 def api_topics():
     """List all available topics/register names"""
-    topics = list(latest_data.get("registers", {}).keys())
-    return jsonify({"topics": topics, "count": len(topics)})
+    def build(snapshot):
+        topics = list(snapshot.registers.keys())
+        return {"topics": topics, "count": len(topics)}
+    return cached_response(*STATE_SNAPSHOT.view("topics", build))
 
 @app.route('/api/topic/<topic_name>')
 def api_topic(topic_name):
-    """Get a specific topic/register value with scaled unit"""
-    registers = latest_data.get("registers", {})
+    """Get a specific topic/register value with scaled unit (?max_age=<seconds> as for /api/data)"""
+    if "max_age" in request.args and topic_name in REGISTER_NAMES:
+        return fresh_response({topic_name}, topic_name)
+    snapshot = STATE_SNAPSHOT
+    registers = snapshot.registers
     if topic_name in registers:
-        return jsonify({
+        return cached_response(*snapshot.view(("topic", topic_name), lambda snap: {
             "topic": topic_name,
-            "data": registers[topic_name],
-            "timestamp": latest_data.get("timestamp")
-        })
+            "data": snap.registers[topic_name],
+            "timestamp": snap.timestamp
+        }))
     else:
         return jsonify({
             "error": "Topic not found",
@@ -196,7 +591,7 @@ def api_topic(topic_name):
 @app.route('/api/topic/<topic_name>/value')
 def api_topic_value(topic_name):
     """Get only the scaled value of a specific topic"""
-    registers = latest_data.get("registers", {})
+    registers = STATE_SNAPSHOT.registers
     if topic_name in registers:
         return str(registers[topic_name]["value"]), 200, {'Content-Type': 'text/plain'}
     else:
@@ -205,7 +600,7 @@ def api_topic_value(topic_name):
 @app.route('/api/topic/<topic_name>/unit')
 def api_topic_unit(topic_name):
     """Get only the unit of a specific topic"""
-    registers = latest_data.get("registers", {})
+    registers = STATE_SNAPSHOT.registers
     if topic_name in registers:
         return str(registers[topic_name]["unit"]), 200, {'Content-Type': 'text/plain'}
     else:
@@ -214,25 +609,126 @@ def api_topic_unit(topic_name):
 @app.route('/api/topic/<topic_name>/raw')
 def api_topic_raw(topic_name):
     """Get only the raw value of a specific topic"""
-    registers = latest_data.get("registers", {})
+    registers = STATE_SNAPSHOT.registers
     if topic_name in registers:
         return str(registers[topic_name]["raw_value"]), 200, {'Content-Type': 'text/plain'}
     else:
         return f"Topic '{topic_name}' not found", 404
 
-# ----------------------------
-# Helpers: combine registers (Big Endian)
-# ----------------------------
-def combine_registers_be(regs, signed=False):
-    val = 0
-    for r in regs:
-        val = (val << 16) | (r & 0xFFFF)
-    bits = 16 * len(regs)
-    if signed:
-        sign_bit = 1 << (bits - 1)
-        if val & sign_bit:
-            val = val - (1 << bits)
-    return val
+@app.route('/api/meters')
+def api_meters():
+    """List all meters with their connection status (fleet mode)"""
+    meters = latest_data.get("meters", {})
+    return jsonify({
+        "meters": {name: {"connection_status": m["connection_status"], "timestamp": m["timestamp"],
+                          "host": m["host"], "unit_id": m["unit_id"], "topic_prefix": m["topic_prefix"]}
+                   for name, m in meters.items()},
+        "count": len(meters)
+    })
+
+@app.route('/api/meter/<meter_name>')
+def api_meter(meter_name):
+    """Get all register values of one meter (fleet mode)"""
+    meters = latest_data.get("meters", {})
+    if meter_name in meters:
+        return jsonify(meters[meter_name])
+    return jsonify({
+        "error": "Meter not found",
+        "meter": meter_name,
+        "available_meters": list(meters.keys())
+    }), 404
+
+@app.route('/api/history/<topic_name>')
+def api_history(topic_name):
+    """Get the recent history of a topic, optionally downsampled (?since=&until=&step=&meter=)"""
+    if HISTORY is None:
+        return jsonify({"error": "History disabled (HISTORY_SIZE=0)"}), 404
+    meter = request.args.get("meter")
+    if "meters" in latest_data and meter not in latest_data["meters"]:
+        return jsonify({"error": "Parameter 'meter' required", "available_meters": list(latest_data["meters"].keys())}), 400
+    try:
+        since = float(request.args["since"]) if "since" in request.args else None
+        until = float(request.args["until"]) if "until" in request.args else None
+        step = float(request.args["step"]) if "step" in request.args else None
+    except ValueError:
+        return jsonify({"error": "since, until and step must be numbers"}), 400
+    if step is not None and step <= 0:
+        return jsonify({"error": "step must be > 0"}), 400
+    ring = HISTORY.get((meter, topic_name))
+    if ring is None:
+        return jsonify({
+            "error": "Topic not found",
+            "topic": topic_name,
+            "available_topics": sorted(name for m, name in HISTORY if m == meter)
+        }), 404
+    result = ring.query(since, until, step)
+    result.update({"topic": topic_name, "since": since, "until": until, "step": step})
+    return jsonify(result)
+
+@app.route('/api/rollup/<window>')
+def api_rollup(window):
+    """Get the last completed and the running statistics of a rollup window (?meter=)"""
+    meter = request.args.get("meter")
+    rollup = ROLLUPS.get((meter, window))
+    if rollup is None:
+        return jsonify({
+            "error": "Rollup window not found",
+            "window": window,
+            "available_windows": sorted({name for m, name in ROLLUPS if m == meter})
+        }), 404
+    last, current = rollup.results()
+    return jsonify({"window": window, "last": last, "current": current})
+
+@app.route('/api/archive/<topic_name>')
+def api_archive(topic_name):
+    """Query the local store (?since=&until=&step=&limit=&meter=)"""
+    if SAMPLE_STORE is None:
+        return jsonify({"error": "Store disabled (STORE_PATH not set)"}), 404
+    meter = request.args.get("meter")
+    if "meters" in latest_data and meter not in latest_data["meters"]:
+        return jsonify({"error": "Parameter 'meter' required", "available_meters": list(latest_data["meters"].keys())}), 400
+    try:
+        since = float(request.args["since"]) if "since" in request.args else None
+        until = float(request.args["until"]) if "until" in request.args else None
+        step = float(request.args["step"]) if "step" in request.args else None
+        limit = int(request.args.get("limit", "10000"))
+    except ValueError:
+        return jsonify({"error": "since, until, step and limit must be numbers"}), 400
+    if step is not None and step <= 0:
+        return jsonify({"error": "step must be > 0"}), 400
+    result = SAMPLE_STORE.query(meter, topic_name, since, until, step, limit)
+    if result is None:
+        return jsonify({
+            "error": "Topic not found",
+            "topic": topic_name,
+            "available_topics": SAMPLE_STORE.names_of(meter)
+        }), 404
+    result.update({"topic": topic_name, "since": since, "until": until, "step": step})
+    return jsonify(result)
+
+@app.route('/api/stats')
+def api_stats():
+    """Poll and publish instrumentation: Modbus RTT, cycle duration, schedule lag, errors"""
+    result = {"mqtt": PUBLISH_TRACKER.summary()}
+    if SHARD_TABLE is not None and SHARD_TABLE.owner:
+        # sharded fleet mode: polling and MQTT run in the shards, which export their statistics
+        shard_stats = list(SHARD_STATS.items())
+        result["mqtt"] = {f"shard-{stats['shard']}": stats["mqtt"] for _, stats in shard_stats}
+        result["meters"] = {name: stats["poll"] for name, stats in shard_stats}
+    elif "meters" in latest_data:
+        result["meters"] = {name: poll_metrics(name).summary() for name in latest_data["meters"]}
+    else:
+        result["poll"] = poll_metrics(None).summary()
+    return jsonify(result)
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: one snapshot per meter, then deltas of changed registers (?meter=)"""
+    meter = request.args.get("meter")
+    if "meters" in latest_data and meter is not None and meter not in latest_data["meters"]:
+        return jsonify({"error": "Meter not found", "meter": meter, "available_meters": list(latest_data["meters"].keys())}), 404
+    return Response(EVENT_STREAM.subscribe(meter), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # ----------------------------
 # MQTT client setup
@@ -258,7 +754,76 @@ if MQTT_TLS:
     except Exception as e:
         log.exception("Failed to configure MQTT TLS: %s", e)
 
+# ----------------------------
+# Publish instrumentation: latency from publish() until paho reports the message
+# written (QoS 0) or acknowledged by the broker (QoS 1/2), and messages in flight
+# ----------------------------
+MQTT_PUBLISH_SECONDS = Histogram(f"{PROMETHEUS_PREFIX}_mqtt_publish_seconds", "MQTT publish latency",
+                                 buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+class PublishTracker:
+    MAX_PENDING = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # mid -> perf_counter at publish()
+        self.early = set()  # mids paho reported before publish() returned
+        self.latency = collections.deque(maxlen=STATS_WINDOW)
+        self.failed = 0
+
+    def publish(self, topic, payload, qos, retain):
+        started = time.perf_counter()
+        info = mqtt_client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            with self.lock:
+                self.failed += 1
+            return info
+        with self.lock:
+            if info.mid in self.early:
+                self.early.discard(info.mid)
+            else:
+                if len(self.pending) >= self.MAX_PENDING:
+                    # never acknowledged (e.g. lost with the connection)
+                    self.pending.pop(next(iter(self.pending)))
+                self.pending[info.mid] = started
+                return info
+        self._observe(started)
+        return info
+
+    def on_publish(self, client, userdata, mid):
+        with self.lock:
+            started = self.pending.pop(mid, None)
+            if started is None:
+                self.early.add(mid)
+                return
+        self._observe(started)
+
+    def _observe(self, started):
+        seconds = time.perf_counter() - started
+        MQTT_PUBLISH_SECONDS.observe(seconds)
+        self.latency.append(seconds)
+
+    def inflight(self):
+        return len(self.pending)
+
+    def summary(self):
+        with self.lock:
+            return {"inflight": len(self.pending), "failed": self.failed,
+                    "publish_seconds": percentiles(self.latency)}
+
+PUBLISH_TRACKER = PublishTracker()
+mqtt_client.on_publish = PUBLISH_TRACKER.on_publish
+Gauge(f"{PROMETHEUS_PREFIX}_mqtt_inflight", "MQTT messages published but not yet sent/acknowledged").set_function(PUBLISH_TRACKER.inflight)
+
 def mqtt_connect():
+    if MQTT_SPOOL:
+        # never block polling on the broker: paho connects in the background, the spool buffers meanwhile
+        mqtt_client.max_queued_messages_set(1000)
+        mqtt_client.connect_async(MQTT_HOST, MQTT_PORT, keepalive=60)
+        mqtt_client.loop_start()
+        threading.Thread(target=spool_replay_loop, name="spool-replay", daemon=True).start()
+        log.info("Connecting to MQTT broker %s:%s in background (spool: %s)", MQTT_HOST, MQTT_PORT, SPOOL_DIR)
+        return
     while True:
         try:
             mqtt_client.connect(MQTT_HOST, MQTT_PORT, keepalive=60)
@@ -269,132 +834,2637 @@ def mqtt_connect():
             log.warning("MQTT connect failed: %s — retry in 5s", e)
             time.sleep(5)
 
+# ----------------------------
+# Store-and-forward spool for MQTT outages (SPOOL_DIR)
+# ----------------------------
+class MqttSpool:
+    """Bounded, append-only on-disk log of MQTT messages.
+
+    Messages are appended to segment files (spool-<seq>.log) while the broker is unreachable
+    and replayed oldest first once it is back, with their original payloads and timestamps.
+    Record layout: >IIBBH (payload length, crc32, qos, retain, topic length) + topic + payload.
+    fsync runs at most every fsync_interval seconds; when max_bytes is exceeded the oldest
+    segment is dropped. The replay position is kept in spool.pos so a restart resumes there.
+    """
+
+    HEADER = struct.Struct(">IIBBH")
+
+    def __init__(self, directory, max_bytes, segment_bytes, fsync_interval):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(int(f[6:-4]) for f in os.listdir(directory)
+                               if f.startswith("spool-") and f.endswith(".log"))
+        self.sizes = {seq: os.path.getsize(self._path(seq)) for seq in self.segments}
+        self.read_offset = self._load_position()
+        self.writer = None
+        self.reader = None
+        self.dirty = False
+        self.last_sync = self.last_position_save = time.monotonic()
+        if self._pending_bytes():
+            log.info("Spool %s holds %d bytes to replay", directory, self._pending_bytes())
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"spool-{seq:012d}.log")
+
+    def _load_position(self):
+        try:
+            with open(os.path.join(self.directory, "spool.pos"), "r", encoding="ascii") as f:
+                seq, offset = (int(v) for v in f.read().split())
+            return offset if self.segments and seq == self.segments[0] else 0
+        except (OSError, ValueError):
+            return 0
+
+    def _save_position(self):
+        self.last_position_save = time.monotonic()
+        path = os.path.join(self.directory, "spool.pos")
+        with open(path + ".tmp", "w", encoding="ascii") as f:
+            f.write(f"{self.segments[0] if self.segments else 0} {self.read_offset}")
+        os.replace(path + ".tmp", path)
+
+    def _pending_bytes(self):
+        return sum(self.sizes.values()) - self.read_offset
+
+    def pending_bytes(self):
+        with self.lock:
+            return self._pending_bytes()
+
+    def pending(self):
+        return self.pending_bytes() > 0
+
+    def append(self, topic, payload, qos, retain):
+        topic_b = topic.encode("utf-8")
+        payload_b = payload if isinstance(payload, bytes) else payload.encode("utf-8")
+        record = self.HEADER.pack(len(payload_b), zlib.crc32(topic_b + payload_b), qos, int(retain),
+                                  len(topic_b)) + topic_b + payload_b
+        with self.lock:
+            if self.writer is None or self.sizes[self.segments[-1]] >= self.segment_bytes:
+                self._rotate()
+            self.writer.write(record)
+            self.sizes[self.segments[-1]] += len(record)
+            self.dirty = True
+            while sum(self.sizes.values()) > self.max_bytes and len(self.segments) > 1:
+                self._drop_oldest(replayed=False)
+            self._sync(force=False)
+
+    def _rotate(self):
+        if self.writer is not None:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            self.writer.close()
+        seq = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(seq)
+        self.sizes[seq] = 0
+        self.writer = open(self._path(seq), "ab")
+
+    def _drop_oldest(self, replayed):
+        seq = self.segments.pop(0)
+        if not replayed:
+            log.warning("Spool exceeds %d bytes: dropping %d unsent bytes of segment %d",
+                        self.max_bytes, self.sizes[seq] - self.read_offset, seq)
+        if self.reader is not None and self.reader[0] == seq:
+            self.reader[1].close()
+            self.reader = None
+        if self.writer is not None and not self.segments:
+            self.writer.close()
+            self.writer = None
+        del self.sizes[seq]
+        self.read_offset = 0
+        os.remove(self._path(seq))
+        self._save_position()
+
+    def _sync(self, force):
+        if self.writer is not None and self.dirty and (force or time.monotonic() - self.last_sync >= self.fsync_interval):
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            self.dirty = False
+            self.last_sync = time.monotonic()
+            self._save_position()
+
+    def sync(self):
+        with self.lock:
+            self._sync(force=False)
+
+    def peek(self):
+        """Return the oldest unsent message as (topic, payload, qos, retain, next_offset) or None."""
+        with self.lock:
+            while self.segments:
+                seq = self.segments[0]
+                if self.read_offset >= self.sizes[seq]:
+                    self._drop_oldest(replayed=True)
+                    continue
+                if self.writer is not None and seq == self.segments[-1]:
+                    self.writer.flush()
+                if self.reader is None or self.reader[0] != seq:
+                    if self.reader is not None:
+                        self.reader[1].close()
+                    self.reader = (seq, open(self._path(seq), "rb"))
+                f = self.reader[1]
+                f.seek(self.read_offset)
+                header = f.read(self.HEADER.size)
+                if len(header) == self.HEADER.size:
+                    payload_len, crc, qos, retain, topic_len = self.HEADER.unpack(header)
+                    body = f.read(topic_len + payload_len)
+                    if len(body) == topic_len + payload_len and zlib.crc32(body) == crc:
+                        return (body[:topic_len].decode("utf-8"), body[topic_len:], qos, bool(retain),
+                                self.read_offset + self.HEADER.size + len(body))
+                # torn write (e.g. power loss): skip the rest of this segment
+                log.warning("Spool segment %d is corrupt at offset %d — skipping %d bytes",
+                            seq, self.read_offset, self.sizes[seq] - self.read_offset)
+                self.read_offset = self.sizes[seq]
+            return None
+
+    def commit(self, next_offset):
+        with self.lock:
+            self.read_offset = next_offset
+            if time.monotonic() - self.last_position_save >= self.fsync_interval:
+                self._save_position()
+
+# every shard process (FLEET_SHARDS) keeps its own spool
+if SPOOL_DIR and FLEET_SHARD is not None:
+    SPOOL_DIR = os.path.join(SPOOL_DIR, f"shard-{FLEET_SHARD}")
+MQTT_SPOOL = MqttSpool(SPOOL_DIR, SPOOL_MAX_MB * 1024 * 1024, SPOOL_SEGMENT_MB * 1024 * 1024,
+                       SPOOL_FSYNC_INTERVAL) if SPOOL_DIR else None
+
+def mqtt_publish(topic, payload):
+    # keep order: while a backlog is replayed, new messages queue up behind it
+    if MQTT_SPOOL and (not mqtt_client.is_connected() or MQTT_SPOOL.pending()):
+        MQTT_SPOOL.append(topic, payload, MQTT_QOS, MQTT_RETAIN)
+        return
+    info = PUBLISH_TRACKER.publish(topic, payload, MQTT_QOS, MQTT_RETAIN)
+    if info.rc != mqtt.MQTT_ERR_SUCCESS:
+        if MQTT_SPOOL:
+            MQTT_SPOOL.append(topic, payload, MQTT_QOS, MQTT_RETAIN)
+        else:
+            log.warning("MQTT publish failed for %s: %s", topic, mqtt.error_string(info.rc))
+
+def spool_replay_loop():
+    delay = 1.0 / max(1, SPOOL_REPLAY_RATE)
+    while True:
+        try:
+            MQTT_SPOOL.sync()
+            if not mqtt_client.is_connected():
+                time.sleep(1)
+                continue
+            item = MQTT_SPOOL.peek()
+            if item is None:
+                time.sleep(0.5)
+                continue
+            topic, payload, qos, retain, next_offset = item
+            info = PUBLISH_TRACKER.publish(topic, payload, qos, retain)
+            if qos > 0 and info.rc == mqtt.MQTT_ERR_SUCCESS:
+                # only drop from the spool what the broker acknowledged
+                info.wait_for_publish(5)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS or (qos > 0 and not info.is_published()):
+                time.sleep(1)
+                continue
+            MQTT_SPOOL.commit(next_offset)
+            time.sleep(delay)
+        except Exception as e:
+            log.exception("Spool replay failed: %s", e)
+            time.sleep(5)
+
+# ----------------------------
+# Read plan: coalesce a register map into block reads
+# Format: (start_address, word_count, [(entry, word_offset), ...], codec)
+# ----------------------------
+def compile_read_plan(registers, max_gap=READ_MAX_GAP, max_words=READ_MAX_WORDS):
+    return register_map.compile_read_plan(registers, max_gap, max_words)
+
+# Codecs for single reads (fallback when a device rejects a block), keyed by register entry
+ENTRY_CODECS = {}
+
+# ----------------------------
+# Poll groups: registers polled at different rates, each group with its own read plan
+# POLL_GROUPS = "<pattern>[,<pattern>...]=<seconds>;..." with fnmatch patterns on register names,
+#   e.g. "active_power_*,current_*=1;voltage_*=5;*Wh,*Varh=60;serial_number=0"
+# 0 seconds = read once. The first matching rule wins, unmatched registers use the "interval" of
+# their profile entry or INTERVAL.
+# ----------------------------
+def parse_pattern_rules(spec, setting):
+    rules = []
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        patterns, _, value = part.rpartition("=")
+        if not patterns:
+            raise ValueError(f"Invalid {setting} entry (expected pattern=value): {part!r}")
+        rules.append(([p.strip() for p in patterns.split(",") if p.strip()], value.strip()))
+    return rules
+
+def match_pattern_rules(rules, name, default):
+    return next((value for patterns, value in rules
+                 if any(fnmatch.fnmatchcase(name, p) for p in patterns)), default)
+
+def match_names(names, patterns):
+    return frozenset(name for name in names if any(fnmatch.fnmatchcase(name, p) for p in patterns))
+
+def compile_poll_groups(spec, registers, default_interval=INTERVAL):
+    rules = parse_pattern_rules(spec, "POLL_GROUPS")
+    members = {}
+    for entry in registers:
+        interval = float(match_pattern_rules(rules, entry[1],
+                                             default_interval if entry.interval is None else entry.interval))
+        members.setdefault(interval, []).append(entry)
+    return [{
+        "name": f"{interval:g}s" if interval > 0 else "once",
+        "interval": interval,
+        "names": frozenset(entry[1] for entry in entries),
+        "plan": compile_read_plan(entries),
+    } for interval, entries in sorted(members.items())]
+
+class PollSchedule:
+    """Drift-free multi-rate schedule.
+
+    Every group ticks on wall-clock multiples of its interval (e.g. :00, :05, :10 for 5s),
+    independent of how long a cycle takes. A cycle that ends after the group's next tick
+    counts the skipped ticks as overruns instead of silently stretching the period.
+    """
+
+    def __init__(self, groups, meter=None):
+        self.groups = groups
+        self.meter = meter
+        self.metrics = poll_metrics(meter)
+        now = time.time()
+        self.due = {group["name"]: now for group in groups}
+        self.stats = {group["name"]: {"interval": group["interval"], "registers": len(group["names"]),
+                                      "overruns": 0, "last_duration": None} for group in groups}
+
+    def next_tick(self):
+        return min(self.due.values())
+
+    def deadline(self, groups):
+        """Seconds a cycle of these groups may take: CYCLE_DEADLINE or the shortest interval"""
+        if CYCLE_DEADLINE > 0:
+            return CYCLE_DEADLINE
+        return min(group["interval"] if group["interval"] > 0 else INTERVAL for group in groups)
+
+    def defer(self, until):
+        """Move every group to its first tick after until, without counting the skipped ticks as overruns"""
+        for group in self.groups:
+            name = group["name"]
+            if self.due[name] == float("inf"):
+                continue
+            interval = group["interval"] if group["interval"] > 0 else INTERVAL
+            self.due[name] = max(self.due[name], (math.floor(until / interval) + 1) * interval)
+
+    def due_groups(self, now):
+        return [group for group in self.groups if self.due[group["name"]] <= now]
+
+    def complete(self, groups, started, samples):
+        finished = time.time()
+        read = {res["name"] for res in samples}
+        lag = started - min(self.due[group["name"]] for group in groups)
+        self.metrics.cycle(finished - started, lag, sum(len(group["names"] - read) for group in groups))
+        for group in groups:
+            name, interval = group["name"], group["interval"]
+            self.stats[name]["last_duration"] = round(finished - started, 3)
+            if interval <= 0:
+                # read once; retry on the default interval until every register was read
+                interval = INTERVAL
+                if group["names"] <= read:
+                    self.due[name] = float("inf")
+                    continue
+            next_due = (math.floor(self.due[name] / interval) + 1) * interval
+            if next_due <= finished:
+                skipped = int((finished - next_due) // interval) + 1
+                next_due += skipped * interval
+                self.stats[name]["overruns"] += skipped
+                POLL_OVERRUNS.labels(name, *([self.meter] if PROM_LABELS else [])).inc(skipped)
+                log.warning("%sPoll group %s overran: cycle took %.3fs, %d tick(s) of %gs skipped",
+                            f"[{self.meter}] " if self.meter else "", name, finished - started, skipped, interval)
+            self.due[name] = next_due
+
+# ----------------------------
+# Poll instrumentation, one PollMetrics per meter (None outside fleet mode)
+# Every observation goes to a Prometheus histogram/counter and to a bounded window of
+# recent samples that /api/stats turns into percentiles.
+# ----------------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+MODBUS_REQUEST_SECONDS = Histogram(f"{PROMETHEUS_PREFIX}_modbus_request_seconds",
+                                   "Round-trip time of successful Modbus requests", ["kind"] + PROM_LABELS,
+                                   buckets=LATENCY_BUCKETS)
+MODBUS_ERRORS = Counter(f"{PROMETHEUS_PREFIX}_modbus_errors", "Failed Modbus requests per error class and block",
+                        ["error", "block"] + PROM_LABELS)
+POLL_CYCLE_SECONDS = Histogram(f"{PROMETHEUS_PREFIX}_poll_cycle_seconds", "Duration of a full poll cycle",
+                               PROM_LABELS, buckets=LATENCY_BUCKETS)
+POLL_SCHEDULE_LAG = Histogram(f"{PROMETHEUS_PREFIX}_poll_schedule_lag_seconds",
+                              "Delay between the scheduled tick and the start of the cycle", PROM_LABELS,
+                              buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60))
+REGISTERS_MISSED = Counter(f"{PROMETHEUS_PREFIX}_registers_missed", "Registers due in a cycle but not read",
+                           PROM_LABELS)
+CIRCUIT_STATE = Gauge(f"{PROMETHEUS_PREFIX}_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+                      PROM_LABELS)
+CIRCUIT_STATES = {"closed": 0, "half-open": 1, "open": 2}
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+    last = len(ordered) - 1
+    result = {"count": len(ordered)}
+    for p in (50, 90, 99):
+        result[f"p{p}"] = round(ordered[last * p // 100], 4)
+    result["max"] = round(ordered[last], 4)
+    return result
+
+class ModbusReadError(Exception):
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+def error_class(error):
+    # ModbusReadError wraps the (error) response of a request
+    if isinstance(error, ModbusReadError):
+        error = error.response
+        if not isinstance(error, (ExceptionResponse, ModbusIOException)):
+            return "protocol"  # no, malformed or otherwise unusable response
+    if isinstance(error, ExceptionResponse):
+        return "exception_response"
+    if isinstance(error, (ModbusIOException, TimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(error, (ConnectionException, ConnectionError)):
+        return "connection"
+    return "other"
+
+def check_response(rr, what):
+    if rr is None:
+        raise ModbusReadError(f"No response reading {what}")
+    if hasattr(rr, "isError") and rr.isError():
+        raise ModbusReadError(f"Modbus error reading {what}: {rr}", rr)
+    return rr
+
+class PollMetrics:
+    def __init__(self, meter=None):
+        self.labels = [meter] if PROM_LABELS else []
+        self.lock = threading.Lock()
+        self.request_seconds = {kind: MODBUS_REQUEST_SECONDS.labels(kind, *self.labels)
+                                for kind in ("block", "single", "gateway", "fresh")}
+        self.cycle_seconds = POLL_CYCLE_SECONDS.labels(*self.labels) if self.labels else POLL_CYCLE_SECONDS
+        self.schedule_lag = POLL_SCHEDULE_LAG.labels(*self.labels) if self.labels else POLL_SCHEDULE_LAG
+        self.missed_counter = REGISTERS_MISSED.labels(*self.labels) if self.labels else REGISTERS_MISSED
+        self.circuit_gauge = CIRCUIT_STATE.labels(*self.labels) if self.labels else CIRCUIT_STATE
+        self.rtt = collections.deque(maxlen=STATS_WINDOW)
+        self.cycles = collections.deque(maxlen=STATS_WINDOW)
+        self.lags = collections.deque(maxlen=STATS_WINDOW)
+        self.requests = 0
+        self.errors = {}  # error class -> {block: count}
+        self.missed = 0
+        self.timeout = MODBUS_TIMEOUT
+        self.circuit = "closed"
+
+    def request(self, kind, seconds):
+        self.request_seconds[kind].observe(seconds)
+        with self.lock:
+            self.requests += 1
+            self.rtt.append(seconds)
+
+    def error(self, error, block):
+        MODBUS_ERRORS.labels(error, block, *self.labels).inc()
+        with self.lock:
+            per_block = self.errors.setdefault(error, {})
+            per_block[block] = per_block.get(block, 0) + 1
+
+    def cycle(self, seconds, lag, missed):
+        self.cycle_seconds.observe(seconds)
+        self.schedule_lag.observe(max(0.0, lag))
+        if missed:
+            self.missed_counter.inc(missed)
+        with self.lock:
+            self.cycles.append(seconds)
+            self.lags.append(max(0.0, lag))
+            self.missed += missed
+
+    def adaptive_timeout(self):
+        """Request timeout from the recent round-trip times (MODBUS_TIMEOUT until 20 are known)"""
+        with self.lock:
+            ordered = sorted(self.rtt)
+        if len(ordered) >= 20:
+            p99 = ordered[(len(ordered) - 1) * 99 // 100]
+            self.timeout = min(MODBUS_TIMEOUT, max(MODBUS_TIMEOUT_MIN, p99 * MODBUS_TIMEOUT_FACTOR))
+        return self.timeout
+
+    def circuit_state(self, state):
+        self.circuit = state
+        self.circuit_gauge.set(CIRCUIT_STATES[state])
+
+    def summary(self):
+        with self.lock:
+            return {
+                "circuit": self.circuit,
+                "request_timeout": round(self.timeout, 4),
+                "requests": self.requests,
+                "request_seconds": percentiles(self.rtt),
+                "cycle_seconds": percentiles(self.cycles),
+                "schedule_lag_seconds": percentiles(self.lags),
+                "errors": {error: dict(blocks) for error, blocks in self.errors.items()},
+                "missed_registers": self.missed
+            }
+
+POLL_METRICS = {}
+
+def poll_metrics(meter=None):
+    metrics = POLL_METRICS.get(meter)
+    if metrics is None:
+        metrics = POLL_METRICS.setdefault(meter, PollMetrics(meter))
+    return metrics
+
+# ----------------------------
+# Fail fast: cycle budget and per-meter circuit breaker
+# ----------------------------
+class CycleBudget:
+    """Time and failure budget of one poll cycle.
+
+    Every request gets the adaptive timeout of its meter, cut to what is left until the cycle
+    deadline. After CYCLE_MAX_FAILURES failed requests in a row, or once the deadline has
+    passed, the remaining reads of the cycle are skipped instead of waiting out each timeout.
+    """
+
+    def __init__(self, started, deadline, metrics):
+        self.deadline = started + deadline
+        self.request_timeout = metrics.adaptive_timeout()
+        self.failures = 0
+        self.aborted = None
+
+    def timeout(self):
+        """Timeout for the next request, None when the cycle has to stop"""
+        if self.aborted is None:
+            remaining = self.deadline - time.time()
+            if self.failures >= CYCLE_MAX_FAILURES:
+                self.aborted = f"{self.failures} failed requests in a row"
+            elif remaining <= 0:
+                self.aborted = "cycle deadline exceeded"
+            else:
+                return min(self.request_timeout, remaining)
+        return None
+
+    def result(self, ok):
+        self.failures = 0 if ok else self.failures + 1
+
+class CircuitBreaker:
+    """Pauses polling of an unresponsive meter instead of failing every cycle.
+
+    closed:    normal polling; BREAKER_THRESHOLD failed cycles in a row open the circuit
+    open:      no requests for a backoff doubling from BREAKER_BACKOFF_MIN to BREAKER_BACKOFF_MAX,
+               with +-20% jitter so many meters behind one gateway do not retry in lockstep
+    half-open: a single probe cycle; success closes the circuit, failure opens it again
+    """
+    JITTER = 0.2
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.state = "closed"
+        self.failures = 0
+        self.backoff = 0.0
+        self.retry_at = 0.0
+
+    def _set(self, state):
+        if state != self.state:
+            self.state = state
+            self.metrics.circuit_state(state)
+
+    def before_cycle(self, now):
+        if self.state == "open" and now >= self.retry_at:
+            self._set("half-open")
+
+    def success(self):
+        self.failures = 0
+        self.backoff = 0.0
+        self._set("closed")
+
+    def failure(self, now):
+        """Count a failed cycle; returns the time of the next attempt if the circuit opened"""
+        self.failures += 1
+        if self.state != "half-open" and self.failures < BREAKER_THRESHOLD:
+            return None
+        self.backoff = min(BREAKER_BACKOFF_MAX, self.backoff * 2 if self.backoff else BREAKER_BACKOFF_MIN)
+        self.retry_at = now + self.backoff * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+        self._set("open")
+        return self.retry_at
+
+    def describe(self, reason):
+        if self.state == "open":
+            retry = datetime.fromtimestamp(self.retry_at).strftime("%H:%M:%S")
+            return f"{reason} (circuit open after {self.failures} failed cycles, next attempt {retry})"
+        return reason
+
+def fail_cycle(schedule, breaker, reason):
+    now = time.time()
+    retry_at = breaker.failure(now)
+    prefix = f"[{schedule.meter}] " if schedule.meter else ""
+    if retry_at is not None:
+        schedule.defer(retry_at)
+        log.warning("%sCircuit open: %s — next attempt in %.0fs", prefix, reason, retry_at - now)
+    else:
+        # no retry before the next tick
+        schedule.defer(now)
+        log.warning("%sPoll cycle failed (%d in a row): %s", prefix, breaker.failures, reason)
+    set_connection_status(breaker.describe(reason), schedule.meter)
+
+# ----------------------------
+# Register cache and shared meter connection (single meter mode)
+# Every successful read lands in REGISTER_CACHE as raw words. The poller and the Modbus gateway
+# share one connection: callers queue on UPSTREAM_LOCK, and a caller that waited while another
+# one read its range takes that result instead of asking the meter again.
+# ----------------------------
+class RegisterCache:
+    """Raw words of the register map and the (monotonic) time each word was read"""
+
+    def __init__(self, registers):
+        self.start = min(int(entry[0]) for entry in registers)
+        self.end = max(int(entry[0]) + entry[3] // 2 for entry in registers)
+        self.words = array("H", bytes(2 * (self.end - self.start)))
+        self.read_at = [-math.inf] * (self.end - self.start)
+        self.lock = threading.Lock()
+
+    def covers(self, address, count):
+        return self.start <= address and address + count <= self.end
+
+    def update(self, address, registers, now):
+        if not self.covers(address, len(registers)):
+            return
+        i = address - self.start
+        with self.lock:
+            self.words[i:i + len(registers)] = array("H", registers)
+            self.read_at[i:i + len(registers)] = [now] * len(registers)
+
+    def read(self, address, count):
+        """(words, time the oldest of them was read) of a range within the map"""
+        i = address - self.start
+        with self.lock:
+            return self.words[i:i + count].tolist(), min(self.read_at[i:i + count])
+
+    def get(self, address, count, oldest):
+        """Words of a range if all of them were read at or after `oldest`, else None"""
+        if not self.covers(address, count):
+            return None
+        words, read_at = self.read(address, count)
+        return words if read_at >= oldest else None
+
+REGISTER_CACHE = RegisterCache(REGISTERS)  # rebuilt when the default profile is reloaded
+UPSTREAM_LOCK = threading.Lock()
+upstream_client = None  # connection of modbus_loop, None while disconnected
+
+def read_upstream(client, address, count, what, metrics, kind, timeout=None, limiter=None):
+    """Read words from the meter (client None = the poller's connection); returns (registers, coalesced)"""
+    waiting_since = time.monotonic()
+    with UPSTREAM_LOCK:
+        registers = REGISTER_CACHE.get(address, count, waiting_since)
+        if registers is not None:
+            return registers, True
+        client = client or upstream_client
+        if client is None:
+            raise ConnectionException("not connected to the meter")
+        if limiter is not None:
+            retry_after = limiter.take()
+            if retry_after:
+                raise RateLimited(retry_after)
+        if timeout is not None:
+            client.comm_params.timeout_connect = timeout
+        started = time.perf_counter()
+        rr = check_response(client.read_holding_registers(address + MODBUS_ADDRESS_OFFSET, count, slave=MODBUS_UNIT_ID),
+                            what)
+        metrics.request(kind, time.perf_counter() - started)
+        REGISTER_CACHE.update(address, rr.registers, time.monotonic())
+        return rr.registers, False
+
 # ----------------------------
 # Read a register entry
 # ----------------------------
-def read_register_entry(client, entry):
-    addr_hex, name, unit, size_bytes, signed = entry
+def read_register_entry(client, entry, metrics=None, budget=None):
+    addr_hex, name, unit, size_bytes, signed = entry[:5]
     # convert hex to int (pdf uses hex addresses)
     base_address = int(addr_hex)
-    address = base_address + MODBUS_ADDRESS_OFFSET
     # count of 16-bit words
     count = size_bytes // 2
+    metrics = metrics or poll_metrics()
+    timeout = None
+    if budget is not None:
+        timeout = budget.timeout()
+        if timeout is None:
+            return None
     try:
-        rr = client.read_holding_registers(address, count, unit=MODBUS_UNIT_ID)
-        if rr is None:
-            raise Exception("No response (None)")
-        if hasattr(rr, "isError") and rr.isError():
-            raise Exception(f"Modbus error reading {hex(base_address)}: {rr}")
-        regs = rr.registers
-        value_raw = combine_registers_be(regs, signed=signed)
-        return {
-            "name": name,
-            "address": hex(base_address),
-            "value_raw": value_raw,
-            "unit_raw": unit,
-            "raw_registers": regs,
-            "timestamp": int(time.time())
-        }
+        registers, _ = read_upstream(client, base_address, count, hex(base_address), metrics, "single", timeout)
+        if budget is not None:
+            budget.result(True)
+        return decode_block(ENTRY_CODECS[entry], registers, int(time.time()))[0]
     except Exception as e:
+        metrics.error(error_class(e), f"{hex(base_address)}+{count}")
+        if budget is not None:
+            budget.result(False)
         log.debug("Exception reading %s (%s): %s", name, hex(base_address), e)
         return None
 
+# ----------------------------
+# Read a block of the read plan and slice it into register results
+# ----------------------------
+def read_block(client, block, metrics=None, budget=None):
+    start, count, members, codec = block
+    metrics = metrics or poll_metrics()
+    timeout = None
+    if budget is not None:
+        timeout = budget.timeout()
+        if timeout is None:
+            return []
+    try:
+        registers, _ = read_upstream(client, start, count, f"block {hex(start)}+{count}", metrics, "block", timeout)
+        if budget is not None:
+            budget.result(True)
+        return decode_block(codec, registers, int(time.time()))
+    except Exception as e:
+        metrics.error(error_class(e), f"{hex(start)}+{count}")
+        if budget is not None:
+            budget.result(False)
+        log.debug("Exception reading block %s (+%d words): %s", hex(start), count, e)
+        # Some devices reject ranges spanning gaps: fall back to single reads
+        if len(members) > 1:
+            return [res for res in (read_register_entry(client, entry, metrics, budget) for entry, _ in members) if res]
+        return []
+
+# ----------------------------
+# Report-by-exception (PUBLISH_ON_CHANGE)
+# Deadbands are compiled per register: name -> (threshold, is_percent)
+# ----------------------------
+def compile_deadbands(spec, names):
+    rules = parse_pattern_rules(spec, "PUBLISH_DEADBANDS")
+    deadbands = {}
+    for name in names:
+        value = match_pattern_rules(rules, name, "0")
+        deadbands[name] = (float(value.rstrip("%")), value.endswith("%"))
+    return deadbands
+
+DEADBANDS = compile_deadbands(PUBLISH_DEADBANDS, SAMPLE_NAMES)
+
+class ChangeFilter:
+    """Decides which register updates of one meter are published to MQTT.
+
+    A value is published when it moved by at least its deadband since the last published
+    value, or when its topic has been silent for PUBLISH_HEARTBEAT seconds.
+    """
+
+    def __init__(self, deadbands=None, heartbeat=PUBLISH_HEARTBEAT):
+        self.deadbands = deadbands  # None = DEADBANDS, which follows profile reloads
+        self.heartbeat = heartbeat
+        self.last = {}
+        self.last_snapshot = None
+
+    def _silent(self, since, now):
+        return self.heartbeat > 0 and now - since >= self.heartbeat
+
+    def changed(self, name, value, now):
+        last = self.last.get(name)
+        if last is not None and not self._silent(last[1], now):
+            threshold, percent = (self.deadbands or DEADBANDS).get(name, (0.0, False))
+            delta = abs(value - last[0])
+            if delta == 0 or delta < (threshold * abs(last[0]) / 100.0 if percent else threshold):
+                return False
+        self.last[name] = (value, now)
+        return True
+
+    def snapshot_due(self, any_changed, now):
+        if any_changed or self.last_snapshot is None or self._silent(self.last_snapshot, now):
+            self.last_snapshot = now
+            return True
+        return False
+
+# ----------------------------
+# Payload formats
+# json/msgpack/cbor carry the same maps. "packed" is a fixed binary layout without key strings:
+#   register: >BIQd   schema version, timestamp, raw value (uint64 bit pattern), scaled value
+#   snapshot: >BIIH   schema version, schema id, timestamp, register count
+#             + >d per register in descriptor order (NaN = not read yet)
+# Every register profile has its own descriptor, published retained on <prefix>/schema of the
+# meters using it.
+# ----------------------------
+PACKED_SCHEMA_VERSION = 1
+PACKED_REGISTER = struct.Struct(">BIQd")
+PACKED_SNAPSHOT_HEADER = struct.Struct(">BIIH")
+RAW_MASK = (1 << 64) - 1
+
+def build_schema_descriptor(registers, derived):
+    descriptor = {
+        "format": PAYLOAD_FORMAT,
+        "schema_version": PACKED_SCHEMA_VERSION,
+        "register_layout": {"struct": PACKED_REGISTER.format,
+                            "fields": ["schema_version", "timestamp", "raw_value", "value"]},
+        "snapshot_layout": {"header": PACKED_SNAPSHOT_HEADER.format,
+                            "header_fields": ["schema_version", "schema_id", "timestamp", "count"],
+                            "values": ">d per register in order, NaN = missing"},
+        "registers": [{"index": i, "name": entry.name, "address": hex(int(entry.address)), "unit": scaling(entry)[1],
+                       "unit_raw": entry.unit, "size_bytes": entry.size_bytes, "signed": entry.signed}
+                      for i, entry in enumerate(registers)],
+    }
+    for register, entry in zip(descriptor["registers"], registers):
+        if entry.value_type != "int":
+            # raw_value is 0 for floating point registers
+            register["type"] = entry.value_type
+    if derived:
+        # snapshot values continue after the registers
+        descriptor["derived"] = [{"index": len(registers) + i, "name": name, "unit": unit}
+                                 for i, (name, unit, _, _) in enumerate(derived)]
+    descriptor["schema_id"] = zlib.crc32(json.dumps(descriptor, sort_keys=True).encode("utf-8"))
+    return descriptor
+
+def register_message(res):
+    return {
+        "value": res["value"],
+        "unit": res["unit"],
+        "raw_value": res["value_raw"],
+        "raw_registers": res["raw_registers"],
+        "address": res["address"],
+        "timestamp": res["timestamp"]
+    }
+
+def encode_register_packed(res):
+    # derived quantities have no raw value, floating point registers no integer one
+    raw = res["value_raw"] & RAW_MASK if isinstance(res["value_raw"], int) else 0
+    return PACKED_REGISTER.pack(PACKED_SCHEMA_VERSION, res["timestamp"], raw, float(res["value"]))
+
+def encode_snapshot_packed(batch):
+    profile = batch.profile
+    values = [float(batch.registers[name]["value"]) if name in batch.registers else math.nan
+              for name in profile.sample_names]
+    return (PACKED_SNAPSHOT_HEADER.pack(PACKED_SCHEMA_VERSION, profile.schema["schema_id"], batch.timestamp, len(values))
+            + profile.snapshot_values.pack(*values))
+
+def compile_payload_encoders(payload_format):
+    """Return (encode_register(res), encode_snapshot(batch), encode_document(dict)) for PAYLOAD_FORMAT.
+
+    Documents without a packed layout (e.g. rollups) fall back to JSON in packed mode.
+    """
+    if payload_format == "packed":
+        return encode_register_packed, encode_snapshot_packed, json.dumps
+    if payload_format == "json":
+        dumps = json.dumps
+    elif payload_format == "msgpack":
+        if msgpack is None:
+            raise RuntimeError("PAYLOAD_FORMAT=msgpack requires the 'msgpack' package")
+        dumps = msgpack.packb
+    elif payload_format == "cbor":
+        if cbor2 is None:
+            raise RuntimeError("PAYLOAD_FORMAT=cbor requires the 'cbor2' package")
+        dumps = cbor2.dumps
+    else:
+        raise ValueError(f"Unknown PAYLOAD_FORMAT {payload_format!r} (expected json, msgpack, cbor or packed)")
+    return (lambda res: dumps(register_message(res)),
+            lambda batch: dumps({"timestamp": batch.timestamp, "data": batch.registers}),
+            dumps)
+
+ENCODE_REGISTER, ENCODE_SNAPSHOT, ENCODE_DOCUMENT = compile_payload_encoders(PAYLOAD_FORMAT)
+
+# prefix -> profile whose retained schema descriptor it got (re-sent on every broker connect)
+SCHEMA_PREFIXES = {}
+
+def publish_schema(topic_prefix, profile):
+    SCHEMA_PREFIXES[topic_prefix] = profile
+    PUBLISH_TRACKER.publish(f"{topic_prefix}/schema", profile.schema_payload, MQTT_QOS, True)
+
+def on_mqtt_connect(client, userdata, flags, rc):
+    if rc == 0:
+        for topic_prefix, profile in list(SCHEMA_PREFIXES.items()):
+            publish_schema(topic_prefix, profile)
+        if FRESH_REQUEST_WORKER.is_alive():
+            client.subscribe(FRESH_REQUEST_TOPIC, MQTT_QOS)
+
+mqtt_client.on_connect = on_mqtt_connect
+
+# ----------------------------
+# Sink pipeline: the poller emits immutable SampleBatches, sink workers consume them
+# in their own threads so a slow broker or scrape never delays the next Modbus read.
+# samples = registers read in this tick, registers = API view of all known registers,
+# profile = MeterProfile the samples were decoded with
+# ----------------------------
+SampleBatch = collections.namedtuple("SampleBatch", ["meter", "topic_prefix", "timestamp", "samples", "registers",
+                                                     "profile"])
+
+SINK_QUEUE_DEPTH = Gauge(f"{PROMETHEUS_PREFIX}_sink_queue_depth", "Sample batches waiting per sink", ["sink"])
+SINK_DROPPED = Counter(f"{PROMETHEUS_PREFIX}_sink_dropped", "Sample batches dropped or coalesced per sink", ["sink"])
+if MQTT_SPOOL:
+    Gauge(f"{PROMETHEUS_PREFIX}_mqtt_spool_bytes", "Bytes waiting in the MQTT spool").set_function(MQTT_SPOOL.pending_bytes)
+
+def merge_samples(samples, previous):
+    registers = dict(previous)
+    for res in samples:
+        # Store for API/Webhooks (with unit information)
+        registers[res["name"]] = {
+            "value": res["value"],
+            "unit": res["unit"],
+            "raw_value": res["value_raw"],
+            "raw_registers": res["raw_registers"],
+            "address": res["address"]
+        }
+    return registers
+
+class SinkWorker:
+    """Feeds one sink from a bounded queue in its own thread.
+
+    Policies:
+      drop-oldest     - when full, discard the oldest pending batch
+      coalesce-latest - keep only the newest pending batch per meter
+      block           - when full, make the poller wait (lossless, but couples it to the sink)
+    """
+
+    POLICIES = ("drop-oldest", "coalesce-latest", "block")
+
+    def __init__(self, name, handler, policy, maxsize=SINK_QUEUE_SIZE):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown sink policy for {name}: {policy!r} (expected one of {', '.join(self.POLICIES)})")
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.maxsize = max(1, maxsize)
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        SINK_QUEUE_DEPTH.labels(name).set_function(lambda: len(self.queue))
+        self.thread = threading.Thread(target=self.run, name=f"sink-{name}", daemon=True)
+        self.thread.start()
+
+    def put(self, batch):
+        with self.cond:
+            if self.policy == "coalesce-latest":
+                for i, pending in enumerate(self.queue):
+                    if pending.meter == batch.meter:
+                        self.queue[i] = batch
+                        SINK_DROPPED.labels(self.name).inc()
+                        return
+            while len(self.queue) >= self.maxsize:
+                if self.policy == "block":
+                    self.cond.wait()
+                else:
+                    self.queue.popleft()
+                    SINK_DROPPED.labels(self.name).inc()
+            self.queue.append(batch)
+            self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                batch = self.queue.popleft()
+                self.cond.notify_all()
+            try:
+                self.handler(batch)
+            except Exception as e:
+                log.exception("Sink %s failed: %s", self.name, e)
+
+# ----------------------------
+# History: one preallocated ring buffer per register (and meter) with columnar
+# float64 timestamps/values, so memory stays fixed at 16 bytes * HISTORY_SIZE per register.
+# ----------------------------
+class RingHistory:
+    """Fixed-capacity time series of one register."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, value):
+        with self.lock:
+            self.timestamps[self.head] = timestamp
+            self.values[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def _ordered(self):
+        # copy out in chronological order (oldest first)
+        with self.lock:
+            start = (self.head - self.count) % self.capacity
+            if start + self.count <= self.capacity:
+                return self.timestamps[start:start + self.count], self.values[start:start + self.count]
+            return (self.timestamps[start:] + self.timestamps[:self.head],
+                    self.values[start:] + self.values[:self.head])
+
+    def query(self, since=None, until=None, step=None):
+        timestamps, values = self._ordered()
+        lo = bisect.bisect_left(timestamps, since) if since is not None else 0
+        hi = bisect.bisect_right(timestamps, until) if until is not None else len(timestamps)
+        timestamps, values = timestamps[lo:hi], values[lo:hi]
+        if step is None:
+            return {"timestamps": timestamps.tolist(), "values": values.tolist()}
+        if np is not None:
+            return downsample_numpy(timestamps, values, step)
+        return downsample_python(timestamps, values, step)
+
+def downsample_numpy(timestamps, values, step):
+    t = np.frombuffer(timestamps, dtype=np.float64)
+    v = np.frombuffer(values, dtype=np.float64)
+    if not len(t):
+        return {"timestamps": [], "min": [], "max": [], "avg": [], "count": []}
+    buckets = np.floor(t / step)
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    counts = np.diff(np.append(starts, len(v)))
+    return {
+        "timestamps": (buckets[starts] * step).tolist(),
+        "min": np.minimum.reduceat(v, starts).tolist(),
+        "max": np.maximum.reduceat(v, starts).tolist(),
+        "avg": (np.add.reduceat(v, starts) / counts).tolist(),
+        "count": counts.tolist(),
+    }
+
+def downsample_python(timestamps, values, step):
+    result = {"timestamps": [], "min": [], "max": [], "avg": [], "count": []}
+    bucket = None
+    for t, v in zip(timestamps, values):
+        key = math.floor(t / step)
+        if key != bucket:
+            if bucket is not None:
+                result["avg"][-1] /= result["count"][-1]
+            bucket = key
+            result["timestamps"].append(float(key * step))
+            result["min"].append(v)
+            result["max"].append(v)
+            result["avg"].append(0.0)
+            result["count"].append(0)
+        result["min"][-1] = min(result["min"][-1], v)
+        result["max"][-1] = max(result["max"][-1], v)
+        result["avg"][-1] += v
+        result["count"][-1] += 1
+    if bucket is not None:
+        result["avg"][-1] /= result["count"][-1]
+    return result
+
+# (meter, register name) -> RingHistory
+HISTORY = {} if HISTORY_SIZE > 0 else None
+
+def history_sink(batch):
+    for res in batch.samples:
+        ring = HISTORY.get((batch.meter, res["name"]))
+        if ring is None:
+            ring = HISTORY[(batch.meter, res["name"])] = RingHistory(HISTORY_SIZE)
+        ring.append(res["timestamp"], res["value"])
+
+# ----------------------------
+# Rollups: O(1) running statistics per register over wall-clock aligned windows.
+# A window is closed (and published to <prefix>/rollup/<window>) by the first sample after it.
+# Per register: [count, sum, min, max, first, last]. The last value of a register in a closed
+# window is the baseline of its delta in the next one, so no reading falls between two windows.
+# ----------------------------
+def window_name(seconds):
+    for unit, size in (("h", 3600), ("m", 60)):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+ROLLUP_SECONDS = sorted({int(w) for w in ROLLUP_WINDOWS.replace(";", ",").split(",") if w.strip()})
+ROLLUP_PATTERNS = [p.strip() for p in ROLLUP_REGISTERS.split(",") if p.strip()]
+ROLLUP_NAMES = match_names(SAMPLE_NAMES, ROLLUP_PATTERNS)
+
+class RollupWindow:
+    """Running min/max/avg/delta of registers over one window length."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.name = window_name(seconds)
+        self.start = None
+        self.stats = {}
+        self.baselines = {}  # register -> last value before the running window
+        self.last_result = None
+        self.lock = threading.Lock()
+
+    def add(self, batch):
+        """Add a batch; returns the result of the window it closed, if any."""
+        with self.lock:
+            return self._add(batch)
+
+    def _add(self, batch):
+        start = batch.timestamp - batch.timestamp % self.seconds
+        closed = None
+        if self.start is not None and start != self.start:
+            closed = self.last_result = self._result()
+            self.baselines.update((name, st[5]) for name, st in self.stats.items())
+            self.stats = {}
+        self.start = start
+        for res in batch.samples:
+            if res["name"] not in ROLLUP_NAMES:
+                continue
+            value = res["value"]
+            st = self.stats.get(res["name"])
+            if st is None:
+                self.stats[res["name"]] = [1, value, value, value, value, value]
+            else:
+                st[0] += 1
+                st[1] += value
+                if value < st[2]:
+                    st[2] = value
+                if value > st[3]:
+                    st[3] = value
+                st[5] = value
+        return closed
+
+    def result(self):
+        with self.lock:
+            return self._result()
+
+    def results(self):
+        """The last completed and the running window, read together."""
+        with self.lock:
+            return self.last_result, self._result()
+
+    def _result(self):
+        if self.start is None:
+            return None
+        data = {}
+        for name, st in self.stats.items():
+            data[name] = {"min": st[2], "max": st[3], "avg": st[1] / st[0], "count": st[0],
+                          "first": st[4], "last": st[5]}
+            # no delta for the first window of a register: nothing to measure it from
+            if name in self.baselines:
+                data[name]["delta"] = st[5] - self.baselines[name]
+        return {
+            "window": self.name,
+            "start": self.start,
+            "end": self.start + self.seconds,
+            "data": data
+        }
+
+# (meter, window name) -> RollupWindow
+ROLLUPS = {}
+
+def rollup_sink(batch):
+    for seconds in ROLLUP_SECONDS:
+        key = (batch.meter, window_name(seconds))
+        rollup = ROLLUPS.get(key)
+        if rollup is None:
+            rollup = ROLLUPS[key] = RollupWindow(seconds)
+        closed = rollup.add(batch)
+        if closed is not None:
+            topic = f"{batch.topic_prefix}/rollup/{rollup.name}"
+            try:
+                mqtt_publish(topic, ENCODE_DOCUMENT(closed))
+            except Exception as e:
+                log.warning("MQTT publish failed for %s: %s", topic, e)
+
+# ----------------------------
+# Local time-series store (STORE_PATH): SQLite in WAL mode, written by its own thread.
+# Samples are buffered and written in one transaction every STORE_FLUSH_INTERVAL seconds;
+# samples(series, ts) is a clustered WITHOUT ROWID table so a range query is a single index
+# seek and appends stay at the end of each series. Completed STORE_DOWNSAMPLE buckets are
+# aggregated into rollup(series, ts) and raw samples expire after STORE_RETENTION_DAYS.
+# Several shard processes may share one database: each rolls up the series it writes and
+# keeps its progress per series in rollup_progress.
+# ----------------------------
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY, meter TEXT NOT NULL, name TEXT NOT NULL,
+                                   UNIQUE (meter, name));
+CREATE TABLE IF NOT EXISTS samples (series INTEGER NOT NULL, ts INTEGER NOT NULL, value REAL,
+                                    PRIMARY KEY (series, ts)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup (series INTEGER NOT NULL, ts INTEGER NOT NULL, min REAL, max REAL,
+                                   avg REAL, count INTEGER, PRIMARY KEY (series, ts)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_progress (series INTEGER PRIMARY KEY, until INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+STORE_MAINTENANCE_INTERVAL = 3600  # seconds between retention runs
+
+STORE_ROWS = Counter(f"{PROMETHEUS_PREFIX}_store_rows", "Samples written to or dropped by the local store", ["result"])
+STORE_FLUSH_SECONDS = Histogram(f"{PROMETHEUS_PREFIX}_store_flush_seconds", "Duration of a store write transaction",
+                                buckets=LATENCY_BUCKETS)
+
+class SampleStore:
+    """Persistent history of register samples with retention and downsampling."""
+
+    def __init__(self, path, names, flush_interval, retention, step, step_retention):
+        self.path = path
+        self.names = names
+        self.flush_interval = max(0.1, flush_interval)
+        self.retention = retention * 86400
+        self.step = step
+        self.step_retention = step_retention * 86400
+        self.pending = []
+        self.written = set()  # series written by this process, rolled up here
+        self.lock = threading.Lock()
+        self.readers = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = self._connect()
+        self.db.executescript(STORE_SCHEMA)
+        self._load_series()
+        self.thread = threading.Thread(target=self.run, name="store", daemon=True)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")  # fsync on checkpoints only, WAL keeps the file consistent
+        return db
+
+    def _load_series(self):
+        self.series = {(meter, name): sid for sid, meter, name in self.db.execute("SELECT id, meter, name FROM series")}
+
+    def _series_id(self, meter, name):
+        sid = self.series.get((meter, name))
+        if sid is None:
+            sid = self.series[(meter, name)] = self.db.execute(
+                "INSERT INTO series (meter, name) VALUES (?, ?)", (meter, name)).lastrowid
+        return sid
+
+    def add(self, batch):
+        meter = batch.meter or ""
+        rows = [(meter, res["name"], int(res["timestamp"]), res["value"])
+                for res in batch.samples if res["name"] in self.names]
+        with self.lock:
+            self.pending.extend(rows)
+
+    def flush(self):
+        with self.lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return
+        started = time.perf_counter()
+        try:
+            with self.db:
+                params = [(self._series_id(meter, name), ts, value) for meter, name, ts, value in rows]
+                self.db.executemany("INSERT OR REPLACE INTO samples (series, ts, value) VALUES (?, ?, ?)", params)
+            self.written.update(sid for sid, _, _ in params)
+        except sqlite3.Error as e:
+            log.warning("Store: dropped %d sample(s): %s", len(rows), e)
+            STORE_ROWS.labels("dropped").inc(len(rows))
+            self._load_series()
+            return
+        STORE_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        STORE_ROWS.labels("written").inc(len(rows))
+
+    def _meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def roll_up(self, now):
+        """Aggregate the buckets completed since the last run (late samples get one flush interval)"""
+        until = int((now - 2 * self.flush_interval) // self.step * self.step)
+        progress = dict(self.db.execute("SELECT series, until FROM rollup_progress"))
+        legacy = self._meta("rollup_until")  # single progress of stores created before rollup_progress
+        with self.db:
+            for sid in self.written:
+                since = progress.get(sid, legacy)
+                if since is None:
+                    oldest = self.db.execute("SELECT MIN(ts) FROM samples WHERE series = ?", (sid,)).fetchone()[0]
+                    since = until if oldest is None else oldest // self.step * self.step
+                if since >= until:
+                    continue
+                self.db.execute(
+                    "INSERT OR REPLACE INTO rollup (series, ts, min, max, avg, count) "
+                    "SELECT series, ts / :step * :step, MIN(value), MAX(value), AVG(value), COUNT(*) FROM samples "
+                    "WHERE series = :series AND ts >= :since AND ts < :until GROUP BY ts / :step",
+                    {"step": self.step, "series": sid, "since": since, "until": until})
+                self.db.execute("INSERT OR REPLACE INTO rollup_progress (series, until) VALUES (?, ?)", (sid, until))
+
+    def prune(self, now):
+        # per series, so each delete is a range on the primary key instead of a table scan;
+        # reloaded first to include series added by other processes sharing the database
+        self._load_series()
+        with self.db:
+            for sid in self.series.values():
+                self.db.execute("DELETE FROM samples WHERE series = ? AND ts < ?", (sid, now - self.retention))
+                if self.step:
+                    self.db.execute("DELETE FROM rollup WHERE series = ? AND ts < ?", (sid, now - self.step_retention))
+
+    def run(self):
+        next_prune = 0
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            now = time.time()
+            try:
+                if self.step:
+                    self.roll_up(now)
+                if now >= next_prune:
+                    self.prune(now)
+                    next_prune = now + STORE_MAINTENANCE_INTERVAL
+            except sqlite3.Error as e:
+                log.warning("Store maintenance failed: %s", e)
+
+    def bytes(self):
+        return sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix))
+
+    def _reader(self):
+        # one connection per API thread; WAL readers never block the writer
+        db = getattr(self.readers, "db", None)
+        if db is None:
+            db = self.readers.db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA query_only=1")
+        return db
+
+    def names_of(self, meter):
+        return sorted(row[0] for row in self._reader().execute("SELECT name FROM series WHERE meter = ?", (meter or "",)))
+
+    def query(self, meter, name, since=None, until=None, step=None, limit=10000):
+        """Raw samples, or min/max/avg per `step` seconds (from rollup rows when step >= STORE_DOWNSAMPLE)"""
+        db = self._reader()
+        row = db.execute("SELECT id FROM series WHERE meter = ? AND name = ?", (meter or "", name)).fetchone()
+        if row is None:
+            return None
+        args = {"series": row[0], "since": -2 ** 62 if since is None else since,
+                "until": 2 ** 62 if until is None else until, "step": step, "limit": limit}
+        if step is None:
+            rows = db.execute("SELECT ts, value FROM samples WHERE series = :series AND ts >= :since AND ts <= :until "
+                              "ORDER BY ts LIMIT :limit", args).fetchall()
+            return {"source": "raw", "timestamps": [r[0] for r in rows], "values": [r[1] for r in rows]}
+        if self.step and step >= self.step:
+            source = "rollup"
+            sql = ("SELECT CAST(ts / :step AS INTEGER) * :step AS bucket, MIN(min), MAX(max), "
+                   "SUM(avg * count) / SUM(count), SUM(count) FROM rollup")
+        else:
+            source = "raw"
+            sql = ("SELECT CAST(ts / :step AS INTEGER) * :step AS bucket, MIN(value), MAX(value), "
+                   "AVG(value), COUNT(*) FROM samples")
+        rows = db.execute(sql + " WHERE series = :series AND ts >= :since AND ts <= :until "
+                          "GROUP BY bucket ORDER BY bucket LIMIT :limit", args).fetchall()
+        result = {"source": source}
+        for i, key in enumerate(("timestamps", "min", "max", "avg", "count")):
+            result[key] = [r[i] for r in rows]
+        return result
+
+STORE_PATTERNS = [p.strip() for p in STORE_REGISTERS.split(",") if p.strip()]
+SAMPLE_STORE = SampleStore(STORE_PATH, match_names(SAMPLE_NAMES, STORE_PATTERNS), STORE_FLUSH_INTERVAL,
+                           STORE_RETENTION_DAYS, STORE_DOWNSAMPLE, STORE_DOWNSAMPLE_RETENTION_DAYS) if STORE_PATH else None
+if SAMPLE_STORE:
+    Gauge(f"{PROMETHEUS_PREFIX}_store_bytes", "Size of the local store (database and WAL)").set_function(SAMPLE_STORE.bytes)
+
+# ----------------------------
+# Sinks: name -> (handler, default policy). Additional sinks register here.
+# ----------------------------
+CHANGE_FILTERS = {}
+
+def mqtt_sink(batch):
+    if SCHEMA_PREFIXES.get(batch.topic_prefix) is not batch.profile:
+        publish_schema(batch.topic_prefix, batch.profile)
+    change_filter = CHANGE_FILTERS.setdefault(batch.meter, ChangeFilter()) if PUBLISH_ON_CHANGE else None
+    now = time.monotonic()
+    any_changed = False
+    for res in batch.samples:
+        # publish per-register payload (only changed values in report-by-exception mode)
+        if change_filter is not None and not change_filter.changed(res["name"], res["value"], now):
+            continue
+        any_changed = True
+        topic = f"{batch.topic_prefix}/{res['name']}"
+        try:
+            payload = ENCODE_REGISTER(res)
+            mqtt_publish(topic, payload)
+            log.debug("Published %s (%d bytes)", topic, len(payload))
+        except Exception as e:
+            log.warning("MQTT publish failed for %s: %s", topic, e)
+
+    # snapshot (combined)
+    if change_filter is None or change_filter.snapshot_due(any_changed, now):
+        snapshot_topic = f"{batch.topic_prefix}/snapshot"
+        try:
+            mqtt_publish(snapshot_topic, ENCODE_SNAPSHOT(batch))
+        except Exception as e:
+            log.warning("MQTT publish failed for snapshot: %s", e)
+
+def state_sink(batch):
+    # Update global state for API/Webhooks, readers only see the published snapshot
+    with SNAPSHOT_LOCK:
+        state = latest_data if batch.meter is None else latest_data["meters"][batch.meter]
+        state["registers"] = batch.registers
+        state["timestamp"] = batch.timestamp
+        latest_data["timestamp"] = batch.timestamp
+        publish_snapshot()
+
+# ----------------------------
+# Live event stream (Server-Sent Events for /api/stream, event_stream.py)
+# ----------------------------
+EVENT_STREAM = EventStream(STREAM_BACKLOG, STREAM_KEEPALIVE)
+
+def set_connection_status(status, meter=None):
+    with SNAPSHOT_LOCK:
+        state = latest_data if meter is None else latest_data["meters"][meter]
+        if state["connection_status"] == status:
+            return
+        state["connection_status"] = status
+        if meter is not None:
+            update_fleet_status()
+        publish_snapshot()
+    EVENT_STREAM.publish_status(meter, status)
+    if SHARD_TABLE is not None and meter in SHARD_ROWS:
+        SHARD_TABLE.write_status(SHARD_ROWS[meter], status)
+
+def stream_sink(batch):
+    EVENT_STREAM.publish(batch.meter, batch.timestamp, batch.registers)
+
+SINKS = {
+    "mqtt": (mqtt_sink, "drop-oldest"),
+    "state": (state_sink, "coalesce-latest"),
+    "stream": (stream_sink, "coalesce-latest"),
+}
+if HISTORY is not None:
+    SINKS["history"] = (history_sink, "drop-oldest")
+if ROLLUP_SECONDS:
+    SINKS["rollup"] = (rollup_sink, "drop-oldest")
+if SAMPLE_STORE:
+    SINKS["store"] = (SAMPLE_STORE.add, "block")
+
+SINK_WORKERS = []
+
+def start_sinks():
+    if SINK_WORKERS:
+        return
+    policies = parse_pattern_rules(SINK_POLICIES, "SINK_POLICIES")
+    for name, (handler, default_policy) in SINKS.items():
+        SINK_WORKERS.append(SinkWorker(name, handler, match_pattern_rules(policies, name, default_policy)))
+    if SAMPLE_STORE and "store" in SINKS:
+        SAMPLE_STORE.thread.start()
+    log.info("Sinks started: %s", ", ".join(f"{w.name} ({w.policy})" for w in SINK_WORKERS))
+
+def emit(batch):
+    for worker in SINK_WORKERS:
+        worker.put(batch)
+
+# ----------------------------
+# Register profiles
+# REGISTER_PROFILE and "profile" in METERS_FILE name JSON/YAML profile files, "" is the built-in
+# map. Each profile is validated and compiled once into poll groups, read plans, codecs and its
+# packed schema. Profiles are reloaded on SIGHUP and when a file changes (PROFILE_WATCH_INTERVAL):
+# the poll loops pick up the new MeterProfile at their next cycle, the Modbus and MQTT
+# connections stay open. A profile that fails to load keeps the previous one in service.
+# ----------------------------
+class MeterProfile:
+    """A register map compiled for polling"""
+
+    def __init__(self, regmap, derived):
+        self.map = regmap
+        self.registers = regmap.registers
+        self.names = regmap.names
+        self.poll_plan = compile_poll_groups(POLL_GROUPS, self.registers)
+        self.read_plan = compile_read_plan(self.registers)  # whole map, for fresh reads
+        # packed snapshot layout: the map's registers, then the derived quantities
+        self.sample_names = [entry.name for entry in self.registers] + [name for name, _, _, _ in derived]
+        self.snapshot_values = struct.Struct(f">{len(self.sample_names)}d")
+        self.schema = build_schema_descriptor(self.registers, derived)
+        self.schema_payload = json.dumps(self.schema)
+        # name -> (address, unit, word count, integer raw value, integer value) to rebuild API entries
+        # from the shard table
+        self.api_fields = {}
+        for entry in self.registers:
+            divisor, unit = scaling(entry)
+            integer = entry.value_type == "int"
+            self.api_fields[entry.name] = (hex(int(entry.address)), unit, entry.size_bytes // 2, integer,
+                                           integer and divisor is None)
+        self.api_fields.update((name, (None, unit, 0, False, False)) for name, unit, _, _ in derived)
+        ENTRY_CODECS.update((entry, compile_codec(entry.size_bytes // 2, [(entry, 0)])) for entry in self.registers)
+        for group in self.poll_plan:
+            log.info("Register map %s: poll group %s with %d register(s) in %d block read(s)",
+                     regmap.label, group["name"], len(group["names"]), len(group["plan"]))
+
+PROFILES = {REGISTER_PROFILE: MeterProfile(DEFAULT_MAP, DERIVED)}
+PROFILE_MTIMES = {}
+PROFILE_LOCK = threading.Lock()
+PROFILE_RELOAD = threading.Event()  # set by SIGHUP
+
+def profile_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns if path else None
+    except OSError:
+        return None
+
+PROFILE_MTIMES[REGISTER_PROFILE] = profile_mtime(REGISTER_PROFILE)
+
+def update_name_tables(derived, counters, registers):
+    """Rebuild everything keyed by sample name for the registers of all loaded profiles"""
+    global DERIVED, DERIVED_COUNTERS, SAMPLE_NAMES, PROM_FAMILIES, PROM_LEGACY, DEADBANDS, ROLLUP_NAMES
+    DERIVED, DERIVED_COUNTERS = derived, counters
+    SAMPLE_NAMES = [entry.name for entry in registers] + [name for name, _, _, _ in derived]
+    PROM_FAMILIES = compile_prom_families()
+    PROM_LEGACY = compile_prom_legacy(PROM_FAMILIES)
+    DEADBANDS = compile_deadbands(PUBLISH_DEADBANDS, SAMPLE_NAMES)
+    ROLLUP_NAMES = match_names(SAMPLE_NAMES, ROLLUP_PATTERNS)
+    if SAMPLE_STORE:
+        SAMPLE_STORE.names = match_names(SAMPLE_NAMES, STORE_PATTERNS)
+
+def load_profiles(paths, force=False):
+    """(Re)load the profiles in `paths` plus the loaded ones; raises if any of them is invalid.
+
+    Unchanged files are not parsed again unless `force` is set. Returns the paths whose profile changed.
+    """
+    global REGISTER_CACHE, REGISTER_NAMES
+    with PROFILE_LOCK:
+        maps = {}
+        for path in set(PROFILES) | set(paths):
+            mtime = profile_mtime(path)
+            if path in PROFILES and mtime == PROFILE_MTIMES.get(path) and not (force and path):
+                maps[path] = PROFILES[path].map
+                continue
+            # remember what was tried, so a broken file is reported once and not on every check
+            PROFILE_MTIMES[path] = mtime
+            maps[path] = load_profile(path) if path else BUILTIN_MAP
+        if all(path in PROFILES and PROFILES[path].map is regmap for path, regmap in maps.items()):
+            return []
+        registers = {}
+        for path in sorted(maps):
+            for entry in maps[path].registers:
+                registers.setdefault(entry.name, entry)
+        derived, counters = compile_derived(DERIVED_METRICS, DERIVED_FORMULAS, list(registers.values()))
+        same_derived = [d[0] for d in derived] == [d[0] for d in DERIVED]
+        changed = [path for path in sorted(maps)
+                   if path not in PROFILES or PROFILES[path].map is not maps[path] or not same_derived]
+        if not changed:
+            return []
+        profiles = {path: MeterProfile(maps[path], derived) for path in changed}
+        update_name_tables(derived, counters, list(registers.values()))
+        PROFILES.update(profiles)
+        if REGISTER_PROFILE in profiles and not METERS_FILE:
+            REGISTER_CACHE = RegisterCache(PROFILES[REGISTER_PROFILE].registers)
+            REGISTER_NAMES = PROFILES[REGISTER_PROFILE].names
+        return changed
+
+def reload_profiles(force=False):
+    try:
+        changed = load_profiles([], force)
+    except (OSError, ValueError, RuntimeError) as e:
+        log.error("Register profile reload failed, keeping the current maps: %s", e)
+        return
+    for path in changed:
+        log.info("Register profile %s reloaded: %s with %d register(s)",
+                 path or "(built-in)", PROFILES[path].map.label, len(PROFILES[path].registers))
+
+def profile_watch_loop():
+    while True:
+        forced = PROFILE_RELOAD.wait(PROFILE_WATCH_INTERVAL if PROFILE_WATCH_INTERVAL > 0 else None)
+        PROFILE_RELOAD.clear()
+        reload_profiles(force=forced)
+
+def switch_profile(profile, schedule, breaker, state):
+    """PollSchedule for a reloaded profile; the circuit breaker and its backoff carry over"""
+    new_schedule = PollSchedule(profile.poll_plan, schedule.meter)
+    if breaker.state == "open":
+        new_schedule.defer(breaker.retry_at)
+    state["poll_groups"] = new_schedule.stats
+    state["register_map"] = profile.map.label
+    log.info("%sSwitched to register map %s (%d register(s))",
+             f"[{schedule.meter}] " if schedule.meter else "", profile.map.label, len(profile.registers))
+    return new_schedule
+
 # ----------------------------
 # Main loop
 # ----------------------------
 def modbus_loop():
-    global latest_data
+    global latest_data, upstream_client
     mqtt_connect()
     client = None
+    start_sinks()
+    profile = PROFILES[REGISTER_PROFILE]
+    schedule = PollSchedule(profile.poll_plan)
+    breaker = CircuitBreaker(schedule.metrics)
+    latest_data["poll_groups"] = schedule.stats
+    latest_data["register_map"] = profile.map.label
+    registers = {}
+    where = f"{MODBUS_HOST}:{MODBUS_PORT}"
     while True:
         try:
+            if PROFILES[REGISTER_PROFILE] is not profile:
+                profile = PROFILES[REGISTER_PROFILE]
+                schedule = switch_profile(profile, schedule, breaker, latest_data)
+                registers = {k: v for k, v in registers.items() if k in profile.names}
+            # wait for the next clock-aligned tick (deferred while the circuit is open)
+            delay = schedule.next_tick() - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            started = time.time()
+            groups = schedule.due_groups(started)
+            if not groups:
+                continue
+            breaker.before_cycle(started)
+
             if client is None:
-                client = ModbusTcpClient(MODBUS_HOST, port=MODBUS_PORT, timeout=5)
+                client = ModbusTcpClient(MODBUS_HOST, port=MODBUS_PORT, timeout=MODBUS_TIMEOUT, retries=MODBUS_RETRIES)
                 if not client.connect():
-                    log.warning("Cannot connect to Modbus %s:%s — retry in 5s", MODBUS_HOST, MODBUS_PORT)
-                    latest_data["connection_status"] = f"Connection failed to {MODBUS_HOST}:{MODBUS_PORT}"
+                    log.warning("Cannot connect to Modbus %s", where)
+                    schedule.metrics.error("connection", "connect")
                     client.close()
                     client = None
-                    time.sleep(5)
-                    continue
-                log.info("Connected to Modbus %s:%s", MODBUS_HOST, MODBUS_PORT)
-                latest_data["connection_status"] = "Connected"
-
-            results = {}
-            for entry in REGISTERS:
-                res = read_register_entry(client, entry)
-                if res is None:
+                    fail_cycle(schedule, breaker, f"Connection failed to {where}")
                     continue
-                # scale value
-                scaled, scaled_unit = scale_value_by_name(res["name"], res["value_raw"], res["unit_raw"])
-                # publish per-register JSON
-                topic = f"{MQTT_TOPIC_PREFIX}/{res['name']}"
-                payload = {
-                    "value": scaled,
-                    "unit": scaled_unit,
-                    "raw_value": res["value_raw"],
-                    "raw_registers": res["raw_registers"],
-                    "address": res["address"],
-                    "timestamp": res["timestamp"]
-                }
-                try:
-                    mqtt_client.publish(topic, json.dumps(payload), qos=MQTT_QOS, retain=MQTT_RETAIN)
-                    log.debug("Published %s -> %s", topic, payload)
-                except Exception as e:
-                    log.warning("MQTT publish failed for %s: %s", topic, e)
+                log.info("Connected to Modbus %s", where)
+                upstream_client = client
 
-                # Prometheus metric
-                try:
-                    PROM_GAUGES[res["name"]].set(float(scaled))
-                except Exception:
-                    # if metric not present or conversion fails, skip
-                    pass
-
-                # Store for API/Webhooks (with unit information)
-                results[res["name"]] = {
-                    "value": scaled,
-                    "unit": scaled_unit,
-                    "raw_value": res["value_raw"],
-                    "raw_registers": res["raw_registers"],
-                    "address": res["address"]
-                }
+            budget = CycleBudget(started, schedule.deadline(groups), schedule.metrics)
+            samples = []
+            for group in groups:
+                for block in group["plan"]:
+                    samples.extend(read_block(client, block, schedule.metrics, budget))
 
-            # snapshot (combined)
-            snapshot_topic = f"{MQTT_TOPIC_PREFIX}/snapshot"
-            snapshot_payload = {"timestamp": int(time.time()), "data": results}
-            try:
-                mqtt_client.publish(snapshot_topic, json.dumps(snapshot_payload), qos=MQTT_QOS, retain=MQTT_RETAIN)
-            except Exception as e:
-                log.warning("MQTT publish failed for snapshot: %s", e)
-
-            SNAPSHOT_GAUGE.set(int(time.time()))
+            if budget.aborted:
+                log.warning("Poll cycle aborted after %d register(s): %s", len(samples), budget.aborted)
+                # a late response could still arrive: continue on a fresh connection
+                with UPSTREAM_LOCK:
+                    upstream_client = None
+                    client.close()
+                client = None
+            if not samples:
+                fail_cycle(schedule, breaker, f"No response from {where}")
+                continue
+            breaker.success()
+            set_connection_status("Connected")
 
-            # Update global state for API/Webhooks
-            latest_data["registers"] = results
-            latest_data["timestamp"] = int(time.time())
+            # registers of groups not polled in this tick keep their last value
+            polled = frozenset().union(*(group["names"] for group in groups))
+            samples_out = samples + derive_samples(None, samples)
+            registers = merge_samples(samples_out, {k: v for k, v in registers.items() if k not in polled})
+            emit(SampleBatch(None, MQTT_TOPIC_PREFIX, int(time.time()), tuple(samples_out), registers, profile))
 
-            time.sleep(INTERVAL)
+            schedule.complete(groups, started, samples)
         except KeyboardInterrupt:
             log.info("Stopping due to KeyboardInterrupt")
             break
         except Exception as e:
-            log.exception("Main loop exception: %s — reconnecting in 5s", e)
-            latest_data["connection_status"] = f"Error: {str(e)}"
+            log.exception("Main loop exception: %s", e)
             if client:
-                client.close()
+                with UPSTREAM_LOCK:
+                    upstream_client = None
+                    client.close()
                 client = None
-            time.sleep(5)
+            fail_cycle(schedule, breaker, f"Error: {str(e)}")
+
+# ----------------------------
+# Fleet mode: poll many meters concurrently from one asyncio event loop
+# METERS_FILE is a JSON list of meters:
+#   [{"name": "house", "host": "192.168.1.100", "port": 502, "unit_id": 1, "topic_prefix": "meter/house"}, ...]
+# Only "name" and "host" are required; port/unit_id default to MODBUS_PORT/MODBUS_UNIT_ID,
+# topic_prefix to <MQTT_TOPIC_PREFIX>/<name> and profile (relative to the meters file) to REGISTER_PROFILE.
+# ----------------------------
+def load_meters(path):
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    meters = []
+    for entry in entries:
+        if "name" not in entry or "host" not in entry:
+            raise ValueError(f"Meter entry needs 'name' and 'host': {entry}")
+        meters.append({
+            "name": str(entry["name"]),
+            "host": entry["host"],
+            "port": int(entry.get("port", MODBUS_PORT)),
+            "unit_id": int(entry.get("unit_id", MODBUS_UNIT_ID)),
+            "pipeline": int(entry.get("pipeline", MODBUS_PIPELINE)),
+            "topic_prefix": entry.get("topic_prefix", f"{MQTT_TOPIC_PREFIX}/{entry['name']}"),
+            "profile": os.path.join(os.path.dirname(path), entry["profile"]) if entry.get("profile") else REGISTER_PROFILE,
+        })
+    names = [m["name"] for m in meters]
+    if len(set(names)) != len(names):
+        raise ValueError("Meter names in METERS_FILE must be unique")
+    return meters
+
+MBAP_HEADER = struct.Struct(">HHHB")  # transaction id, protocol id, length, unit id
+
+class ModbusTcpTransport:
+    """Modbus TCP connection shared by all meters behind one host:port (fleet mode).
+
+    Up to `pipeline` transactions are outstanding at a time; answers are matched to their
+    requests by the MBAP transaction id, so unit ids behind a TCP/RTU gateway and the blocks of
+    one cycle do not wait for each other's round trip. pipeline=1 keeps strictly one request on
+    the wire for gateways that cannot queue. Answers arriving after their request timed out are
+    dropped. Callers hold one of `slots` around each request.
+    """
+
+    def __init__(self, host, port, pipeline=1):
+        self.host = host
+        self.port = port
+        self.pipeline = max(1, pipeline)
+        self.slots = asyncio.Semaphore(self.pipeline)
+        self.connecting = asyncio.Lock()
+        self.writer = None
+        self.receiver = None
+        self.pending = {}
+        self.transaction_ids = itertools.count(1)
+        self.last_answer = 0.0
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self, timeout):
+        async with self.connecting:
+            if self.connected:
+                return True
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+            except (OSError, asyncio.TimeoutError):
+                return False
+            self.writer = writer
+            self.last_answer = time.monotonic()
+            self.receiver = asyncio.create_task(self.receive(reader, writer))
+            log.info("Connected to Modbus %s:%s (pipeline %d)", self.host, self.port, self.pipeline)
+            return True
+
+    async def receive(self, reader, writer):
+        try:
+            while True:
+                transaction_id, _, length, _ = MBAP_HEADER.unpack(await reader.readexactly(MBAP_HEADER.size))
+                pdu = await reader.readexactly(max(length - 1, 0))
+                self.last_answer = time.monotonic()
+                future = self.pending.pop(transaction_id, None)
+                if future is not None and not future.done():
+                    future.set_result(pdu)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            log.debug("Modbus %s:%s closed: %s", self.host, self.port, e)
+        self.drop(writer, ConnectionException(f"Connection to {self.host}:{self.port} lost"))
+
+    def drop(self, writer, error):
+        if writer is not self.writer:
+            return
+        self.writer = None
+        writer.close()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    def close(self):
+        if self.writer is not None:
+            self.drop(self.writer, ConnectionException(f"Connection to {self.host}:{self.port} closed"))
+
+    def close_if_silent(self, seconds):
+        """Drop the connection if nothing at all came back for `seconds` (reconnect on the next cycle)"""
+        if self.connected and time.monotonic() - self.last_answer > seconds:
+            log.warning("No answers from Modbus %s:%s for %.1fs, reconnecting", self.host, self.port, seconds)
+            self.close()
+
+    async def read_holding_registers(self, address, count, unit_id, timeout):
+        if not self.connected:
+            raise ConnectionException(f"Not connected to {self.host}:{self.port}")
+        transaction_id = next(self.transaction_ids) & 0xFFFF
+        while transaction_id in self.pending:
+            transaction_id = next(self.transaction_ids) & 0xFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[transaction_id] = future
+        self.writer.write(MBAP_HEADER.pack(transaction_id, 0, 6, unit_id) + struct.pack(">BHH", 0x03, address, count))
+        try:
+            pdu = await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(transaction_id, None)
+        if len(pdu) >= 2 and pdu[0] == 0x83:
+            raise ModbusReadError(f"Exception response {pdu[1]}", ExceptionResponse(0x03, pdu[1]))
+        if len(pdu) != 2 + 2 * count or pdu[0] != 0x03 or pdu[1] != 2 * count:
+            raise ModbusReadError(f"Malformed response to {hex(address)}+{count}")
+        return list(struct.unpack_from(f">{count}H", pdu, 2))
+
+async def read_register_entry_async(transport, entry, unit_id, metrics, budget):
+    addr_hex, name, unit, size_bytes, signed = entry[:5]
+    base_address = int(addr_hex)
+    async with transport.slots:
+        timeout = budget.timeout()
+        if timeout is None:
+            return None
+        started = time.perf_counter()
+        try:
+            registers = await transport.read_holding_registers(base_address + MODBUS_ADDRESS_OFFSET, size_bytes // 2,
+                                                               unit_id, timeout)
+            metrics.request("single", time.perf_counter() - started)
+            budget.result(True)
+            return decode_block(ENTRY_CODECS[entry], registers, int(time.time()))[0]
+        except Exception as e:
+            metrics.error(error_class(e), f"{hex(base_address)}+{size_bytes // 2}")
+            budget.result(False)
+            log.debug("Exception reading %s (%s): %s", name, hex(base_address), e)
+            return None
+
+async def read_block_async(transport, block, unit_id, metrics, budget):
+    start, count, members, codec = block
+    async with transport.slots:
+        timeout = budget.timeout()
+        if timeout is None:
+            return []
+        started = time.perf_counter()
+        try:
+            registers = await transport.read_holding_registers(start + MODBUS_ADDRESS_OFFSET, count, unit_id, timeout)
+            metrics.request("block", time.perf_counter() - started)
+            budget.result(True)
+            return decode_block(codec, registers, int(time.time()))
+        except Exception as e:
+            metrics.error(error_class(e), f"{hex(start)}+{count}")
+            budget.result(False)
+            log.debug("Exception reading block %s (+%d words): %s", hex(start), count, e)
+    if len(members) > 1:
+        results = await asyncio.gather(*(read_register_entry_async(transport, entry, unit_id, metrics, budget)
+                                         for entry, _ in members))
+        return [res for res in results if res]
+    return []
+
+def update_fleet_status():
+    meters = latest_data["meters"].values()
+    connected = sum(1 for m in meters if m["connection_status"] == "Connected")
+    latest_data["connection_status"] = f"{connected}/{len(meters)} meters connected"
+
+async def poll_meter(meter, host_limit, transport):
+    # name None: the single meter of RUNTIME=asyncio, its state is latest_data itself
+    state = latest_data if meter["name"] is None else latest_data["meters"][meter["name"]]
+    where = f"{meter['host']}:{meter['port']} (unit {meter['unit_id']})"
+    label = meter["name"] or f"{meter['host']}:{meter['port']}"
+    profile = PROFILES[meter["profile"]]
+    schedule = PollSchedule(profile.poll_plan, meter["name"])
+    breaker = CircuitBreaker(schedule.metrics)
+    state["poll_groups"] = schedule.stats
+    state["register_map"] = profile.map.label
+    registers = {}
+    while True:
+        try:
+            if PROFILES[meter["profile"]] is not profile:
+                profile = PROFILES[meter["profile"]]
+                schedule = switch_profile(profile, schedule, breaker, state)
+                registers = {k: v for k, v in registers.items() if k in profile.names}
+            delay = schedule.next_tick() - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = time.time()
+            groups = schedule.due_groups(started)
+            if not groups:
+                continue
+            breaker.before_cycle(started)
+
+            if not transport.connected and not await transport.connect(MODBUS_TIMEOUT):
+                log.warning("[%s] Cannot connect to Modbus %s", label, where)
+                schedule.metrics.error("connection", "connect")
+                fail_cycle(schedule, breaker, f"Connection failed to {where}")
+                continue
+
+            budget = CycleBudget(started, schedule.deadline(groups), schedule.metrics)
+            async with host_limit:
+                # All blocks of the cycle are issued at once; transport.slots decides how many are in flight
+                results = await asyncio.gather(*(read_block_async(transport, block, meter["unit_id"],
+                                                                  schedule.metrics, budget)
+                                                 for group in groups for block in group["plan"]))
+            samples = [sample for result in results for sample in result]
+
+            if budget.aborted:
+                log.warning("[%s] Poll cycle aborted after %d register(s): %s", label, len(samples), budget.aborted)
+                # Other meters share the connection: only reconnect if the whole gateway went silent
+                transport.close_if_silent(MODBUS_TIMEOUT)
+            if not samples:
+                fail_cycle(schedule, breaker, f"No response from {where}")
+                continue
+            breaker.success()
+            set_connection_status("Connected", meter["name"])
+
+            polled = frozenset().union(*(group["names"] for group in groups))
+            samples_out = samples + derive_samples(meter["name"], samples)
+            registers = merge_samples(samples_out, {k: v for k, v in registers.items() if k not in polled})
+            emit(SampleBatch(meter["name"], meter["topic_prefix"], int(time.time()), tuple(samples_out), registers,
+                             profile))
+
+            schedule.complete(groups, started, samples)
+        except Exception as e:
+            log.exception("[%s] Poll exception: %s", label, e)
+            fail_cycle(schedule, breaker, f"Error: {str(e)}")
+
+async def fleet_main(meters):
+    host_limits = {}
+    pipelines = {}
+    for meter in meters:
+        host_limits.setdefault(meter["host"], asyncio.Semaphore(FLEET_HOST_CONCURRENCY))
+        # Meters behind the same host:port share one connection with the smallest pipeline configured
+        key = (meter["host"], meter["port"])
+        pipelines[key] = min(pipelines.get(key, meter["pipeline"]), meter["pipeline"])
+    transports = {key: ModbusTcpTransport(*key, pipeline) for key, pipeline in pipelines.items()}
+    tasks = [asyncio.create_task(poll_meter(meter, host_limits[meter["host"]],
+                                            transports[(meter["host"], meter["port"])]), name=meter["name"])
+             for meter in meters]
+    log.info("Fleet mode: polling %d meter(s) over %d connection(s) on %d host(s)",
+             len(meters), len(transports), len(host_limits))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for transport in transports.values():
+            transport.close()
+
+def init_fleet_state(meters):
+    for meter in meters:
+        latest_data["meters"][meter["name"]] = {
+            "timestamp": None,
+            "connection_status": "Not connected",
+            "host": meter["host"],
+            "unit_id": meter["unit_id"],
+            "topic_prefix": meter["topic_prefix"],
+            "registers": {}
+        }
+    update_fleet_status()
+    publish_snapshot()
+
+def fleet_loop(meters):
+    mqtt_connect()
+    start_sinks()
+    init_fleet_state(meters)
+    asyncio.run(fleet_main(meters))
+
+# ----------------------------
+# Sharded fleet mode (FLEET_SHARDS > 1)
+# The meters are split over shard processes, each polling its meters with fleet_main and
+# publishing to MQTT (rollups and the store included) on its own connection, so decoding and
+# encoding run on several cores. Meters behind the same host:port stay in one shard.
+# Shards write every cycle into a SnapshotTable in shared memory; the front-end process (API,
+# /metrics, stream, history) reads changed rows from it and feeds its own sinks. Shards are
+# supervised one by one and restarted with a backoff when they exit.
+# ----------------------------
+SHARD_READ_INTERVAL = 0.25  # seconds between scans of the table in the front-end
+SHARD_STATS_INTERVAL = 2.0  # seconds between exports of the poll statistics to the table
+SHARD_BACKOFF_MAX = 60.0
+SHARD_TABLE = None  # SnapshotTable in the front-end and in shard processes
+SHARD_ROWS = {}     # meter name -> table row (shard processes)
+SHARD_PROCESSES = []
+SHARD_STATS = {}    # meter name -> poll statistics exported by its shard (front-end)
+
+class SnapshotTable:
+    """Latest register values of all meters in one shared memory block, a row per meter.
+
+    Per row: sequence number, batch timestamp and connection status (UTF-8, zero padded);
+    per cell (row x sample name): scaled value, raw value, sequence number of the write that
+    set it and up to four raw words. Every region is a typed memoryview of the block, so
+    neither side pickles or copies messages. Each row has a single writer (its shard) and is
+    guarded by a seqlock: the sequence number is odd while the row is written, a reader that
+    sees it odd or changed retries. Writers within the shard are serialized by a lock.
+    Raw values are kept as doubles and exact up to 2**53.
+    Each row also holds the meter's poll statistics for /api/stats as JSON (zero padded),
+    refreshed by the shard every SHARD_STATS_INTERVAL seconds.
+    """
+    STATUS_BYTES = 160
+    STATS_BYTES = 4096
+    WORDS = 4
+
+    def __init__(self, rows, columns, name=None):
+        self.rows = rows
+        self.columns = list(columns)
+        self.index = {column: i for i, column in enumerate(self.columns)}
+        cells = rows * len(self.columns)
+        regions = [("seq", "Q", rows), ("timestamp", "d", rows), ("value", "d", cells), ("raw", "d", cells),
+                   ("written", "d", cells), ("words", "H", cells * self.WORDS), ("status", "B", rows * self.STATUS_BYTES),
+                   ("stats", "B", rows * self.STATS_BYTES)]
+        layout, size = [], 0
+        for key, fmt, count in regions:
+            layout.append((key, fmt, size, count * struct.calcsize(fmt)))
+            size += -(-count * struct.calcsize(fmt) // 8) * 8  # keep every region 8-byte aligned
+        self.owner = name is None
+        self.lock = threading.Lock()
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=max(size, 8))
+        self.views = []
+        for key, fmt, offset, length in layout:
+            view = self.shm.buf[offset:offset + length].cast(fmt)
+            self.views.append(view)
+            setattr(self, key, view)
+        if self.owner:
+            self.value[:] = array("d", [math.nan]) * cells
+            self.raw[:] = array("d", [math.nan]) * cells
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, row, timestamp, samples):
+        base = row * len(self.columns)
+        with self.lock:
+            seq = self.seq[row] | 1  # odd: row is being written (also after a shard died mid-write)
+            self.seq[row] = seq
+            try:
+                for res in samples:
+                    column = self.index.get(res["name"])
+                    if column is None:
+                        continue  # added by a profile reload after the table was laid out
+                    cell = base + column
+                    raw = res["value_raw"]
+                    self.value[cell] = float(res["value"])
+                    self.raw[cell] = math.nan if raw is None else float(raw)
+                    self.written[cell] = seq + 1
+                    words = res["raw_registers"][:self.WORDS]
+                    self.words[cell * self.WORDS:cell * self.WORDS + len(words)] = array("H", words)
+                self.timestamp[row] = timestamp
+            finally:
+                self.seq[row] = seq + 1
+
+    def write_status(self, row, status):
+        data = status.encode("utf-8")[:self.STATUS_BYTES].ljust(self.STATUS_BYTES, b"\0")
+        with self.lock:
+            seq = self.seq[row] | 1
+            self.seq[row] = seq
+            self.status[row * self.STATUS_BYTES:(row + 1) * self.STATUS_BYTES] = data
+            self.seq[row] = seq + 1
+
+    def write_stats(self, row, stats):
+        data = json.dumps(stats, separators=(",", ":")).encode("utf-8")
+        if len(data) > self.STATS_BYTES:
+            # many failing blocks: keep the error totals per class only
+            stats = dict(stats, poll=dict(stats["poll"], errors={error: {"*": sum(blocks.values())}
+                                                                 for error, blocks in stats["poll"]["errors"].items()}))
+            data = json.dumps(stats, separators=(",", ":")).encode("utf-8")
+            if len(data) > self.STATS_BYTES:
+                return False
+        data = data.ljust(self.STATS_BYTES, b"\0")
+        with self.lock:
+            seq = self.seq[row] | 1
+            self.seq[row] = seq
+            self.stats[row * self.STATS_BYTES:(row + 1) * self.STATS_BYTES] = data
+            self.seq[row] = seq + 1
+        return True
+
+    def read_stats(self, row, attempts=3):
+        """Poll statistics last written by the shard, None before the first export or while written"""
+        for _ in range(attempts):
+            seq = self.seq[row]
+            if seq & 1:
+                continue
+            data = bytes(self.stats[row * self.STATS_BYTES:(row + 1) * self.STATS_BYTES]).rstrip(b"\0")
+            if self.seq[row] == seq:
+                return json.loads(data) if data else None
+        return None
+
+    def read(self, row, since, attempts=3):
+        """(seq, timestamp, status, [(name, value, raw, words)] written after `since`), None while written"""
+        base = row * len(self.columns)
+        for _ in range(attempts):
+            seq = self.seq[row]
+            if seq & 1:
+                continue
+            cells = [(name, self.value[base + i], self.raw[base + i],
+                      self.words[(base + i) * self.WORDS:(base + i + 1) * self.WORDS].tolist())
+                     for i, name in enumerate(self.columns) if self.written[base + i] > since]
+            timestamp = self.timestamp[row]
+            status = bytes(self.status[row * self.STATUS_BYTES:(row + 1) * self.STATUS_BYTES]).rstrip(b"\0")
+            if self.seq[row] == seq:
+                return seq, timestamp, status.decode("utf-8", "replace"), cells
+        return None
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def table_sink(batch):
+    SHARD_TABLE.write(SHARD_ROWS[batch.meter], batch.timestamp, batch.samples)
+
+def assign_shards(meters, count):
+    """Split meters into at most `count` shards; meters sharing a host:port (one connection) stay together"""
+    groups = {}
+    for meter in meters:
+        groups.setdefault((meter["host"], meter["port"]), []).append(meter)
+    shards = [[] for _ in range(count)]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(shards, key=len).extend(group)
+    return [shard for shard in shards if shard]
+
+def shard_main(index, meters, table_name, rows, columns):
+    """Entry point of a shard process"""
+    global SHARD_TABLE
+    SHARD_TABLE = SnapshotTable(rows, columns, table_name)
+    SHARD_ROWS.update((meter["name"], meter["row"]) for meter in meters)
+    # the front-end serves the API from the table; MQTT, rollups and the store are done here
+    for name in ("state", "stream", "history"):
+        SINKS.pop(name, None)
+    SINKS["table"] = (table_sink, "drop-oldest")
+    if PROMETHEUS_PORT:
+        start_http_server(PROMETHEUS_PORT + 1 + index)
+    load_profiles({meter["profile"] for meter in meters})
+    start_profile_watch(meters)
+    parent = os.getppid()
+    threading.Thread(target=exit_with_parent, args=(parent,), name="parent-watch", daemon=True).start()
+    threading.Thread(target=shard_stats_loop, args=(index,), name="shard-stats", daemon=True).start()
+    log.info("Shard %d: polling %d meter(s)%s", index, len(meters),
+             f", runtime metrics on :{PROMETHEUS_PORT + 1 + index}/metrics" if PROMETHEUS_PORT else "")
+    fleet_loop(meters)
+
+def shard_stats_loop(index):
+    """Shard: export the poll statistics of its meters for /api/stats in the front-end"""
+    while True:
+        time.sleep(SHARD_STATS_INTERVAL)
+        mqtt_stats = PUBLISH_TRACKER.summary()
+        for name, row in SHARD_ROWS.items():
+            state = latest_data["meters"].get(name, {})
+            stats = {"shard": index, "poll": poll_metrics(name).summary(), "mqtt": mqtt_stats,
+                     "poll_groups": state.get("poll_groups"), "register_map": state.get("register_map")}
+            if not SHARD_TABLE.write_stats(row, stats):
+                log.debug("[%s] Poll statistics too large for the shard table", name)
+
+def exit_with_parent(parent):
+    while os.getppid() == parent:
+        time.sleep(1)
+    os._exit(0)
+
+class ShardSupervisor:
+    """Starts the shard processes and restarts each one on its own when it exits"""
+
+    def __init__(self, shards, table):
+        self.shards = shards
+        self.table = table
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = [None] * len(shards)
+        self.started = [0.0] * len(shards)
+        self.backoff = [0.0] * len(shards)
+        self.restart_at = [0.0] * len(shards)
+
+    def start(self, index):
+        process = self.context.Process(target=shard_main, name=f"shard-{index}", daemon=True,
+                                       args=(index, self.shards[index], self.table.name, self.table.rows,
+                                             self.table.columns))
+        # the child reads FLEET_SHARD while importing this module
+        os.environ["FLEET_SHARD"] = str(index)
+        try:
+            process.start()
+        finally:
+            del os.environ["FLEET_SHARD"]
+        self.processes[index] = process
+        SHARD_PROCESSES[:] = [p for p in self.processes if p is not None]
+        self.started[index] = time.monotonic()
+
+    def run(self):
+        for index in range(len(self.shards)):
+            self.start(index)
+        while True:
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                if not self.restart_at[index]:
+                    # a shard that ran for a while restarts quickly, one that keeps crashing backs off
+                    if now - self.started[index] > SHARD_BACKOFF_MAX:
+                        self.backoff[index] = 1.0
+                    else:
+                        self.backoff[index] = min(SHARD_BACKOFF_MAX, max(1.0, self.backoff[index] * 2))
+                    self.restart_at[index] = now + self.backoff[index]
+                    log.warning("Shard %d exited with code %s, restarting in %.0fs",
+                                index, process.exitcode, self.backoff[index])
+                    for meter in self.shards[index]:
+                        set_connection_status(f"Shard {index} restarting", meter["name"])
+                elif now >= self.restart_at[index]:
+                    self.restart_at[index] = 0.0
+                    self.start(index)
+            time.sleep(1)
+
+def shard_reader_loop(table, meters):
+    """Front-end: turn changed table rows into SampleBatches for the API, stream and history sinks"""
+    seen = [0] * table.rows
+    registers = {meter["name"]: {} for meter in meters}
+    next_stats = 0.0
+    while True:
+        if time.monotonic() >= next_stats:
+            next_stats = time.monotonic() + SHARD_STATS_INTERVAL
+            for meter in meters:
+                stats = table.read_stats(meter["row"])
+                if stats is None:
+                    continue
+                SHARD_STATS[meter["name"]] = stats
+                with SNAPSHOT_LOCK:
+                    state = latest_data["meters"][meter["name"]]
+                    state["poll_groups"] = stats["poll_groups"]
+                    state["register_map"] = stats["register_map"]
+        for meter in meters:
+            row, name = meter["row"], meter["name"]
+            if table.seq[row] == seen[row]:
+                continue
+            snapshot = table.read(row, seen[row])
+            if snapshot is None:
+                continue  # being written, next scan
+            seq, timestamp, status, cells = snapshot
+            seen[row] = seq
+            if status and status != latest_data["meters"][name]["connection_status"]:
+                set_connection_status(status, name)
+            if not cells:
+                continue
+            profile = PROFILES[meter["profile"]]
+            timestamp = int(timestamp)
+            samples = []
+            merged = dict(registers[name])
+            for column, value, raw, words in cells:
+                fields = profile.api_fields.get(column)
+                if fields is None:
+                    continue
+                address, unit, word_count, integer_raw, integer_value = fields
+                value = int(value) if integer_value else value
+                merged[column] = {
+                    "value": value,
+                    "unit": unit,
+                    "raw_value": None if math.isnan(raw) else int(raw) if integer_raw else raw,
+                    "raw_registers": words[:word_count],
+                    "address": address
+                }
+                samples.append({"name": column, "value": value, "timestamp": timestamp})
+            registers[name] = merged
+            emit(SampleBatch(name, meter["topic_prefix"], timestamp, tuple(samples), merged, profile))
+        time.sleep(SHARD_READ_INTERVAL)
+
+def sharded_fleet_loop(meters):
+    shards = assign_shards(meters, FLEET_SHARDS)
+    rows = 0
+    for shard in shards:
+        for meter in shard:
+            meter["row"] = rows
+            rows += 1
+    global SHARD_TABLE
+    SHARD_TABLE = table = SnapshotTable(rows, SAMPLE_NAMES)
+    atexit.register(table.close)
+    # polling, MQTT, rollups and the store run in the shards
+    for name in ("mqtt", "rollup", "store"):
+        SINKS.pop(name, None)
+    start_sinks()
+    init_fleet_state(meters)
+    log.info("Sharded fleet mode: %d meter(s) in %d shard process(es), table %s (%d bytes)",
+             len(meters), len(shards), table.name, table.shm.size)
+    threading.Thread(target=shard_reader_loop, args=(table, meters), name="shard-reader", daemon=True).start()
+    ShardSupervisor(shards, table).run()
+
+# ----------------------------
+# Modbus TCP gateway (GATEWAY_PORT, single meter mode)
+# Answers read holding registers (0x03) within the register map from REGISTER_CACHE; ranges older
+# than GATEWAY_MAX_AGE are read through the poller's connection. Addresses as on the meter
+# (including MODBUS_ADDRESS_OFFSET), any unit id is accepted.
+# ----------------------------
+GATEWAY_REQUESTS = Counter(f"{PROMETHEUS_PREFIX}_gateway_requests",
+                           "Modbus gateway reads by result (cache, coalesced, meter, error, unavailable)", ["result"])
+
+def gateway_read(address, count):
+    """Register words for a downstream read, or a Modbus exception code"""
+    if not 1 <= count <= 125:
+        return 0x03  # illegal data value
+    if not REGISTER_CACHE.covers(address, count):
+        return 0x02  # illegal data address
+    registers = REGISTER_CACHE.get(address, count, time.monotonic() - GATEWAY_MAX_AGE)
+    if registers is not None:
+        GATEWAY_REQUESTS.labels("cache").inc()
+        return registers
+    metrics = poll_metrics()
+    if metrics.circuit == "open":
+        GATEWAY_REQUESTS.labels("unavailable").inc()
+        return 0x0B  # gateway target device failed to respond
+    what = f"{hex(address)}+{count}"
+    try:
+        registers, coalesced = read_upstream(None, address, count, f"gateway {what}", metrics, "gateway",
+                                             metrics.adaptive_timeout())
+    except Exception as e:
+        metrics.error(error_class(e), what)
+        GATEWAY_REQUESTS.labels("error").inc()
+        log.debug("Gateway read %s failed: %s", what, e)
+        response = getattr(e, "response", None)
+        return response.exception_code if isinstance(response, ExceptionResponse) else 0x0B
+    GATEWAY_REQUESTS.labels("coalesced" if coalesced else "meter").inc()
+    return registers
+
+def gateway_response(pdu):
+    function = pdu[0]
+    if function != 0x03 or len(pdu) != 5:
+        return bytes((function | 0x80, 0x01))  # illegal function
+    address, count = struct.unpack_from(">HH", pdu, 1)
+    result = gateway_read(address - MODBUS_ADDRESS_OFFSET, count)
+    if isinstance(result, int):
+        return bytes((0x83, result))
+    return struct.pack(f">BB{count}H", 0x03, 2 * count, *result)
+
+class GatewayHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            header = self.rfile.read(MBAP_HEADER.size)
+            if len(header) < MBAP_HEADER.size:
+                return
+            transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack(header)
+            if protocol_id != 0 or not 2 <= length <= 254:
+                return
+            pdu = self.rfile.read(length - 1)
+            if len(pdu) < length - 1:
+                return
+            response = gateway_response(pdu)
+            self.wfile.write(MBAP_HEADER.pack(transaction_id, protocol_id, len(response) + 1, unit_id) + response)
+
+class GatewayServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_gateway():
+    server = GatewayServer(("0.0.0.0", GATEWAY_PORT), GatewayHandler)
+    threading.Thread(target=server.serve_forever, name="modbus-gateway", daemon=True).start()
+    log.info("Modbus gateway listening on :%s (max. age %ss)", GATEWAY_PORT, GATEWAY_MAX_AGE)
+
+# ----------------------------
+# On-demand fresh reads: ?max_age= on /api/data and /api/topic/<name>, MQTT <prefix>/request
+# Plan blocks whose cached words are older than max_age are read from the meter right away.
+# Concurrent requests share one meter transaction (read_upstream); reads that actually reach
+# the meter are limited to FRESH_READ_RATE per second across all callers.
+# ----------------------------
+REGISTER_NAMES = DEFAULT_MAP.names  # rebuilt when the default profile is reloaded
+FRESH_REQUEST_TOPIC = f"{MQTT_TOPIC_PREFIX}/request"
+FRESH_READS = Counter(f"{PROMETHEUS_PREFIX}_fresh_reads",
+                      "Blocks of on-demand reads by result (cache, coalesced, meter, rate_limited, error)", ["result"])
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"rate limit for fresh reads exceeded, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+class MeterUnavailable(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """0 when a token was taken, else seconds until the next one is available"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+FRESH_READ_LIMIT = TokenBucket(FRESH_READ_RATE, FRESH_READ_BURST)
+
+def fresh_samples(names, max_age):
+    """Samples of `names` no older than max_age seconds, reading only the plan blocks that are older"""
+    if METERS_FILE:
+        raise MeterUnavailable("fresh reads are only supported with a single meter")
+    if RUNTIME == "asyncio":
+        raise MeterUnavailable("fresh reads are not supported with RUNTIME=asyncio")
+    metrics = poll_metrics()
+    oldest = time.monotonic() - max_age
+    samples = []
+    for start, count, members, codec in PROFILES[REGISTER_PROFILE].read_plan:
+        if not any(entry[1] in names for entry, _ in members):
+            continue
+        registers, read_at = REGISTER_CACHE.read(start, count)
+        result = "cache"
+        if read_at < oldest:
+            if metrics.circuit == "open":
+                raise MeterUnavailable("circuit open, meter is not polled")
+            try:
+                registers, coalesced = read_upstream(None, start, count, f"fresh {hex(start)}+{count}", metrics,
+                                                     "fresh", metrics.adaptive_timeout(), FRESH_READ_LIMIT)
+            except RateLimited:
+                FRESH_READS.labels("rate_limited").inc()
+                raise
+            except Exception as e:
+                metrics.error(error_class(e), f"{hex(start)}+{count}")
+                FRESH_READS.labels("error").inc()
+                raise
+            read_at = time.monotonic()
+            result = "coalesced" if coalesced else "meter"
+        FRESH_READS.labels(result).inc()
+        timestamp = int(time.time() - (time.monotonic() - read_at))
+        samples.extend(res for res in decode_block(codec, registers, timestamp) if res["name"] in names)
+    return samples
+
+def parse_max_age(value):
+    max_age = float(value)
+    if not 0 <= max_age < math.inf:
+        raise ValueError("max_age must be a number of seconds >= 0")
+    return max_age
+
+def fresh_response(names, topic_name=None):
+    try:
+        max_age = parse_max_age(request.args["max_age"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        samples = fresh_samples(names, max_age)
+    except RateLimited as e:
+        return (jsonify({"error": "Rate limit for fresh reads exceeded", "retry_after": round(e.retry_after, 2)}), 429,
+                {"Retry-After": str(math.ceil(e.retry_after))})
+    except (MeterUnavailable, ConnectionException) as e:
+        return jsonify({"error": "Meter unavailable", "detail": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": "Meter read failed", "detail": str(e)}), 502
+    registers = merge_samples(samples, {})
+    timestamp = min(res["timestamp"] for res in samples)
+    if topic_name is not None:
+        return jsonify({"topic": topic_name, "data": registers[topic_name], "timestamp": timestamp})
+    with SNAPSHOT_LOCK:
+        data = dict(latest_data)
+    data["registers"] = merge_samples(samples, data["registers"])
+    data["timestamp"] = timestamp
+    return jsonify(data)
+
+def valid_reply_topic(topic):
+    return (isinstance(topic, str) and topic.startswith(f"{MQTT_TOPIC_PREFIX}/") and topic != FRESH_REQUEST_TOPIC
+            and not any(c in topic for c in "+#\0"))
+
+def answer_fresh_request(payload):
+    """Request: {"registers": [...], "max_age": 0, "id": ..., "reply_to": ...}, all fields optional"""
+    response = {"id": None}
+    reply_to = f"{MQTT_TOPIC_PREFIX}/response"
+    try:
+        req = json.loads(payload) if payload.strip() else {}
+        response["id"] = req.get("id")
+        if req.get("reply_to"):
+            # only answer below our own prefix, the bridge must not publish to arbitrary topics
+            if not valid_reply_topic(req["reply_to"]):
+                raise ValueError(f"reply_to must be a topic below {MQTT_TOPIC_PREFIX}/")
+            reply_to = req["reply_to"]
+        names = set(req.get("registers") or REGISTER_NAMES)
+        max_age = parse_max_age(req.get("max_age", 0))
+        unknown = names - REGISTER_NAMES
+        if unknown:
+            raise ValueError(f"unknown register(s): {', '.join(sorted(unknown))}")
+        samples = fresh_samples(names, max_age)
+        response["timestamp"] = min(res["timestamp"] for res in samples)
+        response["data"] = merge_samples(samples, {})
+    except RateLimited as e:
+        response["error"] = str(e)
+        response["retry_after"] = round(e.retry_after, 2)
+    except Exception as e:
+        response["error"] = str(e)
+        log.debug("Fresh read request failed: %s", e)
+    PUBLISH_TRACKER.publish(reply_to, ENCODE_DOCUMENT(response), MQTT_QOS, False)
+
+FRESH_REQUESTS = queue.Queue(maxsize=100)
+
+def fresh_request_loop():
+    # meter reads block, so requests are answered here instead of in paho's network thread
+    while True:
+        answer_fresh_request(FRESH_REQUESTS.get())
+
+def on_fresh_request(client, userdata, message):
+    try:
+        FRESH_REQUESTS.put_nowait(message.payload)
+    except queue.Full:
+        log.warning("Fresh read requests pile up, dropping one from %s", message.topic)
+
+FRESH_REQUEST_WORKER = threading.Thread(target=fresh_request_loop, name="fresh-requests", daemon=True)
+mqtt_client.message_callback_add(FRESH_REQUEST_TOPIC, on_fresh_request)
+
+# ----------------------------
+# RUNTIME=asyncio: one event loop for polling (fleet_main, the single meter is a fleet of one),
+# paho's network I/O (driven by socket callbacks instead of loop_start()), the API and /metrics
+# (uvicorn on API_PORT and PROMETHEUS_PORT) and the profile watch. The Flask routes run
+# unchanged in a pool of HTTP_WORKERS threads; sinks keep their own threads so a slow sink never
+# stalls the loop. SIGTERM/SIGINT stop the servers and poll tasks, close the Modbus connections
+# and disconnect from the broker before the process exits.
+# ----------------------------
+class AsyncioMqttDriver:
+    """Runs paho's network I/O on the event loop (reads, writes, keepalive and reconnects)"""
+
+    def __init__(self, client, loop):
+        self.client = client
+        self.loop = loop
+        self.thread = threading.get_ident()
+        client.on_socket_open = lambda client, userdata, sock: self.call(self.loop.add_reader, sock, client.loop_read)
+        client.on_socket_close = lambda client, userdata, sock: self.call(self.loop.remove_reader, sock)
+        client.on_socket_register_write = lambda client, userdata, sock: self.call(self.loop.add_writer, sock,
+                                                                                   client.loop_write)
+        client.on_socket_unregister_write = lambda client, userdata, sock: self.call(self.loop.remove_writer, sock)
+
+    def call(self, func, *args):
+        # sink threads publish too; the loop's reader/writer set is only touched from the loop
+        if threading.get_ident() == self.thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    async def run(self):
+        if MQTT_SPOOL:
+            self.client.max_queued_messages_set(1000)
+            threading.Thread(target=spool_replay_loop, name="spool-replay", daemon=True).start()
+        self.client.connect_async(MQTT_HOST, MQTT_PORT, keepalive=60)
+        while True:
+            if self.client.socket() is None:
+                try:
+                    # DNS, TCP connect and TLS handshake block: run them off the loop, the socket
+                    # callbacks hand the new socket back to the loop through call()
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    log.info("Connected to MQTT broker %s:%s", MQTT_HOST, MQTT_PORT)
+                except OSError as e:
+                    log.warning("MQTT connect failed: %s — retry in 5s", e)
+                    await asyncio.sleep(5)
+                    continue
+            self.client.loop_misc()  # keepalive pings and QoS retries
+            await asyncio.sleep(1)
+
+class WsgiAdapter:
+    """ASGI application running a WSGI app (the Flask API) in a thread pool.
+
+    The response is streamed chunk by chunk, so /api/stream keeps working; a client that
+    disconnects ends its response at the next chunk.
+    """
+
+    def __init__(self, wsgi_app, workers):
+        self.wsgi_app = wsgi_app
+        self.executor = concurrent.futures.ThreadPoolExecutor(max(1, workers), thread_name_prefix="http")
+
+    async def __call__(self, scope, receive, send):
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        disconnected = threading.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.respond, scope, b"".join(body),
+                                                             send, asyncio.get_running_loop(), disconnected)
+        finally:
+            watcher.cancel()
+
+    def respond(self, scope, body, send, loop, disconnected):
+        head = []
+
+        def start_response(status, headers, exc_info=None):
+            head[:] = [int(status.split(" ", 1)[0]),
+                       [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]]
+
+        def post(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = self.wsgi_app(self.environ(scope, body), start_response)
+        started = False
+        try:
+            for chunk in response:
+                if disconnected.is_set():
+                    return
+                if not started:
+                    post({"type": "http.response.start", "status": head[0], "headers": head[1]})
+                    started = True
+                if chunk:
+                    post({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not started:
+                post({"type": "http.response.start", "status": head[0], "headers": head[1]})
+            post({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+
+    @staticmethod
+    def environ(scope, body):
+        server = scope.get("server") or ("localhost", API_PORT)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": str(server[0]),
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope["headers"]:
+            key = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if key == "CONTENT_TYPE":
+                environ[key] = value
+            elif key != "CONTENT_LENGTH":
+                key = f"HTTP_{key}"
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+API_ASGI = WsgiAdapter(app, HTTP_WORKERS)
+
+async def asgi_app(scope, receive, send):
+    """PROMETHEUS_PORT serves the metrics on every path, API_PORT the Flask API and /metrics"""
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/metrics" or (scope.get("server") or (None, None))[1] == PROMETHEUS_PORT:
+        body = generate_latest(REGISTRY)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", CONTENT_TYPE_LATEST.encode("latin-1"))]})
+        await send({"type": "http.response.body", "body": body})
+        return
+    await API_ASGI(scope, receive, send)
+
+def listen_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    return sock
+
+async def profile_watch_async():
+    reload = asyncio.Event()
+
+    def on_sighup():
+        reload.set()
+        reload_on_sighup(signal.SIGHUP, None)  # forwards to the shards
+
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
+    while True:
+        try:
+            await asyncio.wait_for(reload.wait(), PROFILE_WATCH_INTERVAL if PROFILE_WATCH_INTERVAL > 0 else None)
+            forced = True
+        except asyncio.TimeoutError:
+            forced = False
+        reload.clear()
+        reload_profiles(force=forced)
+
+async def runtime_main(meters):
+    tasks = []
+    if REGISTER_PROFILE or any(meter["profile"] for meter in meters):
+        tasks.append(asyncio.create_task(profile_watch_async(), name="profile-watch"))
+        log.info("Reloading register profiles on SIGHUP%s",
+                 f" and every {PROFILE_WATCH_INTERVAL:g}s on change" if PROFILE_WATCH_INTERVAL > 0 else "")
+    if meters and FLEET_SHARDS > 1:
+        # the shards poll and publish, this process only serves their table
+        threading.Thread(target=sharded_fleet_loop, args=(meters,), daemon=True).start()
+    else:
+        tasks.append(asyncio.create_task(AsyncioMqttDriver(mqtt_client, asyncio.get_running_loop()).run(),
+                                         name="mqtt"))
+        start_sinks()
+        if meters:
+            init_fleet_state(meters)
+        else:
+            meters = [{"name": None, "host": MODBUS_HOST, "port": MODBUS_PORT, "unit_id": MODBUS_UNIT_ID,
+                       "pipeline": 1, "topic_prefix": MQTT_TOPIC_PREFIX, "profile": REGISTER_PROFILE}]
+        tasks.append(asyncio.create_task(fleet_main(meters), name="modbus"))
+    log.info("Asyncio runtime: API on port %s, Prometheus metrics on :%s/metrics", API_PORT, PROMETHEUS_PORT)
+    server = uvicorn.Server(uvicorn.Config(asgi_app, lifespan="off", log_config=None))
+    try:
+        # returns on SIGTERM/SIGINT
+        await server.serve([listen_socket(API_PORT), listen_socket(PROMETHEUS_PORT)])
+    finally:
+        log.info("Shutting down")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if mqtt_client.socket() is not None:
+            mqtt_client.disconnect()
+        API_ASGI.executor.shutdown(wait=False, cancel_futures=True)
+
+def run_asyncio():
+    if uvicorn is None:
+        raise RuntimeError("RUNTIME=asyncio requires the 'uvicorn' package")
+    if GATEWAY_PORT or MQTT_REQUESTS:
+        log.warning("GATEWAY_PORT and MQTT_REQUESTS need RUNTIME=threads, both stay disabled")
+    meters = []
+    if METERS_FILE:
+        meters = load_meters(METERS_FILE)
+        load_profiles({meter["profile"] for meter in meters})
+    # uvicorn re-raises the signal that stopped it: let SIGTERM unwind like SIGINT
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        asyncio.run(runtime_main(meters))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    log.info("Stopped")
+
+def reload_on_sighup(signum, frame):
+    PROFILE_RELOAD.set()
+    # shards reload their own profiles
+    for process in SHARD_PROCESSES:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGHUP)
+
+def start_profile_watch(meters):
+    """Reload register profiles on SIGHUP and file changes (call from the main thread)"""
+    if REGISTER_PROFILE or any(meter["profile"] for meter in meters):
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, reload_on_sighup)
+        threading.Thread(target=profile_watch_loop, name="profile-watch", daemon=True).start()
+        log.info("Reloading register profiles on SIGHUP%s",
+                 f" and every {PROFILE_WATCH_INTERVAL:g}s on change" if PROFILE_WATCH_INTERVAL > 0 else "")
 
 def main():
+    if RUNTIME == "asyncio":
+        return run_asyncio()
+    if RUNTIME != "threads":
+        raise ValueError(f"Unknown RUNTIME: {RUNTIME!r} (expected threads or asyncio)")
     # Start Prometheus server
     start_http_server(PROMETHEUS_PORT)
     log.info("Prometheus metrics available on :%s/metrics", PROMETHEUS_PORT)
 
-    # Start Modbus loop in background thread
-    modbus_thread = threading.Thread(target=modbus_loop, daemon=True)
+    if GATEWAY_PORT:
+        if METERS_FILE:
+            log.warning("GATEWAY_PORT is only supported with a single meter, the gateway stays disabled")
+        else:
+            start_gateway()
+    if MQTT_REQUESTS:
+        if METERS_FILE:
+            log.warning("MQTT_REQUESTS is only supported with a single meter, requests are not subscribed")
+        else:
+            FRESH_REQUEST_WORKER.start()
+            log.info("Answering fresh read requests on %s", FRESH_REQUEST_TOPIC)
+
+    # Start Modbus loop (single meter, fleet or sharded fleet) in background thread
+    if METERS_FILE:
+        meters = load_meters(METERS_FILE)
+        load_profiles({meter["profile"] for meter in meters})
+        if FLEET_SHARDS > 1:
+            modbus_thread = threading.Thread(target=sharded_fleet_loop, args=(meters,), daemon=True)
+        else:
+            modbus_thread = threading.Thread(target=fleet_loop, args=(meters,), daemon=True)
+    else:
+        meters = []
+        modbus_thread = threading.Thread(target=modbus_loop, daemon=True)
     modbus_thread.start()
     log.info("Modbus loop started")
 
+    start_profile_watch(meters)
+
     # Start Flask API server
     log.info("Starting API/Webhook server on port %s", API_PORT)
     app.run(host='0.0.0.0', port=API_PORT, debug=False)
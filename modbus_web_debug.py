@@ -12,7 +12,9 @@ import logging
 import threading
 from datetime import datetime
 from pymodbus.client import ModbusTcpClient
-from flask import Flask, render_template_string, jsonify
+from flask import Flask, Response, render_template_string, jsonify
+from event_stream import EventStream
+from register_map import BUILTIN_MAP, compile_codec, compile_read_plan, decode_block, load_profile
 
 # ----------------------------
 # Config from env
@@ -21,6 +23,10 @@ MODBUS_HOST = os.getenv("MODBUS_HOST", "127.0.0.1")
 MODBUS_PORT = int(os.getenv("MODBUS_PORT", "502"))
 MODBUS_UNIT_ID = int(os.getenv("MODBUS_UNIT_ID", "1"))
 MODBUS_ADDRESS_OFFSET = int(os.getenv("MODBUS_ADDRESS_OFFSET", "0"))
+READ_MAX_GAP = int(os.getenv("READ_MAX_GAP", "0"))
+READ_MAX_WORDS = min(int(os.getenv("READ_MAX_WORDS", "125")), 125)
+# JSON/YAML register profile (see README); empty = built-in Telstar 80A map
+REGISTER_PROFILE = os.getenv("REGISTER_PROFILE", "")
 
 INTERVAL = int(os.getenv("INTERVAL", "10"))
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -28,122 +34,58 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 # Web interface port
 WEB_PORT = int(os.getenv("WEB_PORT", "5000"))
 
+# Live stream (/api/stream): events kept for clients that fall behind, keep-alive interval in seconds
+STREAM_BACKLOG = int(os.getenv("STREAM_BACKLOG", "100"))
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "15"))
+
 logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO),
                     format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 log = logging.getLogger("modbus-web-viewer")
 
 # ----------------------------
-# Register mapping (from PDF)
-# ----------------------------
-REGISTERS = [
-    (0x2000, "serial_number", "", 4, False),
-    (0x2002, "date_time_utc", "unix", 4, False),
-    (0x2004, "active_power_total_mW", "mW", 4, True),
-    (0x2006, "active_power_l1_mW", "mW", 4, True),
-    (0x2008, "active_power_l2_mW", "mW", 4, True),
-    (0x200A, "active_power_l3_mW", "mW", 4, True),
-    (0x200C, "reactive_power_total_mVar", "mVar", 4, False),
-    (0x200E, "reactive_power_l1_mVar", "mVar", 4, False),
-    (0x2010, "reactive_power_l2_mVar", "mVar", 4, False),
-    (0x2012, "reactive_power_l3_mVar", "mVar", 4, False),
-    (0x2014, "voltage_l1_mV", "mV", 4, False),
-    (0x2016, "voltage_l2_mV", "mV", 4, False),
-    (0x2018, "voltage_l3_mV", "mV", 4, False),
-    (0x201A, "current_l1_mA", "mA", 4, True),
-    (0x201C, "current_l2_mA", "mA", 4, True),
-    (0x201E, "current_l3_mA", "mA", 4, True),
-    (0x2020, "power_factor_l1_raw", "1/1000", 2, False),
-    (0x2021, "power_factor_l2_raw", "1/1000", 2, False),
-    (0x2022, "power_factor_l3_raw", "1/1000", 2, False),
-    (0x2023, "active_tariff", "", 2, False),
-    (0x2024, "active_energy_import_total_mWh", "mWh", 8, False),
-    (0x2028, "active_energy_export_total_mWh", "mWh", 8, False),
-    (0x202C, "active_energy_import_t1_mWh", "mWh", 8, False),
-    (0x2030, "active_energy_import_t2_mWh", "mWh", 8, False),
-    (0x2034, "active_energy_export_t1_mWh", "mWh", 8, False),
-    (0x2038, "active_energy_export_t2_mWh", "mWh", 8, False),
-    (0x203C, "reactive_energy_q1_mVarh", "mVarh", 8, False),
-    (0x2040, "reactive_energy_q2_mVarh", "mVarh", 8, False),
-    (0x2044, "reactive_energy_q3_mVarh", "mVarh", 8, False),
-    (0x2048, "reactive_energy_q4_mVarh", "mVarh", 8, False),
-    (0x204C, "active_energy_import_total_Wh", "Wh", 4, False),
-    (0x204E, "active_energy_export_total_Wh", "Wh", 4, False),
-    (0x2050, "active_energy_import_t1_Wh", "Wh", 4, False),
-    (0x2052, "active_energy_import_t2_Wh", "Wh", 4, False),
-    (0x2054, "active_energy_export_t1_Wh", "Wh", 4, False),
-    (0x2056, "active_energy_export_t2_Wh", "Wh", 4, False),
-    (0x2058, "reactive_energy_q1_Varh", "Varh", 4, False),
-    (0x205A, "reactive_energy_q2_Varh", "Varh", 4, False),
-    (0x205C, "reactive_energy_q3_Varh", "Varh", 4, False),
-    (0x205E, "reactive_energy_q4_Varh", "Varh", 4, False),
-]
-
-# ----------------------------
-# Scaling rules
+# Register map and read plan (register_map.py), built-in Telstar 80A map unless a profile is set
 # ----------------------------
-SCALE_MAP = {
-    "_mW":      (lambda v: v / 1000.0, "W"),
-    "_mV":      (lambda v: v / 1000.0, "V"),
-    "_mA":      (lambda v: v / 1000.0, "A"),
-    "_mWh":     (lambda v: v / 1_000_000.0, "kWh"),
-    "_mVar":    (lambda v: v / 1000.0, "Var"),
-    "_mVarh":   (lambda v: v / 1000.0, "Varh"),
-    "_1/1000":  (lambda v: v / 1000.0, ""),
-    "_rawpf":   (lambda v: v / 1000.0, ""),
-    "Wh":       (lambda v: v / 1000.0, "kWh"),
-    "Varh":     (lambda v: v, "Varh"),
-}
+REGISTER_MAP = load_profile(REGISTER_PROFILE) if REGISTER_PROFILE else BUILTIN_MAP
+REGISTERS = REGISTER_MAP.registers
+log.info("Register map %s: %d register(s)", REGISTER_MAP.label, len(REGISTERS))
 
-def scale_value_by_name(name, raw_value, unit_label):
-    for suffix, (fn, unit) in SCALE_MAP.items():
-        if name.endswith(suffix) or unit_label == suffix.replace("_",""):
-            return fn(raw_value), unit or unit_label
-    if unit_label in ("mW", "mV", "mA", "mWh", "mVar", "mVarh", "1/1000", "Wh"):
-        key = "_" + unit_label
-        if key in SCALE_MAP:
-            fn, unit = SCALE_MAP[key]
-            return fn(raw_value), unit
-    return raw_value, unit_label
+READ_PLAN = compile_read_plan(REGISTERS, READ_MAX_GAP, READ_MAX_WORDS)
+ENTRY_CODECS = {entry.name: compile_codec(entry.size_bytes // 2, [(entry, 0)]) for entry in REGISTERS}
 
 # ----------------------------
 # Helpers
 # ----------------------------
-def combine_registers_be(regs, signed=False):
-    val = 0
-    for r in regs:
-        val = (val << 16) | (r & 0xFFFF)
-    bits = 16 * len(regs)
-    if signed:
-        sign_bit = 1 << (bits - 1)
-        if val & sign_bit:
-            val = val - (1 << bits)
-    return val
-
 def read_register_entry(client, entry):
-    addr_hex, name, unit, size_bytes, signed = entry
+    addr_hex, name, unit, size_bytes, signed = entry[:5]
     base_address = int(addr_hex)
     address = base_address + MODBUS_ADDRESS_OFFSET
     count = size_bytes // 2
     try:
-        rr = client.read_holding_registers(address, count, unit=MODBUS_UNIT_ID)
+        rr = client.read_holding_registers(address, count, slave=MODBUS_UNIT_ID)
         if rr is None:
             raise Exception("No response (None)")
         if hasattr(rr, "isError") and rr.isError():
             raise Exception(f"Modbus error reading {hex(base_address)}: {rr}")
-        regs = rr.registers
-        value_raw = combine_registers_be(regs, signed=signed)
-        return {
-            "name": name,
-            "address": hex(base_address),
-            "value_raw": value_raw,
-            "unit_raw": unit,
-            "raw_registers": regs,
-            "timestamp": int(time.time())
-        }
+        return decode_block(ENTRY_CODECS[name], rr.registers, int(time.time()))[0]
     except Exception as e:
         log.debug("Exception reading %s (%s): %s", name, hex(base_address), e)
         return None
 
+def read_block(client, block):
+    start, count, members, codec = block
+    try:
+        rr = client.read_holding_registers(start + MODBUS_ADDRESS_OFFSET, count, slave=MODBUS_UNIT_ID)
+        if rr is None:
+            raise Exception("No response (None)")
+        if hasattr(rr, "isError") and rr.isError():
+            raise Exception(f"Modbus error reading block {hex(start)}+{count}: {rr}")
+        return decode_block(codec, rr.registers, int(time.time()))
+    except Exception as e:
+        log.debug("Exception reading block %s (+%d words): %s", hex(start), count, e)
+        if len(members) > 1:
+            return [res for res in (read_register_entry(client, entry) for entry, _ in members) if res]
+        return []
+
 # ----------------------------
 # Global state for web interface
 # ----------------------------
@@ -153,6 +95,11 @@ latest_data = {
     "registers": {}
 }
 
+# ----------------------------
+# Live event stream (Server-Sent Events for /api/stream, event_stream.py)
+# ----------------------------
+EVENT_STREAM = EventStream(STREAM_BACKLOG, STREAM_KEEPALIVE)
+
 # ----------------------------
 # Flask web interface
 # ----------------------------
@@ -236,66 +183,68 @@ HTML_TEMPLATE = """
             return value;
         }
 
-        function updateData() {
-            fetch('/api/data')
-                .then(response => response.json())
-                .then(data => {
-                    // Update status
-                    const statusEl = document.getElementById('status');
-                    if (data.connection_status === 'Connected') {
-                        statusEl.className = 'mb-6 p-4 rounded-lg font-semibold bg-green-100 text-green-800 border border-green-300';
-                        statusEl.textContent = '✓ Status: Connected to Modbus';
-                    } else {
-                        statusEl.className = 'mb-6 p-4 rounded-lg font-semibold bg-red-100 text-red-800 border border-red-300';
-                        statusEl.textContent = '✗ Status: ' + data.connection_status;
-                    }
+        function render(data) {
+            // Update status
+            const statusEl = document.getElementById('status');
+            if (data.connection_status === 'Connected') {
+                statusEl.className = 'mb-6 p-4 rounded-lg font-semibold bg-green-100 text-green-800 border border-green-300';
+                statusEl.textContent = '✓ Status: Connected to Modbus';
+            } else {
+                statusEl.className = 'mb-6 p-4 rounded-lg font-semibold bg-red-100 text-red-800 border border-red-300';
+                statusEl.textContent = '✗ Status: ' + data.connection_status;
+            }
 
-                    // Update timestamp
-                    if (data.timestamp) {
-                        const date = new Date(data.timestamp * 1000);
-                        document.getElementById('timestamp').textContent =
-                            'Last update: ' + date.toLocaleString();
-                    }
+            // Update timestamp
+            if (data.timestamp) {
+                const date = new Date(data.timestamp * 1000);
+                document.getElementById('timestamp').textContent =
+                    'Last update: ' + date.toLocaleString();
+            }
 
-                    // Update content
-                    const content = document.getElementById('content');
-                    if (Object.keys(data.registers).length === 0) {
-                        content.innerHTML = '<div class="text-center py-12 text-gray-600 text-lg">No data available yet...</div>';
-                        return;
-                    }
+            // Update content
+            const content = document.getElementById('content');
+            if (Object.keys(data.registers).length === 0) {
+                content.innerHTML = '<div class="text-center py-12 text-gray-600 text-lg">No data available yet...</div>';
+                return;
+            }
 
-                    let html = '<div class="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4 mt-6">';
-                    for (const [name, info] of Object.entries(data.registers)) {
-                        const colors = getCategoryColors(name);
-                        html += `
-                            <div class="group ${colors.bg} hover:shadow-lg transition-all duration-200 p-4 rounded-lg border-l-4 ${colors.border}">
-                                <div class="font-bold ${colors.text} text-xs uppercase tracking-wide mb-2">
-                                    ${name.replace(/_/g, ' ')}
-                                </div>
-                                <div class="text-3xl font-bold text-gray-800 my-2">
-                                    ${formatValue(info.value)}
-                                    <span class="text-lg text-gray-600 ml-1">${info.unit}</span>
-                                </div>
-                                <div class="text-xs text-gray-600 mt-3 pt-3 border-t border-gray-200 space-y-1">
-                                    <div class="flex justify-between">
-                                        <span class="font-medium">Address:</span>
-                                        <span class="font-mono">${info.address}</span>
-                                    </div>
-                                    <div class="flex justify-between">
-                                        <span class="font-medium">Raw value:</span>
-                                        <span class="font-mono">${info.raw_value}</span>
-                                    </div>
-                                    <div class="flex justify-between">
-                                        <span class="font-medium">Registers:</span>
-                                        <span class="font-mono text-xs">[${info.raw_registers.join(', ')}]</span>
-                                    </div>
-                                </div>
+            let html = '<div class="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4 mt-6">';
+            for (const [name, info] of Object.entries(data.registers)) {
+                const colors = getCategoryColors(name);
+                html += `
+                    <div class="group ${colors.bg} hover:shadow-lg transition-all duration-200 p-4 rounded-lg border-l-4 ${colors.border}">
+                        <div class="font-bold ${colors.text} text-xs uppercase tracking-wide mb-2">
+                            ${name.replace(/_/g, ' ')}
+                        </div>
+                        <div class="text-3xl font-bold text-gray-800 my-2">
+                            ${formatValue(info.value)}
+                            <span class="text-lg text-gray-600 ml-1">${info.unit}</span>
+                        </div>
+                        <div class="text-xs text-gray-600 mt-3 pt-3 border-t border-gray-200 space-y-1">
+                            <div class="flex justify-between">
+                                <span class="font-medium">Address:</span>
+                                <span class="font-mono">${info.address}</span>
                             </div>
-                        `;
-                    }
-                    html += '</div>';
-                    content.innerHTML = html;
-                })
+                            <div class="flex justify-between">
+                                <span class="font-medium">Raw value:</span>
+                                <span class="font-mono">${info.raw_value}</span>
+                            </div>
+                            <div class="flex justify-between">
+                                <span class="font-medium">Registers:</span>
+                                <span class="font-mono text-xs">[${info.raw_registers.join(', ')}]</span>
+                            </div>
+                        </div>
+                    </div>
+                `;
+            }
+            html += '</div>';
+            content.innerHTML = html;
+        }
+
+        function updateData() {
+            fetch('/api/data')
+                .then(response => response.json())
+                .then(render)
                 .catch(error => {
                     console.error('Error fetching data:', error);
                     const statusEl = document.getElementById('status');
@@ -304,11 +253,38 @@ HTML_TEMPLATE = """
                 });
         }
 
-        // Initial load
-        updateData();
-
-        // Auto-refresh every 2 seconds
-        setInterval(updateData, 2000);
+        if (window.EventSource) {
+            // Live updates: a snapshot on connect, then only the registers that changed
+            const state = { timestamp: null, connection_status: 'Not connected', registers: {} };
+            const stream = new EventSource('/api/stream');
+            stream.addEventListener('snapshot', event => {
+                Object.assign(state, JSON.parse(event.data));
+                render(state);
+            });
+            stream.addEventListener('delta', event => {
+                const delta = JSON.parse(event.data);
+                Object.assign(state.registers, delta.registers);
+                state.timestamp = delta.timestamp;
+                state.connection_status = delta.connection_status;
+                render(state);
+            });
+            stream.addEventListener('status', event => {
+                state.connection_status = JSON.parse(event.data).connection_status;
+                render(state);
+            });
+            stream.onerror = () => {
+                // the browser reconnects on its own and receives a fresh snapshot
+                const statusEl = document.getElementById('status');
+                statusEl.className = 'mb-6 p-4 rounded-lg font-semibold bg-red-100 text-red-800 border border-red-300';
+                statusEl.textContent = '✗ Status: Stream disconnected, reconnecting...';
+            };
+        } else {
+            // Initial load
+            updateData();
+
+            // Auto-refresh every 2 seconds
+            setInterval(updateData, 2000);
+        }
     </script>
 </body>
 </html>
@@ -377,6 +353,12 @@ def api_topic_raw(topic_name):
     else:
         return f"Topic '{topic_name}' not found", 404
 
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: a snapshot on connect, then deltas of changed registers"""
+    return Response(EVENT_STREAM.subscribe(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ----------------------------
 # Modbus reading loop
 # ----------------------------
@@ -392,25 +374,24 @@ def modbus_loop():
                 if not client.connect():
                     log.warning("Cannot connect to Modbus %s:%s — retry in 5s", MODBUS_HOST, MODBUS_PORT)
                     latest_data["connection_status"] = f"Connection failed to {MODBUS_HOST}:{MODBUS_PORT}"
+                    EVENT_STREAM.publish_status(None, latest_data["connection_status"])
                     client.close()
                     client = None
                     time.sleep(5)
                     continue
                 log.info("Connected to Modbus %s:%s", MODBUS_HOST, MODBUS_PORT)
                 latest_data["connection_status"] = "Connected"
+                EVENT_STREAM.publish_status(None, "Connected")
 
-            results = {}
-            for entry in REGISTERS:
-                res = read_register_entry(client, entry)
-                if res is None:
-                    continue
-
-                # Scale value
-                scaled, scaled_unit = scale_value_by_name(res["name"], res["value_raw"], res["unit_raw"])
+            samples = []
+            for block in READ_PLAN:
+                samples.extend(read_block(client, block))
 
+            results = {}
+            for res in samples:
                 results[res["name"]] = {
-                    "value": scaled,
-                    "unit": scaled_unit,
+                    "value": res["value"],
+                    "unit": res["unit"],
                     "raw_value": res["value_raw"],
                     "raw_registers": res["raw_registers"],
                     "address": res["address"]
@@ -418,6 +399,7 @@ def modbus_loop():
 
             latest_data["registers"] = results
             latest_data["timestamp"] = int(time.time())
+            EVENT_STREAM.publish(None, latest_data["timestamp"], results)
 
             log.debug("Read %d registers successfully", len(results))
             time.sleep(INTERVAL)
@@ -428,6 +410,7 @@ def modbus_loop():
         except Exception as e:
             log.exception("Main loop exception: %s — reconnecting in 5s", e)
             latest_data["connection_status"] = f"Error: {str(e)}"
+            EVENT_STREAM.publish_status(None, latest_data["connection_status"])
             if client:
                 client.close()
                 client = None
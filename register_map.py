@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""register_map.py
+Register maps shared by the MQTT bridge, the debug web viewer and the meter simulator.
+
+The built-in map describes the Telstar 80A. Other meters are described by versioned JSON or
+YAML profiles (see README); a profile is validated once and compiled into block read plans and
+decoders, so the poll loops never parse anything.
+"""
+
+import re
+import json
+import struct
+import collections
+
+try:
+    import yaml
+except ImportError:  # YAML profiles are optional, JSON always works
+    yaml = None
+
+# Format version of profile files understood by this code
+PROFILE_VERSION = 1
+
+# ----------------------------
+# Register entry
+# The first five fields are the classic map columns (address, name, raw unit, size in bytes,
+# signed); the others default to the Telstar conventions: integer values, big-endian words and
+# bytes, scaling looked up in UNIT_SCALES by unit, poll interval from the bridge configuration.
+# ----------------------------
+Register = collections.namedtuple(
+    "Register", ["address", "name", "unit", "size_bytes", "signed",
+                 "divisor", "scaled_unit", "value_type", "word_order", "byte_order", "interval"],
+    defaults=(None, None, "int", "big", "big", None))
+
+# ----------------------------
+# Register mapping (from PDF)
+# Format: (address_hex, name, unit, size_bytes, signed)
+# ----------------------------
+TELSTAR_80A = [
+    (0x2000, "serial_number", "", 4, False),
+    (0x2002, "date_time_utc", "unix", 4, False),
+    (0x2004, "active_power_total_mW", "mW", 4, True),
+    (0x2006, "active_power_l1_mW", "mW", 4, True),
+    (0x2008, "active_power_l2_mW", "mW", 4, True),
+    (0x200A, "active_power_l3_mW", "mW", 4, True),
+    (0x200C, "reactive_power_total_mVar", "mVar", 4, False),
+    (0x200E, "reactive_power_l1_mVar", "mVar", 4, False),
+    (0x2010, "reactive_power_l2_mVar", "mVar", 4, False),
+    (0x2012, "reactive_power_l3_mVar", "mVar", 4, False),
+    (0x2014, "voltage_l1_mV", "mV", 4, False),
+    (0x2016, "voltage_l2_mV", "mV", 4, False),
+    (0x2018, "voltage_l3_mV", "mV", 4, False),
+    (0x201A, "current_l1_mA", "mA", 4, True),
+    (0x201C, "current_l2_mA", "mA", 4, True),
+    (0x201E, "current_l3_mA", "mA", 4, True),
+    (0x2020, "power_factor_l1_raw", "1/1000", 2, False),
+    (0x2021, "power_factor_l2_raw", "1/1000", 2, False),
+    (0x2022, "power_factor_l3_raw", "1/1000", 2, False),
+    (0x2023, "active_tariff", "", 2, False),
+    (0x2024, "active_energy_import_total_mWh", "mWh", 8, False),
+    (0x2028, "active_energy_export_total_mWh", "mWh", 8, False),
+    (0x202C, "active_energy_import_t1_mWh", "mWh", 8, False),
+    (0x2030, "active_energy_import_t2_mWh", "mWh", 8, False),
+    (0x2034, "active_energy_export_t1_mWh", "mWh", 8, False),
+    (0x2038, "active_energy_export_t2_mWh", "mWh", 8, False),
+    (0x203C, "reactive_energy_q1_mVarh", "mVarh", 8, False),
+    (0x2040, "reactive_energy_q2_mVarh", "mVarh", 8, False),
+    (0x2044, "reactive_energy_q3_mVarh", "mVarh", 8, False),
+    (0x2048, "reactive_energy_q4_mVarh", "mVarh", 8, False),
+    (0x204C, "active_energy_import_total_Wh", "Wh", 4, False),
+    (0x204E, "active_energy_export_total_Wh", "Wh", 4, False),
+    (0x2050, "active_energy_import_t1_Wh", "Wh", 4, False),
+    (0x2052, "active_energy_import_t2_Wh", "Wh", 4, False),
+    (0x2054, "active_energy_export_t1_Wh", "Wh", 4, False),
+    (0x2056, "active_energy_export_t2_Wh", "Wh", 4, False),
+    (0x2058, "reactive_energy_q1_Varh", "Varh", 4, False),
+    (0x205A, "reactive_energy_q2_Varh", "Varh", 4, False),
+    (0x205C, "reactive_energy_q3_Varh", "Varh", 4, False),
+    (0x205E, "reactive_energy_q4_Varh", "Varh", 4, False),
+]
+
+REGISTERS = [Register(*entry) for entry in TELSTAR_80A]
+
+# ----------------------------
+# Scaling rules: convert raw to human units
+# Keyed by the unit column of REGISTERS: raw unit -> (divisor, final_unit)
+# Units not listed (e.g. "", "unix", "Varh") are returned as raw integers.
+# We use: power in W (mW -> W), energy in kWh:
+#  - mWh (milli-watt-hour) -> kWh  : divide by 1_000_000
+#  - Wh -> kWh : divide by 1000
+# Rules match the unit exactly, so "Wh" and "mWh" can not shadow each other.
+# A profile register with an explicit "scale" does not use these rules.
+# ----------------------------
+UNIT_SCALES = {
+    "mW":       (1000.0, "W"),
+    "mV":       (1000.0, "V"),
+    "mA":       (1000.0, "A"),
+    # mWh -> kWh
+    "mWh":      (1_000_000.0, "kWh"),
+    # mVar -> Var
+    "mVar":     (1000.0, "Var"),
+    "mVarh":    (1000.0, "Varh"),
+    # power factor (unit label kept as published so far)
+    "1/1000":   (1000.0, "1/1000"),
+    # Wh -> kWh
+    "Wh":       (1000.0, "kWh"),
+}
+
+def scaling(entry):
+    """(divisor or None, unit of the scaled value) of a register entry"""
+    if entry.divisor is not None:
+        return entry.divisor, entry.scaled_unit
+    return UNIT_SCALES.get(entry.unit, (None, entry.unit))
+
+# ----------------------------
+# Register codec, compiled once per read block
+# Format: (block_struct, [(name, address, unit_raw, value_struct, signed, byte_offset,
+#                          word_offset, word_count, divisor, unit, order), ...])
+# Decoding packs the block into bytes once and unpacks every value from it. order is None for
+# the usual big-endian layout, else (word_order, byte_order) and the value's words are
+# rearranged first.
+# ----------------------------
+VALUE_FORMATS = {(2, False): "H", (2, True): "h", (4, False): "I", (4, True): "i", (8, False): "Q", (8, True): "q"}
+FLOAT_FORMATS = {4: "f", 8: "d"}
+
+# Profile "type" -> (size_bytes, signed, value_type)
+VALUE_TYPES = {
+    "uint16": (2, False, "int"), "int16": (2, True, "int"),
+    "uint32": (4, False, "int"), "int32": (4, True, "int"),
+    "uint64": (8, False, "int"), "int64": (8, True, "int"),
+    "float32": (4, True, "float"), "float64": (8, True, "float"),
+}
+
+def compile_codec(count, members):
+    decoders = []
+    for entry, offset in members:
+        addr_hex, name, unit, size_bytes, signed = entry[:5]
+        if entry.value_type == "float":
+            fmt = FLOAT_FORMATS[size_bytes]
+        else:
+            fmt = VALUE_FORMATS.get((size_bytes, signed))
+        divisor, final_unit = scaling(entry)
+        order = None if (entry.word_order, entry.byte_order) == ("big", "big") else (entry.word_order, entry.byte_order)
+        decoders.append((name, hex(int(addr_hex)), unit, struct.Struct(">" + fmt) if fmt else None, signed,
+                         offset * 2, offset, size_bytes // 2, divisor, final_unit, order))
+    return struct.Struct(f">{count}H"), decoders
+
+def ordered_bytes(words, word_order, byte_order):
+    """Bytes of a value in big-endian order from words sent in the device's order"""
+    if word_order == "little":
+        words = words[::-1]
+    return b"".join(word.to_bytes(2, byte_order) for word in words)
+
+def decode_block(codec, regs, timestamp):
+    block_struct, decoders = codec
+    buf = block_struct.pack(*regs)
+    samples = []
+    for (name, address, unit_raw, value_struct, signed, byte_offset, word_offset, word_count,
+         divisor, unit, order) in decoders:
+        if order is not None:
+            data = ordered_bytes(regs[word_offset:word_offset + word_count], *order)
+            value_raw = value_struct.unpack(data)[0] if value_struct else int.from_bytes(data, "big", signed=signed)
+        elif value_struct is not None:
+            value_raw = value_struct.unpack_from(buf, byte_offset)[0]
+        else:
+            # sizes without a struct format (e.g. 6 bytes)
+            value_raw = int.from_bytes(buf[byte_offset:byte_offset + 2 * word_count], "big", signed=signed)
+        samples.append({
+            "name": name,
+            "address": address,
+            "value": value_raw / divisor if divisor else value_raw,
+            "unit": unit,
+            "value_raw": value_raw,
+            "unit_raw": unit_raw,
+            "raw_registers": regs[word_offset:word_offset + word_count],
+            "timestamp": timestamp
+        })
+    return samples
+
+# ----------------------------
+# Read plan: coalesce registers into block reads
+# Format: (start_address, word_count, [(entry, word_offset), ...], codec)
+# ----------------------------
+def compile_read_plan(registers, max_gap=0, max_words=125):
+    plan = []
+    for entry in sorted(registers, key=lambda e: e[0]):
+        address, count = int(entry[0]), entry[3] // 2
+        if plan:
+            start, words, members = plan[-1]
+            gap = address - (start + words)
+            end = max(start + words, address + count)
+            if gap <= max_gap and end - start <= max_words:
+                plan[-1] = (start, end - start, members + [(entry, address - start)])
+                continue
+        plan.append((address, count, [(entry, 0)]))
+    return [(start, count, members, compile_codec(count, members)) for start, count, members in plan]
+
+# ----------------------------
+# Profiles
+# ----------------------------
+class RegisterMap:
+    """A validated register map: entries sorted by address, looked up by name."""
+
+    def __init__(self, name, registers, revision=None, source=None):
+        self.name = name
+        self.revision = revision
+        self.source = source
+        self.registers = sorted(registers, key=lambda e: e.address)
+        self.by_name = {entry.name: entry for entry in self.registers}
+        self.names = frozenset(self.by_name)
+
+    @property
+    def label(self):
+        return self.name if self.revision is None else f"{self.name} rev {self.revision}"
+
+BUILTIN_MAP = RegisterMap("telstar-80a", REGISTERS)
+
+NAME_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")  # names end up in MQTT topics and formulas
+ORDERS = ("big", "little")
+PROFILE_KEYS = {"profile_version", "name", "revision", "description", "word_order", "byte_order", "registers"}
+REGISTER_KEYS = {"name", "address", "type", "words", "signed", "unit", "scale", "scaled_unit",
+                 "word_order", "byte_order", "interval", "description"}
+
+class ProfileError(ValueError):
+    pass
+
+def parse_address(value, where):
+    try:
+        address = int(value, 0) if isinstance(value, str) else int(value)
+    except (TypeError, ValueError):
+        raise ProfileError(f"{where}: invalid address {value!r}")
+    if not 0 <= address <= 0xFFFF:
+        raise ProfileError(f"{where}: address {value!r} out of range")
+    return address
+
+def compile_register(spec, defaults, where):
+    if not isinstance(spec, dict):
+        raise ProfileError(f"{where}: expected an object")
+    unknown = set(spec) - REGISTER_KEYS
+    if unknown:
+        raise ProfileError(f"{where}: unknown key(s) {', '.join(sorted(unknown))}")
+    name = spec.get("name")
+    if not isinstance(name, str) or not NAME_PATTERN.fullmatch(name):
+        raise ProfileError(f"{where}: 'name' must be an identifier (letters, digits, _), got {name!r}")
+    where = f"{where} ({name})"
+    if "address" not in spec:
+        raise ProfileError(f"{where}: 'address' is required")
+    address = parse_address(spec["address"], where)
+    if "type" in spec:
+        if spec["type"] not in VALUE_TYPES:
+            raise ProfileError(f"{where}: unknown type {spec['type']!r} (expected one of {', '.join(VALUE_TYPES)})")
+        size_bytes, signed, value_type = VALUE_TYPES[spec["type"]]
+        if spec.get("words", size_bytes // 2) != size_bytes // 2 or spec.get("signed", signed) != signed:
+            raise ProfileError(f"{where}: 'words'/'signed' contradict type {spec['type']}")
+    else:
+        words = spec.get("words", 1)
+        if not isinstance(words, int) or not 1 <= words <= 4:
+            raise ProfileError(f"{where}: 'words' must be 1..4")
+        size_bytes, signed, value_type = 2 * words, bool(spec.get("signed", False)), "int"
+    if address + size_bytes // 2 > 0x10000:
+        raise ProfileError(f"{where}: register runs past address 0xFFFF")
+    unit = str(spec.get("unit", ""))
+    divisor = scaled_unit = None
+    if "scale" in spec:
+        scale = spec["scale"]
+        if isinstance(scale, bool) or not isinstance(scale, (int, float)) or scale == 0:
+            raise ProfileError(f"{where}: 'scale' must be a non-zero number")
+        # stored as divisor like UNIT_SCALES, so 0.001 divides by exactly 1000
+        divisor = 1.0 / scale
+        if abs(divisor - round(divisor)) < 1e-9:
+            divisor = float(round(divisor))
+        scaled_unit = str(spec.get("scaled_unit", unit))
+    elif "scaled_unit" in spec:
+        raise ProfileError(f"{where}: 'scaled_unit' needs 'scale'")
+    orders = []
+    for key in ("word_order", "byte_order"):
+        order = spec.get(key, defaults[key])
+        if order not in ORDERS:
+            raise ProfileError(f"{where}: '{key}' must be 'big' or 'little'")
+        orders.append(order)
+    interval = spec.get("interval")
+    if interval is not None and (isinstance(interval, bool) or not isinstance(interval, (int, float)) or interval < 0):
+        raise ProfileError(f"{where}: 'interval' must be a number of seconds >= 0")
+    return Register(address, name, unit, size_bytes, signed, divisor, scaled_unit, value_type, *orders,
+                    None if interval is None else float(interval))
+
+def compile_profile(data, source="<profile>"):
+    """Validate a parsed profile document and return its RegisterMap (ProfileError if invalid)"""
+    if not isinstance(data, dict):
+        raise ProfileError(f"{source}: expected an object at the top level")
+    if data.get("profile_version") != PROFILE_VERSION:
+        raise ProfileError(f"{source}: unsupported profile_version {data.get('profile_version')!r} "
+                           f"(expected {PROFILE_VERSION})")
+    unknown = set(data) - PROFILE_KEYS
+    if unknown:
+        raise ProfileError(f"{source}: unknown key(s) {', '.join(sorted(unknown))}")
+    if not isinstance(data.get("name"), str) or not data["name"]:
+        raise ProfileError(f"{source}: 'name' is required")
+    defaults = {}
+    for key in ("word_order", "byte_order"):
+        defaults[key] = data.get(key, "big")
+        if defaults[key] not in ORDERS:
+            raise ProfileError(f"{source}: '{key}' must be 'big' or 'little'")
+    specs = data.get("registers")
+    if not isinstance(specs, list) or not specs:
+        raise ProfileError(f"{source}: 'registers' must be a non-empty list")
+    registers = [compile_register(spec, defaults, f"{source}: registers[{i}]") for i, spec in enumerate(specs)]
+    seen = set()
+    for entry in registers:
+        if entry.name in seen:
+            raise ProfileError(f"{source}: register name {entry.name} is used twice")
+        seen.add(entry.name)
+    ordered = sorted(registers, key=lambda e: e.address)
+    for previous, entry in zip(ordered, ordered[1:]):
+        if entry.address < previous.address + previous.size_bytes // 2:
+            raise ProfileError(f"{source}: {entry.name} ({hex(entry.address)}) overlaps {previous.name}")
+    return RegisterMap(data["name"], registers, data.get("revision"), source)
+
+def load_profile(path):
+    """Read, validate and compile a JSON or YAML profile file"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        if yaml is None:
+            raise RuntimeError(f"{path}: YAML profiles require the 'PyYAML' package")
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ProfileError(f"{path}: invalid YAML: {e}")
+    else:
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ProfileError(f"{path}: invalid JSON: {e}")
+    return compile_profile(data, path)
@@ -0,0 +1,43 @@
+import pytest
+
+import modbus_mqtt_bridge as bridge
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(bridge, "latest_data", {"timestamp": None, "connection_status": "Connected", "registers": {}})
+    monkeypatch.setattr(bridge, "STATE_SNAPSHOT", bridge.StateSnapshot(0, bridge.latest_data))
+    return bridge.app.test_client()
+
+def update(registers, timestamp):
+    with bridge.SNAPSHOT_LOCK:
+        bridge.latest_data["registers"] = registers
+        bridge.latest_data["timestamp"] = timestamp
+        bridge.publish_snapshot()
+
+def test_data_is_encoded_once_per_version(client, monkeypatch):
+    calls = []
+    encode_json = bridge.encode_json
+    monkeypatch.setattr(bridge, "encode_json", lambda obj: calls.append(obj) or encode_json(obj))
+    for i in range(5):
+        update({"a": {"value": i}}, i)
+    assert calls == []
+    first = client.get("/api/data")
+    assert first.json["registers"] == {"a": {"value": 4}}
+    assert client.get("/api/data").data == first.data
+    assert len(calls) == 1
+
+def test_snapshot_keeps_state_of_its_version(client):
+    update({"a": {"value": 1}}, 1)
+    snapshot = bridge.STATE_SNAPSHOT
+    update({"a": {"value": 2}}, 2)
+    bridge.latest_data["connection_status"] = "Not connected"
+    assert b'"value":1' in snapshot.encode()[0] and b"Connected" in snapshot.encode()[0]
+    assert b"Not connected" not in snapshot.encode()[0]
+
+def test_etag_and_conditional_requests(client):
+    update({"a": {"value": 1}}, 1)
+    etag = client.get("/api/data").headers["ETag"]
+    assert client.get("/api/data", headers={"If-None-Match": etag}).status_code == 304
+    update({"a": {"value": 2}}, 2)
+    response = client.get("/api/data", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
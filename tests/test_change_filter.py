@@ -0,0 +1,54 @@
+import pytest
+
+from modbus_mqtt_bridge import ChangeFilter, compile_deadbands
+
+NAMES = ["active_power_total_mW", "voltage_l1_mV", "active_energy_import_total_Wh"]
+
+@pytest.fixture
+def change_filter():
+    deadbands = compile_deadbands("active_power_*=5;voltage_*=1%", NAMES)
+    return ChangeFilter(deadbands, heartbeat=60)
+
+def test_compile_deadbands():
+    deadbands = compile_deadbands("active_power_*=5;voltage_*,current_*=1%", NAMES)
+    assert deadbands == {"active_power_total_mW": (5.0, False), "voltage_l1_mV": (1.0, True),
+                         "active_energy_import_total_Wh": (0.0, False)}
+
+def test_first_value_is_always_published(change_filter):
+    assert change_filter.changed("active_power_total_mW", 100.0, now=0)
+
+def test_absolute_deadband(change_filter):
+    change_filter.changed("active_power_total_mW", 100.0, now=0)
+    assert not change_filter.changed("active_power_total_mW", 104.9, now=1)
+    assert change_filter.changed("active_power_total_mW", 105.0, now=2)
+    # measured from the last published value, not from the last sample
+    assert not change_filter.changed("active_power_total_mW", 101.0, now=3)
+    assert change_filter.changed("active_power_total_mW", 99.0, now=4)
+
+def test_percent_deadband(change_filter):
+    change_filter.changed("voltage_l1_mV", 230.0, now=0)
+    assert not change_filter.changed("voltage_l1_mV", 232.0, now=1)
+    assert change_filter.changed("voltage_l1_mV", 227.6, now=2)
+
+def test_without_deadband_only_changes_are_published(change_filter):
+    change_filter.changed("active_energy_import_total_Wh", 1000, now=0)
+    assert not change_filter.changed("active_energy_import_total_Wh", 1000, now=1)
+    assert change_filter.changed("active_energy_import_total_Wh", 1001, now=2)
+
+def test_heartbeat_republishes_silent_topic(change_filter):
+    change_filter.changed("active_power_total_mW", 100.0, now=0)
+    assert not change_filter.changed("active_power_total_mW", 100.0, now=59)
+    assert change_filter.changed("active_power_total_mW", 100.0, now=60)
+    assert not change_filter.changed("active_power_total_mW", 100.0, now=61)
+
+def test_heartbeat_disabled():
+    change_filter = ChangeFilter({"x": (0.0, False)}, heartbeat=0)
+    change_filter.changed("x", 1, now=0)
+    assert not change_filter.changed("x", 1, now=10 ** 6)
+
+def test_snapshot_due(change_filter):
+    assert change_filter.snapshot_due(False, now=0)
+    assert not change_filter.snapshot_due(False, now=30)
+    assert change_filter.snapshot_due(True, now=31)
+    assert not change_filter.snapshot_due(False, now=90)
+    assert change_filter.snapshot_due(False, now=91)
@@ -0,0 +1,59 @@
+import json
+
+from event_stream import EventStream
+
+def parse(frame):
+    fields = dict(line.split(": ", 1) for line in frame.decode("utf-8").strip().split("\n"))
+    return fields["event"], json.loads(fields["data"])
+
+def test_snapshot_then_deltas():
+    stream = EventStream(backlog=10, keepalive=0.01)
+    stream.publish_status("a", "Connected")
+    stream.publish("a", 1, {"x": 1, "y": 2})
+    client = stream.subscribe()
+    assert next(client) == b"retry: 5000\n\n"
+    event, data = parse(next(client))
+    assert event == "snapshot"
+    assert data == {"meter": "a", "timestamp": 1, "connection_status": "Connected", "registers": {"x": 1, "y": 2}}
+    stream.publish("a", 2, {"x": 1, "y": 3})
+    assert parse(next(client)) == ("delta", {"meter": "a", "timestamp": 2, "connection_status": "Connected",
+                                             "registers": {"y": 3}})
+    assert stream.clients == 1
+    client.close()
+    assert stream.clients == 0
+
+def test_unchanged_values_publish_nothing():
+    stream = EventStream()
+    stream.publish("a", 1, {"x": 1})
+    stream.publish("a", 2, {"x": 1})
+    stream.publish_status("a", None)
+    assert stream.last_id == 1
+
+def test_meter_filter():
+    stream = EventStream(keepalive=0.01)
+    stream.publish("a", 1, {"x": 1})
+    client = stream.subscribe("b")
+    next(client)
+    stream.publish("a", 2, {"x": 2})
+    stream.publish("b", 2, {"x": 3})
+    assert parse(next(client))[1]["meter"] == "b"
+    client.close()
+
+def test_keepalive():
+    stream = EventStream(keepalive=0.01)
+    client = stream.subscribe()
+    next(client)
+    assert next(client) == b": keepalive\n\n"
+    client.close()
+
+def test_client_behind_backlog_is_resynced():
+    stream = EventStream(backlog=2, keepalive=0.01)
+    stream.publish("a", 0, {"x": 0})
+    client = stream.subscribe()
+    next(client)
+    parse(next(client))
+    for timestamp in range(1, 5):
+        stream.publish("a", timestamp, {"x": timestamp})
+    event, data = parse(next(client))
+    assert (event, data["registers"]) == ("snapshot", {"x": 4})
+    client.close()
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+import modbus_mqtt_bridge as bridge
+
+PREFIX = bridge.MQTT_TOPIC_PREFIX
+
+@pytest.fixture
+def answers(monkeypatch):
+    published = []
+    monkeypatch.setattr(bridge.PUBLISH_TRACKER, "publish",
+                        lambda topic, payload, qos, retain: published.append((topic, json.loads(payload))))
+    monkeypatch.setattr(bridge, "fresh_samples", lambda names, max_age: [
+        {"name": name, "value": 1.0, "unit": "W", "value_raw": 1000, "raw_registers": [0, 1000],
+         "address": "0x2004", "timestamp": 1700000000} for name in names])
+    return published
+
+def request(**fields):
+    bridge.answer_fresh_request(json.dumps(dict(registers=["active_power_total_mW"], id=7, **fields)).encode())
+
+def test_answer_on_default_topic(answers):
+    request()
+    topic, response = answers[0]
+    assert topic == f"{PREFIX}/response"
+    assert response["id"] == 7 and response["data"]["active_power_total_mW"]["value"] == 1.0
+
+def test_answer_on_reply_to_below_prefix(answers):
+    request(reply_to=f"{PREFIX}/response/client-1")
+    assert answers[0][0] == f"{PREFIX}/response/client-1"
+
+@pytest.mark.parametrize("reply_to", ["other/topic", f"{PREFIX}", f"{PREFIX}x/response", f"{PREFIX}/#",
+                                      f"{PREFIX}/+/x", f"{PREFIX}/request", 42])
+def test_reply_to_outside_prefix_is_rejected(answers, reply_to, monkeypatch):
+    monkeypatch.setattr(bridge, "fresh_samples", lambda names, max_age: pytest.fail("meter must not be read"))
+    request(reply_to=reply_to)
+    topic, response = answers[0]
+    assert topic == f"{PREFIX}/response"
+    assert response["id"] == 7 and "reply_to" in response["error"]
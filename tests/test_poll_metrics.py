@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+
+from modbus_mqtt_bridge import ModbusReadError, check_response, error_class, percentiles
+
+class ErrorResponse:
+    def isError(self):
+        return True
+
+@pytest.mark.parametrize("error, expected", [
+    (ModbusReadError("Exception response", ExceptionResponse(0x03, 0x02)), "exception_response"),
+    (ModbusReadError("Timed out", ModbusIOException("no answer")), "timeout"),
+    (ModbusReadError("No response"), "protocol"),
+    (ModbusReadError("Malformed response"), "protocol"),
+    (ModbusReadError("Error", ErrorResponse()), "protocol"),
+    (asyncio.TimeoutError(), "timeout"),
+    (TimeoutError(), "timeout"),
+    (ModbusIOException("no answer"), "timeout"),
+    (ConnectionException("refused"), "connection"),
+    (ConnectionResetError(), "connection"),
+    (ValueError("bug"), "other"),
+])
+def test_error_class(error, expected):
+    assert error_class(error) == expected
+
+def test_check_response():
+    with pytest.raises(ModbusReadError) as error:
+        check_response(None, "0x2000+96")
+    assert error_class(error.value) == "protocol"
+    with pytest.raises(ModbusReadError) as error:
+        check_response(ExceptionResponse(0x03, 0x02), "0x2000+96")
+    assert error_class(error.value) == "exception_response"
+
+def test_percentiles():
+    assert percentiles([]) == {"count": 0}
+    assert percentiles([float(i) for i in range(101, 0, -1)]) == {"count": 101, "p50": 51.0, "p90": 91.0,
+                                                                   "p99": 100.0, "max": 101.0}
@@ -0,0 +1,97 @@
+import json
+import struct
+
+import pytest
+
+import modbus_mqtt_bridge as bridge
+from register_map import ProfileError, compile_codec, compile_profile, decode_block, load_profile
+
+README_PROFILE = """\
+profile_version: 1
+name: hutschiene-3ph
+revision: 2
+word_order: big
+registers:
+  - {name: voltage_l1_V, address: 0x0000, type: float32, unit: V}
+  - {name: active_power_total_W, address: 0x0034, type: int32, unit: W, interval: 1}
+  - {name: energy_import_kWh, address: 0x0100, type: uint32, unit: Wh, scale: 0.001, scaled_unit: kWh}
+  - {name: frequency_Hz, address: 0x0046, words: 1, unit: cHz, scale: 0.01, scaled_unit: Hz, interval: 30}
+"""
+
+def profile(*registers, **fields):
+    return dict({"profile_version": 1, "name": "test", "registers": list(registers)}, **fields)
+
+def decode(entry, words):
+    return decode_block(compile_codec(len(words), [(entry, 0)]), words, 0)[0]
+
+def test_load_yaml_profile(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "hutschiene.yaml"
+    path.write_text(README_PROFILE, encoding="utf-8")
+    regmap = load_profile(str(path))
+    assert regmap.label == "hutschiene-3ph rev 2"
+    assert [entry.name for entry in regmap.registers] == ["voltage_l1_V", "active_power_total_W", "frequency_Hz",
+                                                          "energy_import_kWh"]
+    energy = regmap.by_name["energy_import_kWh"]
+    assert (energy.divisor, energy.scaled_unit) == (1000.0, "kWh")
+    assert regmap.by_name["frequency_Hz"].interval == 30.0
+
+def test_load_json_profile(tmp_path):
+    path = tmp_path / "meter.json"
+    path.write_text(json.dumps(profile({"name": "power_W", "address": "0x10", "type": "int16"})), encoding="utf-8")
+    entry, = load_profile(str(path)).registers
+    assert (entry.address, entry.size_bytes, entry.signed) == (0x10, 2, True)
+
+def test_decode_profile_types():
+    regmap = compile_profile(profile(
+        {"name": "voltage_V", "address": 0, "type": "float32"},
+        {"name": "power_W", "address": 2, "type": "int32", "word_order": "little"},
+        {"name": "energy_kWh", "address": 4, "type": "uint32", "scale": 0.001, "scaled_unit": "kWh"},
+        {"name": "swapped", "address": 6, "words": 1, "byte_order": "little"},
+    ))
+    by_name = regmap.by_name
+    assert decode(by_name["voltage_V"], list(struct.unpack(">2H", struct.pack(">f", 230.5))))["value"] == 230.5
+    assert decode(by_name["power_W"], [0xFFFE, 0xFFFF])["value"] == -2
+    assert decode(by_name["energy_kWh"], [0x0001, 0x0000])["value"] == 65.536
+    assert decode(by_name["swapped"], [0x3412])["value"] == 0x1234
+
+@pytest.mark.parametrize("data, message", [
+    ([], "expected an object"),
+    ({"name": "x", "registers": [{"name": "a", "address": 0}]}, "unsupported profile_version"),
+    (profile({"name": "a", "address": 0}, vendor="x"), "unknown key(s) vendor"),
+    (profile(), "'registers' must be a non-empty list"),
+    (profile({"name": "a", "address": 0}, word_order="middle"), "'word_order' must be 'big' or 'little'"),
+    (profile({"name": "a-b", "address": 0}), "'name' must be an identifier"),
+    (profile({"name": "a"}), "'address' is required"),
+    (profile({"name": "a", "address": "0x1ZZ"}), "invalid address"),
+    (profile({"name": "a", "address": 0x10000}), "out of range"),
+    (profile({"name": "a", "address": 0xFFFF, "type": "uint32"}), "runs past address 0xFFFF"),
+    (profile({"name": "a", "address": 0, "type": "int24"}), "unknown type"),
+    (profile({"name": "a", "address": 0, "type": "uint32", "words": 1}), "contradict type"),
+    (profile({"name": "a", "address": 0, "words": 5}), "'words' must be 1..4"),
+    (profile({"name": "a", "address": 0, "scale": 0}), "'scale' must be a non-zero number"),
+    (profile({"name": "a", "address": 0, "scaled_unit": "kWh"}), "'scaled_unit' needs 'scale'"),
+    (profile({"name": "a", "address": 0, "interval": -1}), "'interval' must be a number"),
+    (profile({"name": "a", "address": 0, "color": "red"}), "unknown key(s) color"),
+    (profile({"name": "a", "address": 0}, {"name": "a", "address": 4}), "used twice"),
+    (profile({"name": "a", "address": 0, "type": "uint32"}, {"name": "b", "address": 1}), "overlaps a"),
+])
+def test_invalid_profiles_are_rejected(data, message):
+    with pytest.raises(ProfileError) as error:
+        compile_profile(data, "meter.json")
+    assert message in str(error.value)
+
+def test_invalid_file_syntax(tmp_path):
+    path = tmp_path / "broken.json"
+    path.write_text("{", encoding="utf-8")
+    with pytest.raises(ProfileError, match="invalid JSON"):
+        load_profile(str(path))
+
+def test_failed_reload_keeps_loaded_profiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(bridge, "PROFILE_MTIMES", dict(bridge.PROFILE_MTIMES))
+    path = tmp_path / "broken.json"
+    path.write_text(json.dumps(profile({"name": "a", "address": 0, "words": 9})), encoding="utf-8")
+    profiles = dict(bridge.PROFILES)
+    with pytest.raises(ProfileError):
+        bridge.load_profiles([str(path)])
+    assert bridge.PROFILES == profiles
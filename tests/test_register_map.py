@@ -0,0 +1,153 @@
+import random
+
+import pytest
+
+from register_map import REGISTERS, compile_codec, compile_read_plan, decode_block
+
+# One known block of the Telstar 80A map: (name, register words, scaled value, unit)
+KNOWN_BLOCK = [
+    ("serial_number", (0x04C6, 0x9640), 80123456, ""),
+    ("date_time_utc", (0x6553, 0xF100), 1700000000, "unix"),
+    ("active_power_total_mW", (0x0034, 0xBF15), 3456.789, "W"),
+    ("active_power_l1_mW", (0x0012, 0xD687), 1234.567, "W"),
+    ("active_power_l2_mW", (0xFFFC, 0x2F70), -250.0, "W"),
+    ("active_power_l3_mW", (0x0025, 0xB91E), 2472.222, "W"),
+    ("reactive_power_total_mVar", (0x0006, 0xF540), 456.0, "Var"),
+    ("reactive_power_l1_mVar", (0x0002, 0x51C0), 152.0, "Var"),
+    ("reactive_power_l2_mVar", (0x0000, 0x0000), 0.0, "Var"),
+    ("reactive_power_l3_mVar", (0x0004, 0xA380), 304.0, "Var"),
+    ("voltage_l1_mV", (0x0003, 0x82ED), 230.125, "V"),
+    ("voltage_l2_mV", (0x0003, 0x81EE), 229.87, "V"),
+    ("voltage_l3_mV", (0x0003, 0x865C), 231.004, "V"),
+    ("current_l1_mA", (0x0000, 0x14F7), 5.367, "A"),
+    ("current_l2_mA", (0xFFFF, 0xFBC0), -1.088, "A"),
+    ("current_l3_mA", (0x0000, 0x29CE), 10.702, "A"),
+    ("power_factor_l1_raw", (0x03E0,), 0.992, "1/1000"),
+    ("power_factor_l2_raw", (0x03E8,), 1.0, "1/1000"),
+    ("power_factor_l3_raw", (0x036B,), 0.875, "1/1000"),
+    ("active_tariff", (0x0002,), 2, ""),
+    ("active_energy_import_total_mWh", (0x0000, 0x0B3A, 0x73CE, 0x2FF2), 12345678.901234, "kWh"),
+    ("active_energy_export_total_mWh", (0x0000, 0x0000, 0x3ADE, 0x68B1), 987.654321, "kWh"),
+    ("active_energy_import_t1_mWh", (0x0000, 0x0746, 0xA528, 0x8000), 8000000.0, "kWh"),
+    ("active_energy_import_t2_mWh", (0x0000, 0x03F3, 0xCEA5, 0xAFF2), 4345678.901234, "kWh"),
+    ("active_energy_export_t1_mWh", (0x0000, 0x0000, 0x0000, 0x0000), 0.0, "kWh"),
+    ("active_energy_export_t2_mWh", (0x0000, 0x0000, 0x3ADE, 0x68B1), 987.654321, "kWh"),
+    ("reactive_energy_q1_mVarh", (0x0000, 0x0000, 0x2114, 0xA13B), 555000.123, "Varh"),
+    ("reactive_energy_q2_mVarh", (0x0000, 0x0000, 0x0000, 0x05DC), 1.5, "Varh"),
+    ("reactive_energy_q3_mVarh", (0x0000, 0x0000, 0x0000, 0x0000), 0.0, "Varh"),
+    ("reactive_energy_q4_mVarh", (0xFFFF, 0xFFFF, 0xFFFF, 0xFFFF), (2 ** 64 - 1) / 1000.0, "Varh"),
+    ("active_energy_import_total_Wh", (0x00BC, 0x614E), 12345.678, "kWh"),
+    ("active_energy_export_total_Wh", (0x0000, 0x03DB), 0.987, "kWh"),
+    ("active_energy_import_t1_Wh", (0x007A, 0x1200), 8000.0, "kWh"),
+    ("active_energy_import_t2_Wh", (0x0042, 0x4F4E), 4345.678, "kWh"),
+    ("active_energy_export_t1_Wh", (0x0000, 0x0000), 0.0, "kWh"),
+    ("active_energy_export_t2_Wh", (0xFFFF, 0xFFFF), 4294967.295, "kWh"),
+    ("reactive_energy_q1_Varh", (0x0008, 0x77F8), 555000, "Varh"),
+    ("reactive_energy_q2_Varh", (0x0000, 0x0001), 1, "Varh"),
+    ("reactive_energy_q3_Varh", (0x0000, 0x0000), 0, "Varh"),
+    ("reactive_energy_q4_Varh", (0x0001, 0x0000), 65536, "Varh"),
+]
+
+# ----------------------------
+# Decoding as done before the codec: big-endian word combination and suffix based scaling
+# ----------------------------
+LEGACY_SCALE_MAP = {
+    "_mW":      (lambda v: v / 1000.0, "W"),
+    "_mV":      (lambda v: v / 1000.0, "V"),
+    "_mA":      (lambda v: v / 1000.0, "A"),
+    "_mWh":     (lambda v: v / 1_000_000.0, "kWh"),
+    "_mVar":    (lambda v: v / 1000.0, "Var"),
+    "_mVarh":   (lambda v: v / 1000.0, "Varh"),
+    "_1/1000":  (lambda v: v / 1000.0, ""),
+    "_rawpf":   (lambda v: v / 1000.0, ""),
+    "Wh":       (lambda v: v / 1000.0, "kWh"),
+    "Varh":     (lambda v: v, "Varh"),
+}
+
+def legacy_scale_value_by_name(name, raw_value, unit_label):
+    for suffix, (fn, unit) in LEGACY_SCALE_MAP.items():
+        if name.endswith(suffix) or unit_label == suffix.replace("_", ""):
+            return fn(raw_value), unit or unit_label
+    if unit_label in ("mW", "mV", "mA", "mWh", "mVar", "mVarh", "1/1000", "Wh"):
+        key = "_" + unit_label
+        if key in LEGACY_SCALE_MAP:
+            fn, unit = LEGACY_SCALE_MAP[key]
+            return fn(raw_value), unit
+    return raw_value, unit_label
+
+def legacy_combine_registers_be(regs, signed=False):
+    val = 0
+    for r in regs:
+        val = (val << 16) | (r & 0xFFFF)
+    bits = 16 * len(regs)
+    if signed:
+        sign_bit = 1 << (bits - 1)
+        if val & sign_bit:
+            val = val - (1 << bits)
+    return val
+
+def legacy_decode(block_words, start):
+    decoded = {}
+    for entry in REGISTERS:
+        offset = entry.address - start
+        regs = block_words[offset:offset + entry.size_bytes // 2]
+        value_raw = legacy_combine_registers_be(regs, signed=entry.signed)
+        decoded[entry.name] = (value_raw,) + legacy_scale_value_by_name(entry.name, value_raw, entry.unit)
+    return decoded
+
+def build_block(words_by_name):
+    start = REGISTERS[0].address
+    end = max(entry.address + entry.size_bytes // 2 for entry in REGISTERS)
+    block = [0] * (end - start)
+    for entry in REGISTERS:
+        words = words_by_name[entry.name]
+        block[entry.address - start:entry.address - start + len(words)] = words
+    return block
+
+def decode_plan(plan, block, start):
+    samples = {}
+    for block_start, count, _, codec in plan:
+        offset = block_start - start
+        for res in decode_block(codec, block[offset:offset + count], 1700000000):
+            samples[res["name"]] = res
+    return samples
+
+def test_known_block_covers_the_whole_map():
+    assert [name for name, _, _, _ in KNOWN_BLOCK] == [entry.name for entry in REGISTERS]
+    for entry, (_, words, _, _) in zip(REGISTERS, KNOWN_BLOCK):
+        assert len(words) == entry.size_bytes // 2
+
+@pytest.mark.parametrize("max_words", [125, 32, 1])
+@pytest.mark.parametrize("name, words, value, unit", KNOWN_BLOCK, ids=[row[0] for row in KNOWN_BLOCK])
+def test_decode_known_block(name, words, value, unit, max_words):
+    block = build_block({row[0]: row[1] for row in KNOWN_BLOCK})
+    samples = decode_plan(compile_read_plan(REGISTERS, max_words=max_words), block, REGISTERS[0].address)
+    res = samples[name]
+    assert res["value"] == value
+    assert type(res["value"]) is type(value)
+    assert res["unit"] == unit
+    assert res["raw_registers"] == list(words)
+
+@pytest.mark.parametrize("name, words, value, unit", KNOWN_BLOCK, ids=[row[0] for row in KNOWN_BLOCK])
+def test_decode_single_register(name, words, value, unit):
+    entry = next(entry for entry in REGISTERS if entry.name == name)
+    res, = decode_block(compile_codec(len(words), [(entry, 0)]), list(words), 1700000000)
+    assert (res["value"], res["unit"], res["address"]) == (value, unit, hex(entry.address))
+
+def test_codec_matches_legacy_decoding():
+    rng = random.Random(80)
+    start = REGISTERS[0].address
+    plan = compile_read_plan(REGISTERS)
+    edge_words = (0x0000, 0x0001, 0x7FFF, 0x8000, 0xFFFE, 0xFFFF)
+    mismatches = []
+    for i in range(2000):
+        if i < 200:
+            block = [rng.choice(edge_words) for _ in range(plan[0][1])]
+        else:
+            block = [rng.randrange(0x10000) for _ in range(plan[0][1])]
+        samples = decode_plan(plan, block, start)
+        for name, (value_raw, value, unit) in legacy_decode(block, start).items():
+            res = samples[name]
+            if (res["value_raw"], res["value"], type(res["value"]), res["unit"]) != (value_raw, value, type(value), unit):
+                mismatches.append((name, block, res["value"], value))
+    assert not mismatches, f"{len(mismatches)} mismatch(es), first: {mismatches[0]}"
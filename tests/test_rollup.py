@@ -0,0 +1,72 @@
+import types
+
+import pytest
+
+import modbus_mqtt_bridge as bridge
+from modbus_mqtt_bridge import RollupWindow, window_name
+
+ENERGY = "active_energy_import_total_Wh"
+POWER = "active_power_total_mW"
+
+@pytest.fixture(autouse=True)
+def rollup_names(monkeypatch):
+    monkeypatch.setattr(bridge, "ROLLUP_NAMES", frozenset({ENERGY, POWER}))
+
+def batch(timestamp, **values):
+    return types.SimpleNamespace(timestamp=timestamp, samples=[{"name": name, "value": value}
+                                                               for name, value in values.items()])
+
+def test_window_name():
+    assert [window_name(s) for s in (30, 60, 900, 3600, 5400)] == ["30s", "1m", "15m", "1h", "90m"]
+
+def test_statistics_of_a_window():
+    window = RollupWindow(60)
+    for timestamp, power in ((120, 10.0), (130, 30.0), (150, 20.0)):
+        assert window.add(batch(timestamp, active_power_total_mW=power)) is None
+    result = window.result()
+    assert (result["window"], result["start"], result["end"]) == ("1m", 120, 180)
+    assert result["data"][POWER] == {"min": 10.0, "max": 30.0, "avg": 20.0, "count": 3, "first": 10.0, "last": 20.0}
+
+def test_unselected_registers_are_ignored():
+    window = RollupWindow(60)
+    window.add(batch(0, voltage_l1_mV=230.0, active_power_total_mW=1.0))
+    assert list(window.result()["data"]) == [POWER]
+
+def test_first_sample_of_next_window_closes_it():
+    window = RollupWindow(60)
+    window.add(batch(0, active_power_total_mW=1.0))
+    window.add(batch(59, active_power_total_mW=2.0))
+    closed = window.add(batch(60, active_power_total_mW=3.0))
+    assert (closed["start"], closed["data"][POWER]["count"]) == (0, 2)
+    last, current = window.results()
+    assert last is closed
+    assert (current["start"], current["data"][POWER]["count"]) == (60, 1)
+
+def test_delta_starts_at_previous_window():
+    window = RollupWindow(60)
+    window.add(batch(50, active_energy_import_total_Wh=1000))
+    closed = window.add(batch(110, active_energy_import_total_Wh=1004))
+    # no reading before the first window: nothing to measure from
+    assert "delta" not in closed["data"][ENERGY]
+    window.add(batch(115, active_energy_import_total_Wh=1005))
+    closed = window.add(batch(170, active_energy_import_total_Wh=1010))
+    # energy between 1000 (t=50) and the last reading of the window (t=115)
+    assert closed["data"][ENERGY]["delta"] == 5
+    assert window.result()["data"][ENERGY]["delta"] == 5
+
+def test_delta_with_one_sample_per_window():
+    window = RollupWindow(60)
+    deltas = []
+    for minute, energy in enumerate((100, 103, 107, 107, 112)):
+        closed = window.add(batch(minute * 60, active_energy_import_total_Wh=energy))
+        if closed is not None:
+            deltas.append(closed["data"][ENERGY].get("delta"))
+    assert deltas == [None, 3, 4, 0]
+
+def test_delta_spans_windows_without_samples():
+    window = RollupWindow(60)
+    window.add(batch(0, active_energy_import_total_Wh=100, active_power_total_mW=1.0))
+    window.add(batch(60, active_power_total_mW=1.0))
+    window.add(batch(120, active_energy_import_total_Wh=110))
+    closed = window.add(batch(180, active_energy_import_total_Wh=111))
+    assert closed["data"][ENERGY]["delta"] == 10
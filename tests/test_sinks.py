@@ -0,0 +1,30 @@
+import pytest
+
+import modbus_mqtt_bridge as bridge
+
+@pytest.fixture
+def sinks(monkeypatch):
+    handler = lambda batch: None
+    monkeypatch.setattr(bridge, "SINKS", {"mqtt": (handler, "drop-oldest"), "state": (handler, "coalesce-latest"),
+                                          "store": (handler, "block")})
+    monkeypatch.setattr(bridge, "SINK_WORKERS", [])
+
+def policies(spec, monkeypatch):
+    monkeypatch.setattr(bridge, "SINK_POLICIES", spec)
+    bridge.start_sinks()
+    return {worker.name: worker.policy for worker in bridge.SINK_WORKERS}
+
+def test_defaults(sinks, monkeypatch):
+    assert policies("", monkeypatch) == {"mqtt": "drop-oldest", "state": "coalesce-latest", "store": "block"}
+
+def test_every_pattern_of_an_entry_applies(sinks, monkeypatch):
+    assert policies("mqtt,store=coalesce-latest", monkeypatch) == {
+        "mqtt": "coalesce-latest", "state": "coalesce-latest", "store": "coalesce-latest"}
+
+def test_first_matching_entry_wins(sinks, monkeypatch):
+    assert policies("mqtt=block;*=drop-oldest", monkeypatch) == {
+        "mqtt": "block", "state": "drop-oldest", "store": "drop-oldest"}
+
+def test_unknown_policy(sinks, monkeypatch):
+    with pytest.raises(ValueError, match="Unknown sink policy for mqtt"):
+        policies("mqtt,state=drop-newest", monkeypatch)
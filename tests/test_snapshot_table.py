@@ -0,0 +1,92 @@
+import math
+import multiprocessing
+
+import pytest
+
+from modbus_mqtt_bridge import SnapshotTable
+
+COLUMNS = ["voltage_l1_mV", "active_power_total_mW", "active_energy_import_total_mWh"]
+
+def sample(name, value, raw, words):
+    return {"name": name, "value": value, "value_raw": raw, "raw_registers": words}
+
+@pytest.fixture
+def table():
+    table = SnapshotTable(3, COLUMNS)
+    yield table
+    table.close()
+
+def test_empty_row(table):
+    seq, timestamp, status, cells = table.read(1, 0)
+    assert (seq, timestamp, status, cells) == (0, 0.0, "", [])
+
+def test_write_and_read_row(table):
+    table.write(1, 1700000000, [sample("voltage_l1_mV", 230.125, 230125, [3, 0x82ED]),
+                                sample("active_energy_import_total_mWh", 12345.678901234, 12345678901234,
+                                       [0, 0x0B3A, 0x73CE, 0x2FF2]),
+                                sample("not_in_table", 1.0, 1, [1])])
+    seq, timestamp, status, cells = table.read(1, 0)
+    assert seq == 2 and timestamp == 1700000000
+    assert cells == [("voltage_l1_mV", 230.125, 230125.0, [3, 0x82ED, 0, 0]),
+                     ("active_energy_import_total_mWh", 12345.678901234, 12345678901234.0, [0, 0x0B3A, 0x73CE, 0x2FF2])]
+    # other rows are untouched
+    assert table.read(0, 0)[3] == [] and table.read(2, 0)[3] == []
+
+def test_read_only_returns_cells_written_since(table):
+    table.write(0, 1, [sample("voltage_l1_mV", 230.0, 230000, [3, 0]),
+                       sample("active_power_total_mW", 1.5, 1500, [0, 1500])])
+    seen = table.read(0, 0)[0]
+    table.write(0, 2, [sample("active_power_total_mW", 2.5, 2500, [0, 2500])])
+    seq, timestamp, _, cells = table.read(0, seen)
+    assert seq > seen and timestamp == 2
+    assert [(name, value) for name, value, _, _ in cells] == [("active_power_total_mW", 2.5)]
+
+def test_missing_raw_value_is_nan(table):
+    table.write(0, 1, [sample("active_power_total_mW", 1.5, None, [])])
+    assert math.isnan(table.read(0, 0)[3][0][2])
+
+def test_status(table):
+    table.write_status(2, "Connected")
+    seq, _, status, cells = table.read(2, 0)
+    assert (seq, status, cells) == (2, "Connected", [])
+    table.write_status(2, "x" * 500)
+    assert table.read(2, 0)[2] == "x" * SnapshotTable.STATUS_BYTES
+
+def test_row_being_written_is_not_read(table):
+    table.write(0, 1, [sample("voltage_l1_mV", 230.0, 230000, [3, 0])])
+    table.seq[0] += 1  # odd: writer in progress (or died mid-write)
+    assert table.read(0, 0) is None
+    assert table.read_stats(0) is None
+    table.write(0, 2, [sample("voltage_l1_mV", 231.0, 231000, [3, 1000])])
+    assert table.read(0, 0)[3][0][1] == 231.0
+
+def test_stats(table):
+    assert table.read_stats(0) is None
+    stats = {"shard": 0, "poll": {"errors": {"timeout": {"0x2000+96": 2}}}}
+    assert table.write_stats(0, stats)
+    assert table.read_stats(0) == stats
+    # stats do not show up as changed cells
+    assert table.read(0, 0)[3] == []
+
+def test_oversized_stats_keep_error_totals(table):
+    blocks = {hex(0x2000 + i): 1 for i in range(2000)}
+    assert table.write_stats(1, {"shard": 0, "poll": {"errors": {"timeout": blocks}}})
+    assert table.read_stats(1)["poll"]["errors"] == {"timeout": {"*": 2000}}
+
+def write_from_child(name, rows, columns):
+    table = SnapshotTable(rows, columns, name)
+    try:
+        table.write(1, 42, [sample("active_power_total_mW", -250.0, -250000, [0xFFFC, 0x2F70])])
+        table.write_status(1, "Connected")
+    finally:
+        table.close()
+
+def test_rows_are_shared_between_processes(table):
+    process = multiprocessing.get_context("spawn").Process(target=write_from_child,
+                                                           args=(table.name, table.rows, table.columns))
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+    seq, timestamp, status, cells = table.read(1, 0)
+    assert (timestamp, status) == (42, "Connected")
+    assert cells == [("active_power_total_mW", -250.0, -250000.0, [0xFFFC, 0x2F70, 0, 0])]
@@ -0,0 +1,102 @@
+import os
+import time
+import types
+
+import pytest
+
+import modbus_mqtt_bridge as bridge
+from modbus_mqtt_bridge import MqttSpool
+
+class StopReplay(BaseException):
+    pass
+
+def make_spool(directory, max_bytes=1 << 20, segment_bytes=1 << 16):
+    return MqttSpool(str(directory), max_bytes, segment_bytes, fsync_interval=0)
+
+def drain(spool):
+    messages = []
+    while True:
+        item = spool.peek()
+        if item is None:
+            return messages
+        messages.append(item[:4])
+        spool.commit(item[4])
+
+def test_replays_in_order_with_payload_and_flags(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append("meter/a", "1", 0, False)
+    spool.append("meter/b", b"\x00\x01", 1, True)
+    assert spool.pending()
+    assert drain(spool) == [("meter/a", b"1", 0, False), ("meter/b", b"\x00\x01", 1, True)]
+    assert not spool.pending()
+
+def test_uncommitted_message_is_peeked_again(tmp_path):
+    spool = make_spool(tmp_path)
+    spool.append("meter/a", "1", 0, False)
+    assert spool.peek()[:2] == ("meter/a", b"1")
+    assert spool.peek()[:2] == ("meter/a", b"1")
+
+def test_restart_resumes_at_committed_position(tmp_path):
+    spool = make_spool(tmp_path)
+    for i in range(3):
+        spool.append("meter/t", str(i), 0, False)
+    spool.commit(spool.peek()[4])
+    restarted = make_spool(tmp_path)
+    assert [payload for _, payload, _, _ in drain(restarted)] == [b"1", b"2"]
+
+def test_size_cap_drops_oldest_segment(tmp_path):
+    spool = make_spool(tmp_path, max_bytes=400, segment_bytes=100)
+    for i in range(20):
+        spool.append("meter/t", f"{i:02d}" * 10, 0, False)
+    payloads = [payload for _, payload, _, _ in drain(spool)]
+    assert payloads == [f"{i:02d}".encode() * 10 for i in range(20 - len(payloads), 20)]
+    assert 0 < len(payloads) < 20
+    assert sum(os.path.getsize(tmp_path / f) for f in os.listdir(tmp_path) if f.endswith(".log")) <= 400
+
+def test_torn_write_skips_rest_of_segment(tmp_path):
+    spool = make_spool(tmp_path, segment_bytes=20)
+    spool.append("meter/a", "first", 0, False)
+    spool.append("meter/b", "second", 0, False)   # rotates into a new segment
+    spool.sync()
+    first = tmp_path / f"spool-{0:012d}.log"
+    with open(first, "ab") as f:
+        f.write(b"\x00\x00\x00\x10garbage")        # record cut short by a crash
+    restarted = make_spool(tmp_path, segment_bytes=20)
+    assert [topic for topic, _, _, _ in drain(restarted)] == ["meter/a", "meter/b"]
+
+def test_publish_queues_behind_backlog(tmp_path, monkeypatch):
+    spool = make_spool(tmp_path)
+    published = []
+    monkeypatch.setattr(bridge, "MQTT_SPOOL", spool)
+    monkeypatch.setattr(bridge.mqtt_client, "is_connected", lambda: True)
+    monkeypatch.setattr(bridge.PUBLISH_TRACKER, "publish", lambda *args: published.append(args))
+    spool.append("meter/old", "0", 0, False)
+    bridge.mqtt_publish("meter/new", "1")
+    assert published == []
+    assert [topic for topic, _, _, _ in drain(spool)] == ["meter/old", "meter/new"]
+
+def test_replay_loop_commits_only_acknowledged_messages(tmp_path, monkeypatch):
+    spool = make_spool(tmp_path)
+    spool.append("meter/a", "1", 1, False)
+    spool.append("meter/b", "2", 1, False)
+    acks = iter([False, True, True])
+    sent = []
+
+    def publish(topic, payload, qos, retain):
+        sent.append(topic)
+        acked = next(acks)
+        return types.SimpleNamespace(rc=bridge.mqtt.MQTT_ERR_SUCCESS, wait_for_publish=lambda timeout: None,
+                                     is_published=lambda: acked)
+
+    def sleep(seconds):
+        if not spool.pending():
+            raise StopReplay()
+
+    monkeypatch.setattr(bridge, "MQTT_SPOOL", spool)
+    monkeypatch.setattr(bridge.mqtt_client, "is_connected", lambda: True)
+    monkeypatch.setattr(bridge.PUBLISH_TRACKER, "publish", publish)
+    monkeypatch.setattr(time, "sleep", sleep)
+    with pytest.raises(StopReplay):
+        bridge.spool_replay_loop()
+    assert sent == ["meter/a", "meter/a", "meter/b"]
+    assert spool.peek() is None
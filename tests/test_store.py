@@ -0,0 +1,62 @@
+import types
+
+import pytest
+
+from modbus_mqtt_bridge import SampleStore
+
+NAME = "active_power_total_mW"
+
+def store(path, step=60):
+    return SampleStore(str(path), {NAME}, flush_interval=1, retention=7, step=step, step_retention=730)
+
+def add(store, meter, timestamps):
+    store.add(types.SimpleNamespace(meter=meter, samples=[{"name": NAME, "timestamp": ts, "value": float(ts)}
+                                                          for ts in timestamps]))
+    store.flush()
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "store.db"
+
+def test_raw_and_downsampled_queries(path):
+    db = store(path)
+    add(db, "a", range(0, 300, 10))
+    raw = db.query("a", NAME, since=100, until=130)
+    assert raw == {"source": "raw", "timestamps": [100, 110, 120, 130], "values": [100.0, 110.0, 120.0, 130.0]}
+    db.roll_up(now=400)
+    rolled = db.query("a", NAME, step=120)
+    assert rolled["source"] == "rollup"
+    assert rolled["timestamps"] == [0, 120, 240]
+    assert rolled["count"] == [12, 12, 6]
+    assert rolled["min"] == [0.0, 120.0, 240.0] and rolled["max"] == [110.0, 230.0, 290.0]
+    assert db.query("b", NAME) is None
+    assert db.names_of("a") == [NAME]
+
+def test_roll_up_is_incremental(path):
+    db = store(path)
+    add(db, "a", range(0, 60, 10))
+    db.roll_up(now=61)   # bucket 0 is not complete yet with late samples allowed for
+    assert db.query("a", NAME, step=60)["count"] == []
+    add(db, "a", range(60, 120, 10))
+    db.roll_up(now=125)
+    assert db.query("a", NAME, step=60)["count"] == [6, 6]
+    add(db, "a", range(120, 180, 10))
+    db.roll_up(now=185)
+    assert db.query("a", NAME, step=60)["count"] == [6, 6, 6]
+
+def test_processes_sharing_a_store_roll_up_their_own_series(path):
+    first, second = store(path), store(path)
+    add(first, "a", range(0, 300, 10))
+    first.roll_up(now=200)
+    # created after the other store loaded its series, written before its next run
+    add(second, "b", range(0, 300, 10))
+    second.roll_up(now=400)
+    first.roll_up(now=400)
+    for meter in ("a", "b"):
+        assert first.query(meter, NAME, step=60)["count"] == [6, 6, 6, 6, 6]
+
+def test_prune_sees_series_of_other_processes(path):
+    first, second = store(path), store(path)
+    add(second, "b", [0, 10, 10 ** 6])
+    first.prune(now=10 ** 6)
+    assert first.query("b", NAME)["timestamps"] == [10 ** 6]